@@ -5,12 +5,19 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
 from .auth import admin_required
 from datetime import datetime
-import bcrypt
-import random
 from . import database as db
+from . import lottery_engine
+from . import batch_assign
+from . import csv_import
+from .csv_import import parse_priority_weight
+from .selection_windows import get_selection_windows
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
 
+def wants_dry_run():
+    """True when an import request only asks to validate the file (dry_run=1)."""
+    return request.values.get('dry_run', '').lower() in ('1', 'true', 'yes')
+
 # Helper functions to convert database rows to dictionaries
 def user_to_dict(user):
     return {
@@ -18,6 +25,7 @@ def user_to_dict(user):
         'username': user['username'],
         'name': user['name'],
         'is_admin': bool(user['is_admin']),
+        'priority_weight': user['priority_weight'],
         'created_at': user['created_at']
     }
 
@@ -164,6 +172,8 @@ def delete_user(user_id):
     try:
         with db.get_db_connection() as conn:
             c = conn.cursor()
+            c.execute('DELETE FROM roommate_group_members WHERE user_id = ?', (user_id,))
+            c.execute('DELETE FROM room_preferences WHERE user_id = ?', (user_id,))
             c.execute('DELETE FROM users WHERE id = ?', (user_id,))
         return jsonify({'message': '用户删除成功'}), 200
     except Exception as e:
@@ -185,7 +195,7 @@ def reset_user_password(user_id):
         return jsonify({'error': '密码长度不能少于6位'}), 400
     
     try:
-        password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = db.hash_password(new_password)
         with db.get_db_connection() as conn:
             c = conn.cursor()
             c.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
@@ -193,6 +203,169 @@ def reset_user_password(user_id):
     except Exception as e:
         return jsonify({'error': '密码重置失败'}), 500
 
+@admin_bp.route('/users/<int:user_id>/priority-weight', methods=['PUT'])
+@admin_required
+def update_user_priority_weight(user_id):
+    user = db.get_user_by_id(user_id)
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    data = request.get_json()
+    if not data or 'priority_weight' not in data:
+        return jsonify({'error': '优先权重不能为空'}), 400
+    
+    try:
+        priority_weight = parse_priority_weight(data['priority_weight'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        with db.get_db_connection() as conn:
+            conn.execute('UPDATE users SET priority_weight = ? WHERE id = ?', (priority_weight, user_id))
+        return jsonify({'message': '优先权重更新成功', 'priority_weight': priority_weight}), 200
+    except Exception as e:
+        return jsonify({'error': '优先权重更新失败'}), 500
+
+@admin_bp.route('/users/priority-weights/import', methods=['POST'])
+@admin_required
+def import_priority_weights():
+    if 'file' not in request.files:
+        return jsonify({'error': '没有文件被上传'}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': '没有选择文件'}), 400
+    
+    if not file.filename.endswith('.csv'):
+        return jsonify({'error': '只支持CSV文件'}), 400
+    
+    try:
+        file_content = file.read()
+        try:
+            content = file_content.decode('utf-8')
+        except UnicodeDecodeError:
+            content = file_content.decode('gbk')
+        
+        df = pd.read_csv(io.StringIO(content), dtype=str)
+        
+        if not all(col in df.columns for col in ['username', 'priority_weight']):
+            return jsonify({'error': 'CSV文件必须包含username和priority_weight列'}), 400
+        
+        # 一次查询得到用户名到ID的映射
+        conn = db.get_db()
+        user_ids = {row['username']: row['id'] for row in conn.execute('SELECT id, username FROM users WHERE is_admin = 0')}
+        conn.close()
+        
+        updates = []
+        errors = []
+        for index, username, weight in zip(df.index, df['username'], df['priority_weight']):
+            username = username.strip() if isinstance(username, str) else ''
+            if username not in user_ids:
+                errors.append(f"第{index+2}行: 用户 {username} 不存在")
+                continue
+            try:
+                updates.append((parse_priority_weight(weight), user_ids[username]))
+            except ValueError as e:
+                errors.append(f"第{index+2}行: {str(e)}")
+        
+        with db.get_db_connection() as conn:
+            conn.executemany('UPDATE users SET priority_weight = ? WHERE id = ?', updates)
+        
+        return jsonify({
+            'message': f'导入完成：成功 {len(updates)} 个，失败 {len(errors)} 个',
+            'success_count': len(updates),
+            'error_count': len(errors),
+            'errors': errors[:10]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'文件处理失败: {str(e)}'}), 500
+
+# 室友组管理
+@admin_bp.route('/roommate-groups', methods=['GET'])
+@admin_required
+def get_roommate_groups():
+    conn = db.get_db()
+    c = conn.cursor()
+    c.execute('''
+        SELECT g.id as group_id, g.name as group_name, g.created_at,
+               u.id as user_id, u.username, u.name
+        FROM roommate_groups g
+        LEFT JOIN roommate_group_members m ON m.group_id = g.id
+        LEFT JOIN users u ON m.user_id = u.id
+        ORDER BY g.id, u.id
+    ''')
+    groups = {}
+    for row in c.fetchall():
+        group = groups.setdefault(row['group_id'], {
+            'id': row['group_id'],
+            'name': row['group_name'],
+            'created_at': row['created_at'],
+            'members': []
+        })
+        if row['user_id'] is not None:
+            group['members'].append({'id': row['user_id'], 'username': row['username'], 'name': row['name']})
+    conn.close()
+    
+    return jsonify({'groups': list(groups.values())}), 200
+
+@admin_bp.route('/roommate-groups', methods=['POST'])
+@admin_required
+def create_roommate_group():
+    current_user_id = get_jwt_identity()
+    data = request.get_json()
+    if not data or not data.get('name') or not data.get('usernames'):
+        return jsonify({'error': '组名和成员不能为空'}), 400
+    
+    name = str(data['name']).strip()
+    usernames = list(dict.fromkeys(str(u).strip() for u in data['usernames'] if str(u).strip()))
+    if not 2 <= len(usernames) <= 6:
+        return jsonify({'error': '室友组成员必须为2到6人'}), 400
+    
+    try:
+        with db.get_db_connection() as conn:
+            c = conn.cursor()
+            placeholders = ','.join('?' * len(usernames))
+            c.execute(f'''
+                SELECT u.id, u.username, m.group_id FROM users u
+                LEFT JOIN roommate_group_members m ON m.user_id = u.id
+                WHERE u.is_admin = 0 AND u.username IN ({placeholders})
+            ''', usernames)
+            users = {row['username']: row for row in c.fetchall()}
+            
+            missing = [u for u in usernames if u not in users]
+            if missing:
+                return jsonify({'error': f"用户不存在: {', '.join(missing)}"}), 400
+            grouped = [u for u in usernames if users[u]['group_id'] is not None]
+            if grouped:
+                return jsonify({'error': f"用户已在其他室友组中: {', '.join(grouped)}"}), 400
+            
+            c.execute('INSERT INTO roommate_groups (name, created_by) VALUES (?, ?)', (name, current_user_id))
+            group_id = c.lastrowid
+            c.executemany(
+                'INSERT INTO roommate_group_members (group_id, user_id) VALUES (?, ?)',
+                [(group_id, users[u]['id']) for u in usernames]
+            )
+        
+        return jsonify({'message': '室友组创建成功', 'group_id': group_id}), 201
+    except Exception as e:
+        return jsonify({'error': '室友组创建失败'}), 500
+
+@admin_bp.route('/roommate-groups/<int:group_id>', methods=['DELETE'])
+@admin_required
+def delete_roommate_group(group_id):
+    try:
+        with db.get_db_connection() as conn:
+            c = conn.cursor()
+            c.execute('DELETE FROM roommate_group_members WHERE group_id = ?', (group_id,))
+            c.execute('DELETE FROM roommate_groups WHERE id = ?', (group_id,))
+            if c.rowcount == 0:
+                return jsonify({'error': '室友组不存在'}), 404
+        
+        return jsonify({'message': '室友组删除成功'}), 200
+    except Exception as e:
+        return jsonify({'error': '室友组删除失败'}), 500
+
 @admin_bp.route('/users', methods=['POST'])
 @admin_required
 def create_user():
@@ -214,11 +387,16 @@ def create_user():
     if len(password) < 6:
         return jsonify({'error': '密码长度不能少于6位'}), 400
     
+    try:
+        priority_weight = parse_priority_weight(data.get('priority_weight', 1))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     if db.get_user_by_username(username):
         return jsonify({'error': '用户名已存在'}), 409
     
     try:
-        user_id = db.create_user(username, password, name)
+        user_id = db.create_user(username, password, name, priority_weight=priority_weight)
         return jsonify({'message': '用户创建成功', 'user_id': user_id}), 201
     except Exception as e:
         return jsonify({'error': '用户创建失败'}), 500
@@ -237,66 +415,12 @@ def import_users():
         return jsonify({'error': '只支持CSV文件'}), 400
     
     try:
-        # 尝试不同的编码格式读取CSV文件
-        file_content = file.read()
-        try:
-            content = file_content.decode('utf-8')
-        except UnicodeDecodeError:
-            try:
-                content = file_content.decode('gbk')
-            except UnicodeDecodeError:
-                content = file_content.decode('latin-1')
-        
-        df = pd.read_csv(io.StringIO(content))
-        
-        required_columns = ['username', 'name', 'password']
-        if not all(col in df.columns for col in required_columns):
-            return jsonify({'error': 'CSV文件必须包含username、name和password列'}), 400
-        
-        success_count = 0
-        error_count = 0
-        errors = []
-        
-        for index, row in df.iterrows():
-            try:
-                # Handle NaN values from pandas
-                username = str(row['username']).strip() if pd.notna(row['username']) else ''
-                name = str(row['name']).strip() if pd.notna(row['name']) else ''
-                password = str(row['password']).strip() if pd.notna(row['password']) else ''
-                
-                # Check if username, name, and password are not empty
-                if not username or not name or not password or username == 'nan' or name == 'nan' or password == 'nan':
-                    error_count += 1
-                    errors.append(f"第{index+2}行: 用户名、姓名和密码不能为空")
-                    continue
-                
-                # Basic validation for username
-                if len(username) < 3:
-                    error_count += 1
-                    errors.append(f"第{index+2}行: 用户名 {username} 长度至少3个字符")
-                    continue
-                
-                # Check if user exists using database function
-                if db.get_user_by_username(username):
-                    error_count += 1
-                    errors.append(f"第{index+2}行: 用户名 {username} 已存在")
-                    continue
-                
-                # Create user using database function
-                db.create_user(username, password, name)
-                success_count += 1
-                
-            except Exception as e:
-                error_count += 1
-                errors.append(f"第{index+2}行: {str(e)}")
-        
-        return jsonify({
-            'message': f'导入完成：成功 {success_count} 个，失败 {error_count} 个',
-            'success_count': success_count,
-            'error_count': error_count,
-            'errors': errors[:10]  # 只返回前10个错误
-        }), 200
-        
+        if wants_dry_run():
+            return jsonify(csv_import.dry_run('users', file)), 200
+        report = csv_import.import_users(file)
+        return jsonify(report.to_dict()), 200
+    except csv_import.ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'文件处理失败: {str(e)}'}), 500
 
@@ -342,7 +466,18 @@ def get_lottery_results():
     if not lottery:
         return jsonify({'error': '没有活动的抽签'}), 404
     
-    results = db.get_lottery_results(lottery['id'])
+    conn = db.get_db()
+    with lottery_engine.merged_results(conn) as results_table:
+        c = conn.cursor()
+        c.execute(f'''
+            SELECT lr.*, u.name as user_name, u.username
+            FROM {results_table} lr
+            JOIN users u ON lr.user_id = u.id
+            WHERE lr.lottery_id = ?
+            ORDER BY lr.lottery_number
+        ''', (lottery['id'],))
+        results = c.fetchall()
+    conn.close()
     
     return jsonify({
         'results': [lottery_result_to_dict(r) for r in results],
@@ -362,27 +497,19 @@ def generate_lottery_results():
     try:
         # Get all non-admin users
         conn = db.get_db()
-        c = conn.cursor()
-        c.execute('SELECT id FROM users WHERE is_admin = 0')
-        users = c.fetchall()
+        user_ids = lottery_engine.load_participants(conn)
         conn.close()
         
-        # Shuffle users
-        user_ids = [u['id'] for u in users]
-        random.shuffle(user_ids)
-        
         # Save results
+        group_size = 4 if lottery['room_type'] == '4' else 8
         with db.get_db_connection() as conn:
-            c = conn.cursor()
             # Clear existing results
-            c.execute('DELETE FROM lottery_results WHERE lottery_id = ?', (lottery['id'],))
+            conn.execute('DELETE FROM lottery_results WHERE lottery_id = ?', (lottery['id'],))
             
             # Insert new results
-            for i, user_id in enumerate(user_ids):
-                group_number = (i // 4) + 1 if lottery['room_type'] == '4' else (i // 8) + 1
-                db.save_lottery_result(user_id, lottery['id'], i + 1, group_number)
+            lottery_engine.draw(conn, lottery['id'], user_ids, [(None, len(user_ids), group_size, None)])
         
-        return jsonify({'message': '抽签结果生成成功', 'total': len(users)}), 200
+        return jsonify({'message': '抽签结果生成成功', 'total': len(user_ids)}), 200
         
     except Exception as e:
         return jsonify({'error': f'生成失败: {str(e)}'}), 500
@@ -430,6 +557,7 @@ def delete_building(building_id):
                 return jsonify({'error': f'无法删除建筑，该建筑下还有 {room_count} 个房间，请先删除所有房间'}), 400
             
             # Delete the building
+            c.execute('DELETE FROM room_preferences WHERE building_id = ?', (building_id,))
             c.execute('DELETE FROM buildings WHERE id = ?', (building_id,))
         
         return jsonify({'message': '建筑删除成功'}), 200
@@ -519,57 +647,12 @@ def import_rooms():
         return jsonify({'error': '只支持CSV文件'}), 400
     
     try:
-        df = pd.read_csv(io.StringIO(file.read().decode('utf-8')))
-        
-        required_columns = ['building_name', 'room_number', 'room_type', 'max_capacity']
-        if not all(col in df.columns for col in required_columns):
-            return jsonify({'error': 'CSV文件必须包含building_name、room_number、room_type和max_capacity列'}), 400
-        
-        success_count = 0
-        error_count = 0
-        errors = []
-        
-        with db.get_db_connection() as conn:
-            c = conn.cursor()
-            
-            for index, row in df.iterrows():
-                try:
-                    building_name = str(row['building_name']).strip()
-                    room_number = str(row['room_number']).strip()
-                    room_type = str(row['room_type']).strip()
-                    max_capacity = int(row['max_capacity'])
-                    
-                    # Get building by name
-                    c.execute('SELECT id FROM buildings WHERE name = ?', (building_name,))
-                    building = c.fetchone()
-                    if not building:
-                        error_count += 1
-                        errors.append(f"第{index+2}行: 楼栋 {building_name} 不存在")
-                        continue
-                    
-                    # Check if room already exists
-                    c.execute('SELECT id FROM rooms WHERE building_id = ? AND room_number = ?', 
-                             (building['id'], room_number))
-                    if c.fetchone():
-                        error_count += 1
-                        errors.append(f"第{index+2}行: 房间 {building_name}-{room_number} 已存在")
-                        continue
-                    
-                    # Create room
-                    db.create_room(building['id'], room_number, room_type, max_capacity)
-                    success_count += 1
-                    
-                except Exception as e:
-                    error_count += 1
-                    errors.append(f"第{index+2}行: {str(e)}")
-        
-        return jsonify({
-            'message': f'导入完成：成功 {success_count} 个，失败 {error_count} 个',
-            'success_count': success_count,
-            'error_count': error_count,
-            'errors': errors[:10]
-        }), 200
-        
+        if wants_dry_run():
+            return jsonify(csv_import.dry_run('rooms', file)), 200
+        report = csv_import.import_rooms(file)
+        return jsonify(report.to_dict()), 200
+    except csv_import.ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'文件处理失败: {str(e)}'}), 500
 
@@ -650,6 +733,7 @@ def update_room(room_id):
             if update_fields:
                 update_params.append(room_id)
                 c.execute(f'UPDATE rooms SET {", ".join(update_fields)} WHERE id = ?', update_params)
+                db.record_inventory_change(conn, ('refresh_room', room_id))
         
         return jsonify({'message': '房间更新成功'}), 200
     except Exception as e:
@@ -700,11 +784,15 @@ def delete_room(room_id):
             # 3. Delete any remaining room selections for this room (should be 0 based on check above)
             c.execute('DELETE FROM room_selections WHERE room_id = ?', (room_id,))
             
-            # 4. Delete beds (this will also clean up any remaining bed references)
+            # 4. Delete room preferences that point at this room
+            c.execute('DELETE FROM room_preferences WHERE room_id = ?', (room_id,))
+            
+            # 5. Delete beds (this will also clean up any remaining bed references)
             c.execute('DELETE FROM beds WHERE room_id = ?', (room_id,))
             
-            # 5. Finally delete the room
+            # 6. Finally delete the room
             c.execute('DELETE FROM rooms WHERE id = ?', (room_id,))
+            db.record_inventory_change(conn, ('delete_room', room_id))
             
             # Prepare success message
             message = '房间删除成功'
@@ -787,52 +875,53 @@ def get_room_type_allocations():
     search = request.args.get('search', '')
     
     conn = db.get_db()
-    c = conn.cursor()
-    
-    # Combined query to get both manual allocations and lottery results
-    base_query = '''
-        SELECT 
-            u.id as user_id,
-            u.name as user_name, 
-            u.username,
-            COALESCE(rta.room_type, lr.room_type, ls.room_type) as room_type,
-            COALESCE(rta.allocated_at, lr.created_at) as allocated_at,
-            COALESCE(a.name, '抽签系统') as allocator_name,
-            COALESCE(rta.notes, '通过抽签获得') as notes,
-            COALESCE(rta.id, lr.id) as id,
-            rta.allocated_by as allocated_by,
-            CASE WHEN rta.id IS NOT NULL THEN 'manual' ELSE 'lottery' END as allocation_type
-        FROM users u
-        LEFT JOIN room_type_allocations rta ON u.id = rta.user_id
-        LEFT JOIN lottery_results lr ON u.id = lr.user_id
-        LEFT JOIN lottery_settings ls ON lr.lottery_id = ls.id AND ls.is_published = 1
-        LEFT JOIN users a ON rta.allocated_by = a.id
-        WHERE u.is_admin = 0 
-        AND (rta.user_id IS NOT NULL OR lr.user_id IS NOT NULL)
-        AND COALESCE(rta.room_type, lr.room_type, ls.room_type) IS NOT NULL
-    '''
-    
-    # Add search filter if provided
-    params = []
-    if search:
-        base_query += ' AND (u.name LIKE ? OR u.username LIKE ?)'
-        params.extend([f'%{search}%', f'%{search}%'])
-    
-    # Get total count
-    count_query = f'SELECT COUNT(*) as total FROM ({base_query}) as filtered'
-    if params:
-        c.execute(count_query, params)
-    else:
-        c.execute(count_query)
-    total = c.fetchone()['total']
-    
-    # Add pagination
-    base_query += ' ORDER BY allocated_at DESC LIMIT ? OFFSET ?'
-    offset = (page - 1) * per_page
-    params.extend([per_page, offset])
-    
-    c.execute(base_query, params)
-    allocations = c.fetchall()
+    with lottery_engine.merged_results(conn) as results_table:
+        c = conn.cursor()
+        
+        # Combined query to get both manual allocations and lottery results
+        base_query = f'''
+            SELECT 
+                u.id as user_id,
+                u.name as user_name, 
+                u.username,
+                COALESCE(rta.room_type, lr.room_type, ls.room_type) as room_type,
+                COALESCE(rta.allocated_at, lr.created_at) as allocated_at,
+                COALESCE(a.name, '抽签系统') as allocator_name,
+                COALESCE(rta.notes, '通过抽签获得') as notes,
+                COALESCE(rta.id, lr.id) as id,
+                rta.allocated_by as allocated_by,
+                CASE WHEN rta.id IS NOT NULL THEN 'manual' ELSE 'lottery' END as allocation_type
+            FROM users u
+            LEFT JOIN room_type_allocations rta ON u.id = rta.user_id
+            LEFT JOIN {results_table} lr ON u.id = lr.user_id
+            LEFT JOIN lottery_settings ls ON lr.lottery_id = ls.id AND ls.is_published = 1
+            LEFT JOIN users a ON rta.allocated_by = a.id
+            WHERE u.is_admin = 0 
+            AND (rta.user_id IS NOT NULL OR lr.user_id IS NOT NULL)
+            AND COALESCE(rta.room_type, lr.room_type, ls.room_type) IS NOT NULL
+        '''
+        
+        # Add search filter if provided
+        params = []
+        if search:
+            base_query += ' AND (u.name LIKE ? OR u.username LIKE ?)'
+            params.extend([f'%{search}%', f'%{search}%'])
+        
+        # Get total count
+        count_query = f'SELECT COUNT(*) as total FROM ({base_query}) as filtered'
+        if params:
+            c.execute(count_query, params)
+        else:
+            c.execute(count_query)
+        total = c.fetchone()['total']
+        
+        # Add pagination
+        base_query += ' ORDER BY allocated_at DESC LIMIT ? OFFSET ?'
+        offset = (page - 1) * per_page
+        params.extend([per_page, offset])
+        
+        c.execute(base_query, params)
+        allocations = c.fetchall()
     conn.close()
     
     pages = (total + per_page - 1) // per_page
@@ -897,58 +986,12 @@ def import_room_type_allocations():
     current_user_id = get_jwt_identity()
     
     try:
-        df = pd.read_csv(io.StringIO(file.read().decode('utf-8')))
-        
-        required_columns = ['username', 'room_type']
-        if not all(col in df.columns for col in required_columns):
-            return jsonify({'error': 'CSV文件必须包含username和room_type列'}), 400
-        
-        success_count = 0
-        error_count = 0
-        errors = []
-        
-        with db.get_db_connection() as conn:
-            c = conn.cursor()
-            
-            for index, row in df.iterrows():
-                try:
-                    username = str(row['username']).strip()
-                    room_type = str(row['room_type']).strip()
-                    
-                    if room_type not in ['4', '8']:
-                        error_count += 1
-                        errors.append(f"第{index+2}行: 房间类型必须是4或8")
-                        continue
-                    
-                    # Get user by username (exclude admin users)
-                    c.execute('SELECT id, is_admin FROM users WHERE username = ?', (username,))
-                    user = c.fetchone()
-                    if not user:
-                        error_count += 1
-                        errors.append(f"第{index+2}行: 用户名 {username} 不存在")
-                        continue
-                    
-                    if user['is_admin']:
-                        error_count += 1
-                        errors.append(f"第{index+2}行: 不能为管理员用户 {username} 分配房间类型")
-                        continue
-                    
-                    # Allocate room type
-                    notes = row['notes'] if 'notes' in df.columns and pd.notna(row['notes']) else None
-                    db.allocate_room_type(user['id'], room_type, current_user_id, notes)
-                    success_count += 1
-                    
-                except Exception as e:
-                    error_count += 1
-                    errors.append(f"第{index+2}行: {str(e)}")
-        
-        return jsonify({
-            'message': f'导入完成：成功 {success_count} 个，失败 {error_count} 个',
-            'success_count': success_count,
-            'error_count': error_count,
-            'errors': errors[:10]
-        }), 200
-        
+        if wants_dry_run():
+            return jsonify(csv_import.dry_run('room_type_allocations', file)), 200
+        report = csv_import.import_room_type_allocations(file, current_user_id)
+        return jsonify(report.to_dict()), 200
+    except csv_import.ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'文件处理失败: {str(e)}'}), 500
 
@@ -980,84 +1023,85 @@ def get_statistics():
 def get_detailed_statistics():
     """获取详细的分配统计信息"""
     conn = db.get_db()
-    c = conn.cursor()
-    
-    stats = {}
-    
-    # 总用户数（非管理员）
-    c.execute('SELECT COUNT(*) as total FROM users WHERE is_admin = 0')
-    stats['total_users'] = c.fetchone()['total']
-    
-    # 房间类型分配统计
-    c.execute('''
-        SELECT COUNT(*) as total FROM users u
-        WHERE u.is_admin = 0 
-        AND (u.id IN (SELECT user_id FROM room_type_allocations)
-             OR u.id IN (SELECT user_id FROM lottery_results lr 
-                         JOIN lottery_settings ls ON lr.lottery_id = ls.id 
-                         WHERE ls.is_published = 1))
-    ''')
-    stats['room_type_allocated_users'] = c.fetchone()['total']
-    
-    # 未分配房间类型的用户数
-    stats['room_type_unallocated_users'] = stats['total_users'] - stats['room_type_allocated_users']
-    
-    # 具体房间分配统计
-    c.execute('SELECT COUNT(*) as total FROM room_selections')
-    stats['room_allocated_users'] = c.fetchone()['total']
-    
-    # 未分配具体房间的用户数
-    stats['room_unallocated_users'] = stats['total_users'] - stats['room_allocated_users']
-    
-    # 已确认分配的用户数
-    c.execute('SELECT COUNT(*) as total FROM room_selections WHERE is_confirmed = 1')
-    stats['confirmed_users'] = c.fetchone()['total']
-    
-    # 未确认分配的用户数
-    stats['unconfirmed_users'] = stats['room_allocated_users'] - stats['confirmed_users']
-    
-    # 分配到4人间的人数
-    c.execute('''
-        SELECT COUNT(*) as total FROM users u
-        WHERE u.is_admin = 0 
-        AND (
-            (u.id IN (SELECT user_id FROM room_type_allocations WHERE room_type = '4'))
-            OR 
-            (u.id IN (SELECT user_id FROM lottery_results lr 
-                      JOIN lottery_settings ls ON lr.lottery_id = ls.id 
-                      WHERE ls.is_published = 1 AND (lr.room_type = '4' OR ls.room_type = '4')))
-        )
-    ''')
-    stats['room_4_users'] = c.fetchone()['total']
-    
-    # 分配到8人间的人数
-    c.execute('''
-        SELECT COUNT(*) as total FROM users u
-        WHERE u.is_admin = 0 
-        AND (
-            (u.id IN (SELECT user_id FROM room_type_allocations WHERE room_type = '8'))
-            OR 
-            (u.id IN (SELECT user_id FROM lottery_results lr 
-                      JOIN lottery_settings ls ON lr.lottery_id = ls.id 
-                      WHERE ls.is_published = 1 AND (lr.room_type = '8' OR ls.room_type = '8')))
-        )
-    ''')
-    stats['room_8_users'] = c.fetchone()['total']
-    
-    # 房间占用统计
-    c.execute('SELECT COUNT(*) as total FROM beds WHERE is_occupied = 1')
-    stats['occupied_beds'] = c.fetchone()['total']
-    
-    c.execute('SELECT COUNT(*) as total FROM beds')
-    stats['total_beds'] = c.fetchone()['total']
-    
-    stats['available_beds'] = stats['total_beds'] - stats['occupied_beds']
-    
-    # 按房间类型统计房间数
-    c.execute('SELECT room_type, COUNT(*) as count FROM rooms GROUP BY room_type')
-    room_type_counts = c.fetchall()
-    stats['room_counts'] = {str(row['room_type']): row['count'] for row in room_type_counts}
-    
+    with lottery_engine.merged_results(conn) as results_table:
+        c = conn.cursor()
+        
+        stats = {}
+        
+        # 总用户数（非管理员）
+        c.execute('SELECT COUNT(*) as total FROM users WHERE is_admin = 0')
+        stats['total_users'] = c.fetchone()['total']
+        
+        # 房间类型分配统计
+        c.execute(f'''
+            SELECT COUNT(*) as total FROM users u
+            WHERE u.is_admin = 0 
+            AND (u.id IN (SELECT user_id FROM room_type_allocations)
+                 OR u.id IN (SELECT user_id FROM {results_table} lr 
+                             JOIN lottery_settings ls ON lr.lottery_id = ls.id 
+                             WHERE ls.is_published = 1))
+        ''')
+        stats['room_type_allocated_users'] = c.fetchone()['total']
+        
+        # 未分配房间类型的用户数
+        stats['room_type_unallocated_users'] = stats['total_users'] - stats['room_type_allocated_users']
+        
+        # 具体房间分配统计
+        c.execute('SELECT COUNT(*) as total FROM room_selections')
+        stats['room_allocated_users'] = c.fetchone()['total']
+        
+        # 未分配具体房间的用户数
+        stats['room_unallocated_users'] = stats['total_users'] - stats['room_allocated_users']
+        
+        # 已确认分配的用户数
+        c.execute('SELECT COUNT(*) as total FROM room_selections WHERE is_confirmed = 1')
+        stats['confirmed_users'] = c.fetchone()['total']
+        
+        # 未确认分配的用户数
+        stats['unconfirmed_users'] = stats['room_allocated_users'] - stats['confirmed_users']
+        
+        # 分配到4人间的人数
+        c.execute(f'''
+            SELECT COUNT(*) as total FROM users u
+            WHERE u.is_admin = 0 
+            AND (
+                (u.id IN (SELECT user_id FROM room_type_allocations WHERE room_type = '4'))
+                OR 
+                (u.id IN (SELECT user_id FROM {results_table} lr 
+                          JOIN lottery_settings ls ON lr.lottery_id = ls.id 
+                          WHERE ls.is_published = 1 AND (lr.room_type = '4' OR ls.room_type = '4')))
+            )
+        ''')
+        stats['room_4_users'] = c.fetchone()['total']
+        
+        # 分配到8人间的人数
+        c.execute(f'''
+            SELECT COUNT(*) as total FROM users u
+            WHERE u.is_admin = 0 
+            AND (
+                (u.id IN (SELECT user_id FROM room_type_allocations WHERE room_type = '8'))
+                OR 
+                (u.id IN (SELECT user_id FROM {results_table} lr 
+                          JOIN lottery_settings ls ON lr.lottery_id = ls.id 
+                          WHERE ls.is_published = 1 AND (lr.room_type = '8' OR ls.room_type = '8')))
+            )
+        ''')
+        stats['room_8_users'] = c.fetchone()['total']
+        
+        # 房间占用统计
+        c.execute('SELECT COUNT(*) as total FROM beds WHERE is_occupied = 1')
+        stats['occupied_beds'] = c.fetchone()['total']
+        
+        c.execute('SELECT COUNT(*) as total FROM beds')
+        stats['total_beds'] = c.fetchone()['total']
+        
+        stats['available_beds'] = stats['total_beds'] - stats['occupied_beds']
+        
+        # 按房间类型统计房间数
+        c.execute('SELECT room_type, COUNT(*) as count FROM rooms GROUP BY room_type')
+        room_type_counts = c.fetchall()
+        stats['room_counts'] = {str(row['room_type']): row['count'] for row in room_type_counts}
+        
     conn.close()
     
     return jsonify({'statistics': stats}), 200
@@ -1071,43 +1115,44 @@ def export_allocations():
         from io import BytesIO
         
         conn = db.get_db()
-        c = conn.cursor()
-        
-        # 获取所有用户的完整分配信息
-        c.execute('''
-            SELECT 
-                u.id,
-                u.username,
-                u.name,
-                COALESCE(rta.room_type, lr.room_type, ls.room_type) as allocated_room_type,
-                CASE 
-                    WHEN rta.id IS NOT NULL THEN '手动分配'
-                    WHEN lr.id IS NOT NULL THEN '抽签分配'
-                    ELSE '未分配'
-                END as allocation_method,
-                lr.lottery_number,
-                rs.id as has_room_selection,
-                rs.is_confirmed,
-                r.room_number,
-                b_name.name as building_name,
-                bd.bed_number,
-                rta.allocated_at as room_type_allocated_at,
-                lr.created_at as lottery_allocated_at,
-                rs.selected_at as room_selected_at,
-                rta.notes
-            FROM users u
-            LEFT JOIN room_type_allocations rta ON u.id = rta.user_id
-            LEFT JOIN lottery_results lr ON u.id = lr.user_id
-            LEFT JOIN lottery_settings ls ON lr.lottery_id = ls.id AND ls.is_published = 1
-            LEFT JOIN room_selections rs ON u.id = rs.user_id
-            LEFT JOIN rooms r ON rs.room_id = r.id
-            LEFT JOIN buildings b_name ON r.building_id = b_name.id
-            LEFT JOIN beds bd ON rs.bed_id = bd.id
-            WHERE u.is_admin = 0
-            ORDER BY u.id
-        ''')
-        
-        allocations = c.fetchall()
+        with lottery_engine.merged_results(conn) as results_table:
+            c = conn.cursor()
+            
+            # 获取所有用户的完整分配信息
+            c.execute(f'''
+                SELECT 
+                    u.id,
+                    u.username,
+                    u.name,
+                    COALESCE(rta.room_type, lr.room_type, ls.room_type) as allocated_room_type,
+                    CASE 
+                        WHEN rta.id IS NOT NULL THEN '手动分配'
+                        WHEN lr.id IS NOT NULL THEN '抽签分配'
+                        ELSE '未分配'
+                    END as allocation_method,
+                    lr.lottery_number,
+                    rs.id as has_room_selection,
+                    rs.is_confirmed,
+                    r.room_number,
+                    b_name.name as building_name,
+                    bd.bed_number,
+                    rta.allocated_at as room_type_allocated_at,
+                    lr.created_at as lottery_allocated_at,
+                    rs.selected_at as room_selected_at,
+                    rta.notes
+                FROM users u
+                LEFT JOIN room_type_allocations rta ON u.id = rta.user_id
+                LEFT JOIN {results_table} lr ON u.id = lr.user_id
+                LEFT JOIN lottery_settings ls ON lr.lottery_id = ls.id AND ls.is_published = 1
+                LEFT JOIN room_selections rs ON u.id = rs.user_id
+                LEFT JOIN rooms r ON rs.room_id = r.id
+                LEFT JOIN buildings b_name ON r.building_id = b_name.id
+                LEFT JOIN beds bd ON rs.bed_id = bd.id
+                WHERE u.is_admin = 0
+                ORDER BY u.id
+            ''')
+            
+            allocations = c.fetchall()
         conn.close()
         
         # 转换为DataFrame
@@ -1213,65 +1258,35 @@ def quick_lottery_draw():
             data.get('room_type', 'mixed')  # 混合类型
         )
         
-        # 获取所有非管理员用户
+        # 获取所有非管理员用户及其优先权重
         conn = db.get_db()
-        c = conn.cursor()
-        c.execute('SELECT id FROM users WHERE is_admin = 0')
-        users = c.fetchall()
+        user_ids, weights = lottery_engine.load_participants(conn, with_weights=True)
         conn.close()
+        if not data.get('use_priority_weights', True):
+            weights = None
         
-        if not users:
+        if len(user_ids) == 0:
             return jsonify({'error': '没有可参与抽签的用户'}), 400
         
-        # 打乱用户顺序
-        import random
-        user_ids = [user['id'] for user in users]
-        random.shuffle(user_ids)
+        # 计算实际需要分配的人数
+        total_room_4_users = room_4_count * 4 if room_4_count != 999999 else 0
+        total_room_8_users = room_6_count * 8 if room_6_count != 999999 else 0
         
-        # 计算分配
-        total_4_beds = room_4_count * 4 if room_4_count != 999999 else len(user_ids)
-        total_6_beds = room_6_count * 6 if room_6_count != 999999 else len(user_ids)
+        # 如果是单一房间类型模式
+        if room_4_count == 999999:
+            total_room_4_users = len(user_ids)
+            total_room_8_users = 0
+        elif room_6_count == 999999:
+            total_room_4_users = 0
+            total_room_8_users = len(user_ids)
         
         with db.get_db_connection() as conn:
-            c = conn.cursor()
-            
-            allocated_users = 0
-            room_4_users = 0
-            room_8_users = 0
-            
-            # 计算实际需要分配的人数
-            total_room_4_users = room_4_count * 4 if room_4_count != 999999 else 0
-            total_room_8_users = room_6_count * 8 if room_6_count != 999999 else 0
-            
-            # 如果是单一房间类型模式
-            if room_4_count == 999999:
-                total_room_4_users = len(user_ids)
-                total_room_8_users = 0
-            elif room_6_count == 999999:
-                total_room_4_users = 0
-                total_room_8_users = len(user_ids)
-            
-            # 分配四人间
-            if total_room_4_users > 0:
-                actual_4_users = min(total_room_4_users, len(user_ids) - allocated_users)
-                for i in range(actual_4_users):
-                    c.execute(
-                        'INSERT INTO lottery_results (user_id, lottery_id, lottery_number, room_type) VALUES (?, ?, ?, ?)',
-                        (user_ids[allocated_users + i], lottery_id, allocated_users + i + 1, '4')
-                    )
-                    room_4_users += 1
-                allocated_users += actual_4_users
-            
-            # 分配八人间
-            if total_room_8_users > 0 and allocated_users < len(user_ids):
-                actual_8_users = min(total_room_8_users, len(user_ids) - allocated_users)
-                for i in range(actual_8_users):
-                    c.execute(
-                        'INSERT INTO lottery_results (user_id, lottery_id, lottery_number, room_type) VALUES (?, ?, ?, ?)',
-                        (user_ids[allocated_users + i], lottery_id, allocated_users + i + 1, '8')
-                    )
-                    room_8_users += 1
-                allocated_users += actual_8_users
+            # 先分配四人间，再分配八人间
+            room_4_users, room_8_users = lottery_engine.draw(conn, lottery_id, user_ids, [
+                ('4', total_room_4_users, None, None),
+                ('8', total_room_8_users, None, None),
+            ], weights=weights)
+        allocated_users = room_4_users + room_8_users
         
         return jsonify({
             'message': '抽签生成成功',
@@ -1290,6 +1305,7 @@ def quick_lottery_draw():
 def publish_lottery_results(lottery_id):
     try:
         db.publish_lottery(lottery_id)
+        get_selection_windows().invalidate()
         return jsonify({'message': '抽签结果已发布'}), 200
     except Exception as e:
         return jsonify({'error': f'发布失败: {str(e)}'}), 500
@@ -1302,61 +1318,94 @@ def delete_lottery_results(lottery_id):
             c = conn.cursor()
             # 删除抽签结果
             c.execute('DELETE FROM lottery_results WHERE lottery_id = ?', (lottery_id,))
+            c.execute('DELETE FROM lottery_draws WHERE lottery_id = ?', (lottery_id,))
             # 删除抽签设置
             c.execute('DELETE FROM lottery_settings WHERE id = ?', (lottery_id,))
+        get_selection_windows().invalidate()
         
         return jsonify({'message': '抽签结果已删除'}), 200
     except Exception as e:
         return jsonify({'error': f'删除失败: {str(e)}'}), 500
 
-@admin_bp.route('/lottery/results', methods=['GET'])
+@admin_bp.route('/lottery/<int:lottery_id>/batch-assign', methods=['POST'])
 @admin_required
-def get_all_lottery_results():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
-    lottery_id = request.args.get('lottery_id', type=int)
+def batch_assign_beds(lottery_id):
+    current_user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
     
     conn = db.get_db()
     c = conn.cursor()
+    c.execute('SELECT is_published FROM lottery_settings WHERE id = ?', (lottery_id,))
+    lottery = c.fetchone()
+    conn.close()
     
-    base_query = '''
-        SELECT lr.*, u.name as user_name, u.username,
-               ls.lottery_name, ls.is_published
-        FROM lottery_results lr
-        JOIN users u ON lr.user_id = u.id
-        JOIN lottery_settings ls ON lr.lottery_id = ls.id
-    '''
-    
-    if lottery_id:
-        base_query += ' WHERE lr.lottery_id = ?'
-        params = (lottery_id,)
-    else:
-        params = ()
-    
-    base_query += ' ORDER BY lr.lottery_number'
-    
-    # 分页
-    offset = (page - 1) * per_page
-    if params:
-        c.execute(base_query + ' LIMIT ? OFFSET ?', params + (per_page, offset))
-    else:
-        c.execute(base_query + ' LIMIT ? OFFSET ?', (per_page, offset))
+    if not lottery:
+        return jsonify({'error': '抽签不存在'}), 404
     
-    results = c.fetchall()
+    if not lottery['is_published']:
+        return jsonify({'error': '抽签结果尚未公布'}), 400
     
-    # 获取总数
-    count_query = '''
-        SELECT COUNT(*) as total
-        FROM lottery_results lr
-        JOIN lottery_settings ls ON lr.lottery_id = ls.id
-    '''
-    if lottery_id:
-        count_query += ' WHERE lr.lottery_id = ?'
-        c.execute(count_query, (lottery_id,))
-    else:
-        c.execute(count_query)
+    try:
+        # 按抽签号顺序依次满足每位学生的志愿，一个事务内写入全部分配
+        summary = batch_assign.assign_beds(lottery_id, operated_by=current_user_id,
+                                           dry_run=bool(data.get('dry_run', False)))
+        message = '批量分配预览完成' if summary['dry_run'] else '批量分配完成'
+        return jsonify({
+            'message': f"{message}：分配 {summary['assigned']} 人，未分配 {summary['unassigned']} 人",
+            **summary
+        }), 200
+    except Exception as e:
+        return jsonify({'error': f'批量分配失败: {str(e)}'}), 500
+
+@admin_bp.route('/lottery/results', methods=['GET'])
+@admin_required
+def get_all_lottery_results():
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    lottery_id = request.args.get('lottery_id', type=int)
     
-    total = c.fetchone()['total']
+    conn = db.get_db()
+    with lottery_engine.merged_results(conn) as results_table:
+        c = conn.cursor()
+        
+        base_query = f'''
+            SELECT lr.*, u.name as user_name, u.username,
+                   ls.lottery_name, ls.is_published
+            FROM {results_table} lr
+            JOIN users u ON lr.user_id = u.id
+            JOIN lottery_settings ls ON lr.lottery_id = ls.id
+        '''
+        
+        if lottery_id:
+            base_query += ' WHERE lr.lottery_id = ?'
+            params = (lottery_id,)
+        else:
+            params = ()
+        
+        base_query += ' ORDER BY lr.lottery_number'
+        
+        # 分页
+        offset = (page - 1) * per_page
+        if params:
+            c.execute(base_query + ' LIMIT ? OFFSET ?', params + (per_page, offset))
+        else:
+            c.execute(base_query + ' LIMIT ? OFFSET ?', (per_page, offset))
+        
+        results = c.fetchall()
+        
+        # 获取总数
+        count_query = f'''
+            SELECT COUNT(*) as total
+            FROM {results_table} lr
+            JOIN lottery_settings ls ON lr.lottery_id = ls.id
+        '''
+        if lottery_id:
+            count_query += ' WHERE lr.lottery_id = ?'
+            c.execute(count_query, (lottery_id,))
+        else:
+            c.execute(count_query)
+        
+        total = c.fetchone()['total']
     conn.close()
     
     pages = (total + per_page - 1) // per_page
@@ -1508,7 +1557,7 @@ def update_allocation(allocation_id):
             c = conn.cursor()
             
             # Check if allocation exists
-            c.execute('SELECT rs.*, u.is_admin FROM room_selections rs JOIN users u ON rs.user_id = u.id WHERE rs.id = ?', (allocation_id,))
+            c.execute('SELECT rs.*, u.is_admin, u.name as user_name FROM room_selections rs JOIN users u ON rs.user_id = u.id WHERE rs.id = ?', (allocation_id,))
             allocation = c.fetchone()
             if not allocation:
                 return jsonify({'error': '分配记录不存在'}), 404
@@ -1568,6 +1617,12 @@ def update_allocation(allocation_id):
                     INSERT INTO allocation_history (user_id, room_id, bed_id, action, operated_by, notes)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (allocation['user_id'], new_bed['room_id'], new_bed_id, 'modified', current_user_id, '管理员修改分配'))
+                
+                db.record_inventory_change(
+                    conn,
+                    ('release', old_bed_id, old_room_id),
+                    ('occupy', new_bed_id, new_bed['room_id'], allocation['user_id'], allocation['user_name'])
+                )
             
             # Update confirmation status
             if 'is_confirmed' in data:
@@ -1578,7 +1633,7 @@ def update_allocation(allocation_id):
     except Exception as e:
         return jsonify({'error': '更新失败'}), 500
 
-@admin_bp.route('/lottery/results/<int:result_id>', methods=['PUT'])
+@admin_bp.route('/lottery/results/<int(signed=True):result_id>', methods=['PUT'])
 @admin_required
 def update_lottery_result(result_id):
     data = request.get_json()
@@ -1589,6 +1644,9 @@ def update_lottery_result(result_id):
         with db.get_db_connection() as conn:
             c = conn.cursor()
             
+            # A result of a compact draw: write that draw out as rows first
+            result_id = lottery_engine.materialize_result(conn, result_id)
+            
             # Check if lottery result exists
             c.execute('SELECT * FROM lottery_results WHERE id = ?', (result_id,))
             result = c.fetchone()
@@ -1619,6 +1677,7 @@ def update_lottery_result(result_id):
             if update_fields:
                 update_params.append(result_id)
                 c.execute(f'UPDATE lottery_results SET {", ".join(update_fields)} WHERE id = ?', update_params)
+                db.on_commit(conn, get_selection_windows().invalidate)
                 
                 # Prepare success message
                 if is_published:
@@ -1,12 +1,21 @@
 import os
-from flask import Flask, render_template, send_from_directory
+from flask import Flask, render_template, request, send_from_directory
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from config import config
 from . import database as db
+from . import locks
+from . import selection_engine
+from . import availability
+from . import room_events
+from . import lottery_engine
+from . import selection_windows
+from . import sql_profile
+from . import metrics
+from . import password_hashing
 from .auth import auth_bp
 from .admin import admin_bp
-from .lottery import lottery_bp
+from .lottery import lottery_bp, ROOM_STREAM_SCOPE
 from .room_selection import room_selection_bp
 
 def create_app(config_name=None):
@@ -20,11 +29,27 @@ def create_app(config_name=None):
     app.config.from_object(config[config_name])
     
     # Initialize database
+    password_hashing.init_app(app)
+    db.init_app(app)
     with app.app_context():
         db.init_db()
+    locks.init_app(app)
+    selection_engine.init_app(app)
+    availability.init_app(app)
+    room_events.init_app(app)
+    lottery_engine.init_app(app)
+    selection_windows.init_app(app)
+    sql_profile.init_app(app)
+    metrics.init_app(app)
     
     jwt = JWTManager(app)
     
+    @jwt.token_verification_loader
+    def check_token_scope(jwt_header, jwt_data):
+        # 推送令牌会出现在 URL 和访问日志中：只允许用于推送接口，推送接口也只接受推送令牌
+        is_stream_token = jwt_data.get('scope') == ROOM_STREAM_SCOPE
+        return is_stream_token == (request.endpoint == 'lottery.stream_rooms')
+    
     CORS(app, origins=['http://localhost:5000', 'http://127.0.0.1:5000'])
     
     app.register_blueprint(auth_bp)
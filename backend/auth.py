@@ -31,6 +31,13 @@ def login():
     if not user or not db.check_password(user, password):
         return jsonify({'error': '用户名或密码错误'}), 401
     
+    # Move the stored hash to the configured bcrypt cost while we have the password
+    if db.needs_rehash(user['password_hash']):
+        try:
+            db.rehash_password(user, password)
+        except Exception:
+            pass
+    
     access_token = create_access_token(identity=user['id'])
     
     return jsonify({
@@ -111,8 +118,7 @@ def change_password():
         return jsonify({'error': '新密码长度不能少于6位'}), 400
     
     try:
-        import bcrypt
-        password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = db.hash_password(new_password)
         
         with db.get_db_connection() as conn:
             c = conn.cursor()
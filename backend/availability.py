@@ -0,0 +1,286 @@
+import threading
+from config import Config
+from . import database as db
+
+# A commit refreshing more rooms than this reloads the whole index instead
+BULK_REFRESH_ROOMS = 100
+
+class AvailabilityIndex:
+    """In-process copy of rooms, beds and occupants for the room browser.
+
+    Loaded once from the rooms, beds and room_selections tables and then
+    kept current by the inventory changes that database writes record.
+    Writes from other processes are detected cheaply: PRAGMA data_version
+    on the index's own connection changes whenever anyone commits, and only
+    then is inventory_version compared with the version the index has
+    applied. A mismatch is bridged with the inventory_changes log by
+    re-reading just the rooms changed since; the index is only reloaded
+    in full when the log has been pruned past its version.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.conn = None
+        self.version = None
+        self.data_version = None
+        self.pending = {}
+        self.rooms = {}
+        self.beds = {}
+        self.bed_room = {}
+        self.order = []
+
+    def _connection(self):
+        pool = db.get_pool()
+        if self.conn is None or self.conn.pool is not pool:
+            # Private long-lived connection so data_version tracks everyone else
+            self.conn = pool.acquire()
+            self.version = None
+        return self.conn
+
+    def _load(self):
+        conn = self._connection()
+        c = conn.cursor()
+        # One read transaction so the version matches the rows
+        c.execute('BEGIN')
+        try:
+            c.execute('SELECT version FROM inventory_version WHERE id = 1')
+            version = c.fetchone()['version']
+            c.execute('''
+                SELECT r.*, b.name as building_name
+                FROM rooms r
+                JOIN buildings b ON r.building_id = b.id
+            ''')
+            rooms = c.fetchall()
+            c.execute('''
+                SELECT b.id, b.room_id, b.bed_number, b.is_occupied, rs.user_id, u.name as user_name
+                FROM beds b
+                LEFT JOIN room_selections rs ON b.id = rs.bed_id
+                LEFT JOIN users u ON rs.user_id = u.id
+                ORDER BY b.room_id, b.bed_number
+            ''')
+            beds = c.fetchall()
+        finally:
+            conn.rollback()
+
+        self.rooms = {}
+        self.beds = {}
+        self.bed_room = {}
+        for room in rooms:
+            self.rooms[room['id']] = self._room_entry(room)
+            self.beds[room['id']] = []
+        for bed in beds:
+            if bed['room_id'] in self.beds:
+                self.beds[bed['room_id']].append(self._bed_entry(bed))
+                self.bed_room[bed['id']] = bed['room_id']
+        for room_id in self.rooms:
+            self._recount(room_id)
+        self._sort()
+        self.version = version
+        self.pending = {v: changes for v, changes in self.pending.items() if v > version}
+        self._apply_pending()
+        self.data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _room_entry(self, room):
+        return {
+            'id': room['id'],
+            'building_id': room['building_id'],
+            'building_name': room['building_name'],
+            'room_number': room['room_number'],
+            'room_type': room['room_type'],
+            'max_capacity': room['max_capacity'],
+            'current_occupancy': 0,
+            'is_available': bool(room['is_available']),
+            'available_beds': 0
+        }
+
+    def _bed_entry(self, bed):
+        return {
+            'id': bed['id'],
+            'bed_number': bed['bed_number'],
+            'is_occupied': bool(bed['is_occupied']),
+            'user_id': bed['user_id'],
+            'user_name': bed['user_name']
+        }
+
+    def _sort(self):
+        self.order = sorted(self.rooms, key=lambda rid: (self.rooms[rid]['building_name'], self.rooms[rid]['room_number']))
+
+    def _recount(self, room_id):
+        occupied = sum(1 for bed in self.beds[room_id] if bed['is_occupied'])
+        room = self.rooms[room_id]
+        room['current_occupancy'] = occupied
+        room['available_beds'] = len(self.beds[room_id]) - occupied
+
+    def _find_bed(self, bed_id):
+        room_id = self.bed_room.get(bed_id)
+        if room_id is None:
+            return None
+        for bed in self.beds[room_id]:
+            if bed['id'] == bed_id:
+                return bed
+        return None
+
+    def _refresh_rooms(self, room_ids):
+        if not room_ids:
+            return
+        c = self._connection().cursor()
+        placeholders = ','.join('?' * len(room_ids))
+        c.execute(f'''
+            SELECT r.*, b.name as building_name
+            FROM rooms r
+            JOIN buildings b ON r.building_id = b.id
+            WHERE r.id IN ({placeholders})
+        ''', room_ids)
+        rooms = c.fetchall()
+        c.execute(f'''
+            SELECT b.id, b.room_id, b.bed_number, b.is_occupied, rs.user_id, u.name as user_name
+            FROM beds b
+            LEFT JOIN room_selections rs ON b.id = rs.bed_id
+            LEFT JOIN users u ON rs.user_id = u.id
+            WHERE b.room_id IN ({placeholders})
+            ORDER BY b.room_id, b.bed_number
+        ''', room_ids)
+        beds = c.fetchall()
+        for room_id in room_ids:
+            self._delete_room(room_id)
+        for room in rooms:
+            self.rooms[room['id']] = self._room_entry(room)
+            self.beds[room['id']] = []
+        for bed in beds:
+            if bed['room_id'] in self.beds:
+                self.beds[bed['room_id']].append(self._bed_entry(bed))
+                self.bed_room[bed['id']] = bed['room_id']
+        for room in rooms:
+            self._recount(room['id'])
+        self._sort()
+
+    def _delete_room(self, room_id):
+        if room_id not in self.rooms:
+            return
+        for bed in self.beds.pop(room_id):
+            self.bed_room.pop(bed['id'], None)
+        del self.rooms[room_id]
+        self.order = [rid for rid in self.order if rid != room_id]
+
+    def _apply_change(self, change):
+        kind = change[0]
+        if kind == 'occupy':
+            _, bed_id, room_id, user_id, user_name = change
+            bed = self._find_bed(bed_id)
+            if bed:
+                bed.update(is_occupied=True, user_id=user_id, user_name=user_name)
+                self._recount(room_id)
+        elif kind == 'release':
+            _, bed_id, room_id = change
+            bed = self._find_bed(bed_id)
+            if bed:
+                bed.update(is_occupied=False, user_id=None, user_name=None)
+                self._recount(room_id)
+        elif kind == 'refresh_room':
+            self._refresh_rooms([change[1]])
+        elif kind == 'delete_room':
+            self._delete_room(change[1])
+
+    def _apply_pending(self):
+        # Commit hooks can run out of order across threads; apply in sequence
+        while self.version + 1 in self.pending:
+            self.version += 1
+            for change in self.pending.pop(self.version):
+                self._apply_change(change)
+
+    def on_change(self, version, changes):
+        """Inventory listener: apply committed changes incrementally."""
+        with self.lock:
+            if self.version is None or version <= self.version:
+                return
+            if sum(1 for change in changes if change[0] == 'refresh_room') > BULK_REFRESH_ROOMS:
+                # Bulk room import: one reload beats re-reading and re-sorting room by room
+                self.version = None
+                return
+            self.pending[version] = changes
+            self._apply_pending()
+
+    def _catch_up(self, conn):
+        """Apply other processes' commits from the inventory_changes log.
+        
+        Re-reads only the rooms changed since the applied version. Returns
+        False when the log no longer reaches back that far (or too many
+        rooms changed) and a full reload is needed instead.
+        """
+        conn.execute('BEGIN')
+        try:
+            version, room_ids = db.get_changed_rooms(conn, self.version)
+            if room_ids is None or len(room_ids) > BULK_REFRESH_ROOMS:
+                return False
+            self._refresh_rooms(room_ids)
+        finally:
+            conn.rollback()
+        self.version = version
+        self.pending = {v: changes for v, changes in self.pending.items() if v > version}
+        self._apply_pending()
+        return True
+    
+    def _ensure_fresh(self):
+        conn = self._connection()
+        if self.version is None:
+            self._load()
+            return
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self.data_version:
+            return
+        version = conn.execute('SELECT version FROM inventory_version WHERE id = 1').fetchone()['version']
+        if version != self.version and not self._catch_up(conn):
+            # Written by someone else (another worker, or a hook not yet
+            # run) and the change log cannot bridge the gap
+            self._load()
+        else:
+            self.data_version = data_version
+
+    def invalidate(self):
+        """Force a full reload on the next read."""
+        with self.lock:
+            self.version = None
+
+    def available_rooms(self, room_type=None, building_id=None):
+        """Return (version, rooms): open rooms with free beds, filtered and
+        ordered like the SQL query, and the inventory version they reflect."""
+        with self.lock:
+            self._ensure_fresh()
+            result = []
+            for room_id in self.order:
+                room = self.rooms[room_id]
+                if not room['is_available'] or room['current_occupancy'] >= room['max_capacity']:
+                    continue
+                if room_type and room['room_type'] != room_type:
+                    continue
+                if building_id and room['building_id'] != building_id:
+                    continue
+                beds = self.beds[room_id]
+                room_data = dict(room)
+                room_data['beds'] = [
+                    {'id': bed['id'], 'bed_number': bed['bed_number'], 'is_occupied': bed['is_occupied']}
+                    for bed in beds
+                ]
+                room_data['occupied_users'] = [
+                    {'name': bed['user_name'], 'bed_number': bed['bed_number']}
+                    for bed in beds if bed['user_id']
+                ]
+                result.append(room_data)
+            return self.version, result
+
+_index = None
+
+def get_availability_index():
+    """Get the availability index, or None when it is disabled."""
+    return _index
+
+def init_app(app):
+    """Create the index when AVAILABILITY_INDEX_ENABLED is set."""
+    global _index
+    if app.config.get('AVAILABILITY_INDEX_ENABLED', Config.AVAILABILITY_INDEX_ENABLED):
+        if _index is None:
+            _index = AvailabilityIndex()
+            db.add_inventory_listener(_index.on_change)
+    elif _index is not None:
+        _index.invalidate()
+        _index = None
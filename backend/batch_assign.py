@@ -0,0 +1,191 @@
+import itertools
+import re
+from . import database as db
+from . import lottery_engine
+
+def room_floor(room_number):
+    """Floor of a room from its number ('305' and 'A305' are on floor 3), or None."""
+    match = re.search(r'(\d{3,})$', str(room_number))
+    return int(match.group(1)[:-2]) if match else None
+
+class FreeBeds:
+    """Free beds of the open rooms, indexed for preference lookups.
+
+    Every room is listed under each (room_type, building_id, floor) key with
+    any of the parts replaced by None, in building and room number order.
+    Rooms only fill up during a pass, so each index keeps a cursor past its
+    full rooms and finding the first room with a free bed is amortized O(1).
+    """
+
+    def __init__(self, beds):
+        self.free = {}  # room_id -> free bed ids, next bed last
+        self.room_types = {}
+        self.indexes = {}  # key -> [room ids, cursor]
+        for bed_id, room_id, building_id, room_number, room_type in beds:
+            if room_id not in self.free:
+                self.free[room_id] = []
+                self.room_types[room_id] = room_type
+                keys = set(itertools.product((room_type, None), (building_id, None), (room_floor(room_number), None)))
+                for key in keys:
+                    self.indexes.setdefault(key, [[], 0])[0].append(room_id)
+            self.free[room_id].append(bed_id)
+        for beds in self.free.values():
+            beds.reverse()
+
+    def _find(self, room_type, building_id, floor, count):
+        entry = self.indexes.get((room_type, building_id, floor))
+        if entry is None:
+            return None
+        rooms, cursor = entry
+        while cursor < len(rooms) and not self.free[rooms[cursor]]:
+            cursor += 1
+        entry[1] = cursor
+        if count == 1:
+            return rooms[cursor] if cursor < len(rooms) else None
+        # Groups need several beds in one room; a plain scan is fine for the few of them
+        return next((room_id for room_id in itertools.islice(rooms, cursor, None)
+                     if len(self.free[room_id]) >= count), None)
+
+    def take(self, room_type, building_id=None, room_id=None, floor=None, count=1):
+        """Take count free beds in one matching room; returns (room_id, bed_ids) or None.
+
+        room_type None matches every room type. A preference naming a room
+        ignores building and floor.
+        """
+        if room_id is not None:
+            if room_id not in self.free or len(self.free[room_id]) < count:
+                return None
+            if room_type is not None and self.room_types[room_id] != room_type:
+                return None
+        else:
+            room_id = self._find(room_type, building_id, floor, count)
+            if room_id is None:
+                return None
+        beds = self.free[room_id]
+        return room_id, [beds.pop() for _ in range(count)]
+
+def match(participants, preferences, groups, free_beds):
+    """Serial dictatorship over the free beds in lottery order.
+
+    participants is a list of (user_id, room_type) in lottery_number order.
+    Each student in turn gets a bed from their best-ranked preference that
+    still has one, else any room of their room type. When the first member
+    of a roommate group comes up, the whole group is seated in one room if
+    a matching room has enough free beds; otherwise members are placed one
+    by one at their own turns. Returns a list of (user_id, room_id, bed_id,
+    preference rank or None).
+    """
+    room_type_of = dict(participants)
+    assignments = []
+    assigned = set()
+
+    def seat(user_ids, room_type, count):
+        for rank, (building_id, room_id, floor) in enumerate(preferences.get(user_ids[0], ()), 1):
+            taken = free_beds.take(room_type, building_id, room_id, floor, count)
+            if taken:
+                return taken, rank
+        return free_beds.take(room_type, count=count), None
+
+    for user_id, room_type in participants:
+        if user_id in assigned:
+            continue
+        # Group members still waiting for a bed; those already seated keep their beds
+        members = [user_id] + [m for m in groups.get(user_id, ()) if m != user_id and m in room_type_of and m not in assigned]
+        if len(members) > 1 and all(room_type_of[m] == room_type for m in members):
+            taken, rank = seat(members, room_type, len(members))
+            if taken is None:
+                members = [user_id]
+                taken, rank = seat(members, room_type, 1)
+        else:
+            members = [user_id]
+            taken, rank = seat(members, room_type, 1)
+        if taken is None:
+            continue
+        room_id, bed_ids = taken
+        for member, bed_id in zip(members, bed_ids):
+            assignments.append((member, room_id, bed_id, rank))
+            assigned.add(member)
+    return assignments
+
+def assign_beds(lottery_id, operated_by=None, dry_run=False):
+    """Assign beds to every student of a lottery without a selection.
+
+    Loads participants, preferences, roommate groups and free beds, runs
+    match() in memory and writes room_selections, beds, room occupancy and
+    allocation_history with executemany, all in one BEGIN IMMEDIATE
+    transaction. With dry_run=True nothing is written. Returns a summary.
+    """
+    with db.get_db_connection(immediate=True) as conn:
+        c = conn.cursor()
+        c.row_factory = None
+        # Students without a bed, in lottery order; an explicit room type allocation wins
+        with lottery_engine.merged_results(conn) as results_table:
+            c.execute(f'''
+                SELECT lr.user_id, COALESCE(rta.room_type, lr.room_type), u.name
+                FROM {results_table} lr
+                JOIN users u ON lr.user_id = u.id
+                LEFT JOIN room_type_allocations rta ON rta.user_id = lr.user_id
+                LEFT JOIN room_selections rs ON rs.user_id = lr.user_id
+                WHERE lr.lottery_id = ? AND u.is_admin = 0 AND rs.id IS NULL
+                ORDER BY lr.lottery_number
+            ''', (lottery_id,))
+            rows = c.fetchall()
+        participants = [(user_id, room_type) for user_id, room_type, name in rows]
+        names = {user_id: name for user_id, room_type, name in rows}
+
+        preferences = {}
+        c.execute('SELECT user_id, building_id, room_id, floor FROM room_preferences ORDER BY user_id, rank')
+        for user_id, building_id, room_id, floor in c:
+            preferences.setdefault(user_id, []).append((building_id, room_id, floor))
+
+        members = {}
+        c.execute('SELECT group_id, user_id FROM roommate_group_members ORDER BY user_id')
+        for group_id, user_id in c:
+            members.setdefault(group_id, []).append(user_id)
+        groups = {user_id: group for group in members.values() for user_id in group}
+
+        c.execute('''
+            SELECT b.id, b.room_id, r.building_id, r.room_number, r.room_type
+            FROM beds b
+            JOIN rooms r ON b.room_id = r.id
+            WHERE b.is_occupied = 0 AND r.is_available = 1
+            ORDER BY r.building_id, r.room_number, b.bed_number
+        ''')
+        free_beds = FreeBeds(c.fetchall())
+
+        assignments = match(participants, preferences, groups, free_beds)
+
+        if assignments and not dry_run:
+            c.executemany('UPDATE beds SET is_occupied = 1 WHERE id = ?', [(a[2],) for a in assignments])
+            c.executemany(
+                'INSERT INTO room_selections (user_id, room_id, bed_id) VALUES (?, ?, ?)',
+                [a[:3] for a in assignments]
+            )
+            occupancy = {}
+            for user_id, room_id, bed_id, rank in assignments:
+                occupancy[room_id] = occupancy.get(room_id, 0) + 1
+            c.executemany(
+                'UPDATE rooms SET current_occupancy = current_occupancy + ? WHERE id = ?',
+                [(count, room_id) for room_id, count in occupancy.items()]
+            )
+            c.executemany(
+                'INSERT INTO allocation_history (user_id, room_id, bed_id, action, operated_by, notes) VALUES (?, ?, ?, ?, ?, ?)',
+                [(user_id, room_id, bed_id, 'assigned', operated_by, '按抽签顺序批量分配')
+                 for user_id, room_id, bed_id, rank in assignments]
+            )
+            db.record_inventory_change(conn, *[
+                ('occupy', bed_id, room_id, user_id, names[user_id])
+                for user_id, room_id, bed_id, rank in assignments
+            ])
+
+    assigned = {a[0] for a in assignments}
+    return {
+        'lottery_id': lottery_id,
+        'dry_run': dry_run,
+        'participants': len(participants),
+        'assigned': len(assignments),
+        'preference_matched': sum(1 for a in assignments if a[3] is not None),
+        'first_choice': sum(1 for a in assignments if a[3] == 1),
+        'unassigned': len(participants) - len(assignments),
+        'unassigned_user_ids': [user_id for user_id, room_type in participants if user_id not in assigned][:20]
+    }
@@ -0,0 +1,363 @@
+import codecs
+import itertools
+import sqlite3
+import numpy as np
+import pandas as pd
+from config import Config
+from . import database as db
+from .password_hashing import is_bcrypt_hash
+
+# Only this many row errors are kept and returned by a real import
+MAX_REPORTED_ERRORS = 10
+
+# Room types a student can be allocated
+ALLOCATION_ROOM_TYPES = ['4', '8']
+
+def detect_encoding(stream, sample_size=65536):
+    """Guess the encoding of an uploaded CSV from its first bytes: UTF-8, GBK or Latin-1."""
+    sample = stream.read(sample_size)
+    stream.seek(0)
+    for encoding in ('utf-8-sig', 'gbk'):
+        try:
+            # final=False: a character cut off at the end of the sample is fine
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return 'latin-1'
+
+def read_csv_chunks(file, chunk_size=None):
+    """Read an uploaded CSV as DataFrames of chunk_size rows with every column as text.
+
+    The upload is streamed from Werkzeug's spooled temporary file, so only
+    one chunk is in memory at a time. Empty cells become ''. Each chunk
+    keeps its row positions in the file as index.
+    """
+    stream = file.stream
+    return pd.read_csv(
+        stream,
+        encoding=detect_encoding(stream),
+        dtype=str,
+        keep_default_na=False,
+        chunksize=chunk_size or Config.IMPORT_CHUNK_SIZE
+    )
+
+def read_csv_frame(file):
+    """Read a whole uploaded CSV like read_csv_chunks, as one DataFrame."""
+    stream = file.stream
+    return pd.read_csv(stream, encoding=detect_encoding(stream), dtype=str, keep_default_na=False)
+
+class ImportFormatError(ValueError):
+    """The uploaded file cannot be imported at all, e.g. a required column is missing."""
+
+def require_columns(frame, required, message):
+    """Raise ImportFormatError(message) unless every required column is present."""
+    if not all(column in frame.columns for column in required):
+        raise ImportFormatError(message)
+
+def text_column(frame, column):
+    """A column with surrounding whitespace removed; all '' when the file does not have it."""
+    if column not in frame.columns:
+        return pd.Series('', index=frame.index, dtype=object)
+    return frame[column].str.strip()
+
+class ImportReport:
+    """Success and failure counts of an import plus the first row errors."""
+
+    def __init__(self):
+        self.success_count = 0
+        self.error_count = 0
+        self.errors = []
+
+    def fail(self, index, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            # index is the 0-based data row; the header is line 1
+            self.errors.append(f"第{index + 2}行: {message}")
+
+    def fail_all(self, errors):
+        """Record every index -> message of a validation result."""
+        for index, message in errors.items():
+            self.fail(index, message)
+    
+    def to_dict(self):
+        return {
+            'message': f'导入完成：成功 {self.success_count} 个，失败 {self.error_count} 个',
+            'success_count': self.success_count,
+            'error_count': self.error_count,
+            'errors': self.errors
+        }
+
+def parse_priority_weight(value):
+    """Validate a lottery priority weight; raises ValueError with a user-facing message."""
+    try:
+        weight = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('优先权重必须是大于0的数字')
+    if not weight > 0 or weight == float('inf'):
+        raise ValueError('优先权重必须是大于0的数字')
+    return weight
+
+# Validation: every rule is a boolean mask over the whole frame plus the
+# message for the rows it flags. A row reports the first rule it breaks,
+# and only failing rows get their message built.
+
+def first_errors(index, rules):
+    """Series index -> message of each row's first broken rule.
+    
+    rules is a list of (mask, message) where message is a string or a
+    function of the flagged rows' index returning a Series of strings.
+    """
+    errors = pd.Series(np.nan, index=index, dtype=object)
+    for mask, message in rules:
+        hit = mask & errors.isna()
+        if hit.any():
+            errors[hit] = message(hit[hit].index) if callable(message) else message
+    return errors.dropna()
+
+def load_usernames():
+    """Set of every username in the database, from a single query."""
+    conn = db.get_db()
+    c = conn.cursor()
+    c.row_factory = None
+    c.execute('SELECT username FROM users')
+    usernames = {row[0] for row in c}
+    conn.close()
+    return usernames
+
+def validate_users(frame, existing):
+    """Check a frame of the user import against the usernames in existing.
+    
+    Returns (errors, rows): errors maps row index to message and rows is a
+    DataFrame of the valid rows with username, name, password,
+    password_hash and priority_weight columns.
+    """
+    columns = set(frame.columns)
+    if not {'username', 'name'} <= columns or not columns & {'password', 'password_hash'}:
+        raise ImportFormatError('CSV文件必须包含username、name和password（或password_hash）列')
+    username = text_column(frame, 'username')
+    name = text_column(frame, 'name')
+    password = text_column(frame, 'password')
+    password_hash = text_column(frame, 'password_hash')
+    weight_text = text_column(frame, 'priority_weight')
+    weight = pd.to_numeric(weight_text, errors='coerce')
+    has_hash = password_hash != ''
+    bad_hash = has_hash & ~password_hash.map(is_bcrypt_hash).astype(bool)
+    
+    errors = first_errors(frame.index, [
+        ((username == '') | (name == '') | ((password == '') & ~has_hash), '用户名、姓名和密码不能为空'),
+        (bad_hash, '密码哈希不是有效的bcrypt格式'),
+        (username.str.len() < 3, lambda rows: '用户名 ' + username[rows] + ' 长度至少3个字符'),
+        ((weight_text != '') & ~((weight > 0) & np.isfinite(weight)), '优先权重必须是大于0的数字'),
+        (username.isin(existing), lambda rows: '用户名 ' + username[rows] + ' 已存在'),
+        (username.duplicated(), lambda rows: '用户名 ' + username[rows] + ' 在文件中重复'),
+    ])
+    rows = pd.DataFrame({
+        'username': username,
+        'name': name,
+        'password': password,
+        'password_hash': password_hash,
+        'priority_weight': weight.where(weight_text != '', 1.0)
+    }).drop(errors.index)
+    return errors, rows
+
+def load_buildings():
+    """Building name -> id (the oldest building when names repeat), from a single query."""
+    conn = db.get_db()
+    c = conn.cursor()
+    c.row_factory = None
+    c.execute('SELECT name, id FROM buildings ORDER BY id DESC')
+    buildings = dict(c.fetchall())
+    conn.close()
+    return buildings
+
+def load_room_keys():
+    """Set of 'building_id/room_number' keys of every room, from a single query."""
+    conn = db.get_db()
+    c = conn.cursor()
+    c.row_factory = None
+    c.execute('SELECT building_id, room_number FROM rooms')
+    keys = {f'{building_id}/{room_number}' for building_id, room_number in c}
+    conn.close()
+    return keys
+
+def validate_rooms(frame, buildings, room_keys):
+    """Check a frame of the room import against building name -> id and existing room keys.
+    
+    Returns (errors, rows) like validate_users; rows has building_id,
+    room_number, room_type and max_capacity columns.
+    """
+    require_columns(frame, ['building_name', 'room_number', 'room_type', 'max_capacity'],
+                    'CSV文件必须包含building_name、room_number、room_type和max_capacity列')
+    building_name = text_column(frame, 'building_name')
+    room_number = text_column(frame, 'room_number')
+    room_type = text_column(frame, 'room_type')
+    capacity = pd.to_numeric(text_column(frame, 'max_capacity'), errors='coerce')
+    building_id = building_name.map(buildings)
+    key = building_id.astype('Int64').astype(str) + '/' + room_number
+    label = lambda rows: '房间 ' + building_name[rows] + '-' + room_number[rows]
+    
+    errors = first_errors(frame.index, [
+        ((building_name == '') | (room_number == '') | (room_type == ''), '楼栋、房间号和房间类型不能为空'),
+        (~((capacity > 0) & (capacity % 1 == 0)), '最大容量必须是正整数'),
+        (building_id.isna(), lambda rows: '楼栋 ' + building_name[rows] + ' 不存在'),
+        (key.isin(room_keys), lambda rows: label(rows) + ' 已存在'),
+        (pd.Series(list(zip(building_name, room_number)), index=frame.index).duplicated(),
+         lambda rows: label(rows) + ' 在文件中重复'),
+    ])
+    valid = frame.index.difference(errors.index)
+    rows = pd.DataFrame({
+        'building_id': building_id[valid].astype(int),
+        'room_number': room_number[valid],
+        'room_type': room_type[valid],
+        'max_capacity': capacity[valid].astype(int)
+    })
+    return errors, rows
+
+def load_students():
+    """id and is_admin of every user indexed by username, from a single query."""
+    conn = db.get_db()
+    c = conn.cursor()
+    c.row_factory = None
+    c.execute('SELECT username, id, is_admin FROM users')
+    users = pd.DataFrame(c.fetchall(), columns=['username', 'id', 'is_admin']).set_index('username')
+    conn.close()
+    return users
+
+def validate_room_type_allocations(frame, users):
+    """Check a frame of the room type allocation import against the users from load_students().
+    
+    Returns (errors, rows) like validate_users; rows has user_id, room_type
+    and notes (None when empty) columns.
+    """
+    require_columns(frame, ['username', 'room_type'], 'CSV文件必须包含username和room_type列')
+    username = text_column(frame, 'username')
+    room_type = text_column(frame, 'room_type')
+    notes = text_column(frame, 'notes')
+    user_id = username.map(users['id'])
+    is_admin = username.map(users['is_admin']).fillna(0).astype(bool)
+    
+    errors = first_errors(frame.index, [
+        (~room_type.isin(ALLOCATION_ROOM_TYPES), '房间类型必须是4或8'),
+        (user_id.isna(), lambda rows: '用户名 ' + username[rows] + ' 不存在'),
+        (is_admin, lambda rows: '不能为管理员用户 ' + username[rows] + ' 分配房间类型'),
+        (username.duplicated(), lambda rows: '用户名 ' + username[rows] + ' 在文件中重复'),
+    ])
+    valid = frame.index.difference(errors.index)
+    rows = pd.DataFrame({
+        'user_id': user_id[valid].astype(int),
+        'room_type': room_type[valid],
+        'notes': notes[valid].replace('', None)
+    })
+    return errors, rows
+
+# The checks a dry run performs for each import, including the database lookups
+DRY_RUN_CHECKS = {
+    'users': lambda frame: validate_users(frame, load_usernames()),
+    'rooms': lambda frame: validate_rooms(frame, load_buildings(), load_room_keys()),
+    'room_type_allocations': lambda frame: validate_room_type_allocations(frame, load_students()),
+}
+
+def dry_run(kind, file):
+    """Validate a whole upload for import kind without writing anything.
+    
+    Runs the same checks as the real import over the full file at once and
+    returns the counts and every row error, not just the first few.
+    """
+    frame = read_csv_frame(file)
+    errors, rows = DRY_RUN_CHECKS[kind](frame)
+    return {
+        'message': f'校验完成：共 {len(frame)} 行，可导入 {len(rows)} 行，有错误 {len(errors)} 行',
+        'dry_run': True,
+        'total_count': len(frame),
+        'valid_count': len(rows),
+        'error_count': len(errors),
+        'errors': [f'第{index + 2}行: {message}' for index, message in errors.items()]
+    }
+
+def _insert_users(rows, report):
+    """Insert one chunk of (index, username, password_hash, name, weight) rows."""
+    sql = 'INSERT INTO users (username, password_hash, name, priority_weight) VALUES (?, ?, ?, ?)'
+    try:
+        with db.get_db_connection() as conn:
+            conn.executemany(sql, [row[1:] for row in rows])
+        report.success_count += len(rows)
+    except sqlite3.IntegrityError:
+        # Someone else created one of these usernames meanwhile: redo the
+        # chunk row by row to find out which
+        for index, *values in rows:
+            try:
+                with db.get_db_connection() as conn:
+                    conn.execute(sql, values)
+                report.success_count += 1
+            except sqlite3.IntegrityError:
+                report.fail(index, f'用户名 {values[0]} 已存在')
+
+def import_users(file, chunk_size=None):
+    """Create users from an uploaded CSV with username, name and password columns.
+
+    Instead of password a row may carry a bcrypt hash in a password_hash
+    column, e.g. exported from another system; it is checked for the bcrypt
+    format and stored as is, and login moves it to BCRYPT_ROUNDS later if
+    its cost differs. The file is read in chunks and each chunk is checked
+    by validate_users against the usernames loaded with a single query plus
+    those of earlier chunks. Each chunk's valid rows are inserted with one
+    executemany in their own transaction, so memory stays flat and the
+    write lock is never held for the whole file. Returns an ImportReport.
+    """
+    report = ImportReport()
+    existing = load_usernames()
+
+    for chunk in read_csv_chunks(file, chunk_size):
+        errors, valid = validate_users(chunk, existing)
+        report.fail_all(errors)
+        if valid.empty:
+            continue
+        existing.update(valid['username'])
+        # The plaintext passwords of the chunk are hashed in parallel on the hashing pool
+        plaintext = valid['password_hash'] == ''
+        hashes = valid['password_hash'].copy()
+        hashes[plaintext] = db.hash_passwords(valid.loc[plaintext, 'password'].tolist())
+        _insert_users(list(zip(
+            valid.index.tolist(), valid['username'], hashes, valid['name'], valid['priority_weight'].astype(float).tolist()
+        )), report)
+    return report
+
+def import_rooms(file):
+    """Create rooms and their beds from an uploaded CSV with building_name,
+    room_number, room_type and max_capacity columns.
+    
+    Every row is checked by validate_rooms against the buildings and room
+    keys loaded with one query each; db.create_rooms then writes all valid
+    rooms and beds in one transaction. Returns an ImportReport.
+    """
+    report = ImportReport()
+    frame = read_csv_frame(file)
+    errors, rows = validate_rooms(frame, load_buildings(), load_room_keys())
+    room_ids = db.create_rooms(list(zip(
+        rows['building_id'].tolist(), rows['room_number'], rows['room_type'], rows['max_capacity'].tolist()
+    ))) if not rows.empty else []
+    # Rooms created by someone else since the keys were loaded
+    taken = pd.Series(room_ids, index=rows.index, dtype=object).isna()
+    building_name = text_column(frame, 'building_name')
+    errors = pd.concat([errors, '房间 ' + building_name[taken[taken].index] + '-' + rows.loc[taken, 'room_number'] + ' 已存在'])
+    report.fail_all(errors.sort_index())
+    report.success_count = len(rows) - int(taken.sum())
+    return report
+
+def import_room_type_allocations(file, allocated_by):
+    """Allocate room types from an uploaded CSV with username and room_type columns.
+    
+    Every row is checked by validate_room_type_allocations first; the valid
+    ones are written with one executemany. Returns an ImportReport.
+    """
+    report = ImportReport()
+    errors, rows = validate_room_type_allocations(read_csv_frame(file), load_students())
+    report.fail_all(errors)
+    with db.get_db_connection() as conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO room_type_allocations (user_id, room_type, allocated_by, notes) VALUES (?, ?, ?, ?)',
+            zip(rows['user_id'].tolist(), rows['room_type'], itertools.repeat(allocated_by), rows['notes'])
+        )
+    report.success_count = len(rows)
+    return report
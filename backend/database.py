@@ -1,29 +1,319 @@
 import sqlite3
 import os
+import threading
+import time
 from datetime import datetime
 from contextlib import contextmanager
 import bcrypt
-from config import Config
+from flask import g, has_app_context
+from config import Config, SQLITE_PROFILES
+from . import metrics
+from .password_hashing import get_password_hasher, hash_cost
+
+class SelectionError(ValueError):
+    """A bed claim that failed; carries the HTTP status to report."""
+
+    def __init__(self, message, status_code=409):
+        super().__init__(message)
+        self.status_code = status_code
+
+class ProfilingCursor(sqlite3.Cursor):
+    """Cursor that reports each statement and its duration to connection.profile.
+    
+    The time covers executing the statement up to its first row; rows
+    fetched afterwards are not included.
+    """
+    
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.profile.record(self.connection, sql, parameters, time.perf_counter() - start)
+    
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.profile.record(self.connection, sql, None, time.perf_counter() - start)
+    
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self.connection.profile.record(self.connection, sql_script, None, time.perf_counter() - start)
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection that goes back to its pool when closed."""
+
+    pool = None
+    request_bound = False
+    tx_depth = 0
+    commit_hooks = None
+    # Per-request statement statistics (see sql_profile); None when off
+    profile = None
+    
+    def cursor(self, factory=None):
+        if self.profile is None:
+            return super().cursor() if factory is None else super().cursor(factory)
+        return super().cursor(ProfilingCursor if factory is None else factory)
+    
+    # Connection.execute() and friends create their cursor internally,
+    # bypassing cursor(); route them through it while profiling
+    def execute(self, sql, parameters=()):
+        if self.profile is None:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        if self.profile is None:
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def executescript(self, sql_script):
+        if self.profile is None:
+            return super().executescript(sql_script)
+        return self.cursor().executescript(sql_script)
+
+    def close(self):
+        # Request-bound connections are released on app-context teardown
+        if self.request_bound:
+            return
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def dispose(self):
+        """Really close the underlying SQLite handle."""
+        sqlite3.Connection.close(self)
+
+class ConnectionPool:
+    """Thread-safe pool of idle SQLite connections for one database file."""
+
+    def __init__(self, database, size=10, health_check=True, pragmas=None):
+        self.database = database
+        self.size = size
+        self.health_check = health_check
+        self.pragmas = pragmas or {}
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, factory=PooledConnection, check_same_thread=False)
+        metrics.DB_CONNECTIONS.inc()
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        conn.pool = self
+        conn.commit_hooks = []
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        """Take an idle connection, or open a new one if none is usable."""
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            if not self.health_check or self._is_healthy(conn):
+                return conn
+            conn.dispose()
+
+    def release(self, conn):
+        """Roll back leftovers and keep the connection if the pool has room."""
+        conn.request_bound = False
+        conn.profile = None
+        conn.tx_depth = 0
+        conn.commit_hooks = []
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.dispose()
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.dispose()
+
+    def close_all(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.dispose()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Get the connection pool for the configured database file."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.database != Config.DATABASE_NAME:
+            if _pool is not None:
+                _pool.close_all()
+            _pool = ConnectionPool(
+                Config.DATABASE_NAME,
+                Config.DB_POOL_SIZE,
+                Config.DB_POOL_HEALTH_CHECK,
+                SQLITE_PROFILES[Config.SQLITE_PROFILE]
+            )
+        return _pool
 
 def get_db():
-    """Create a database connection and configure it to return rows as dictionaries."""
-    conn = sqlite3.connect(Config.DATABASE_NAME)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
-    return conn
+    """Get a database connection that returns rows as dictionaries.
+
+    Inside a Flask app context one connection is shared by the whole request
+    and handed back to the pool on teardown; elsewhere close() returns it.
+    """
+    if has_app_context():
+        if 'db' not in g:
+            conn = get_pool().acquire()
+            conn.request_bound = True
+            conn.profile = g.get('sql_profile')
+            g.db = conn
+        return g.db
+    return get_pool().acquire()
 
 @contextmanager
-def get_db_connection():
-    """Context manager for database connections."""
+def get_db_connection(immediate=False):
+    """Context manager for a transaction on the current connection.
+
+    Nested blocks on a shared request connection run inside a savepoint, so
+    a failing inner block only rolls back its own statements. With
+    immediate=True the outermost block starts with BEGIN IMMEDIATE and takes
+    the write lock up front. Hooks registered with on_commit() run after the
+    outermost block commits.
+    """
     conn = get_db()
+    depth = conn.tx_depth
+    savepoint = f'sp_{depth}'
+    hook_mark = len(conn.commit_hooks)
+    hooks = []
+    conn.tx_depth = depth + 1
+    started = time.perf_counter()
+    mode = 'immediate' if immediate else 'deferred'
     try:
+        if depth:
+            conn.execute(f'SAVEPOINT {savepoint}')
+        elif immediate and not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
         yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
+        if depth:
+            conn.execute(f'RELEASE {savepoint}')
+        else:
+            conn.commit()
+            hooks, conn.commit_hooks = conn.commit_hooks, []
+            metrics.DB_TRANSACTIONS.labels(mode, 'commit').observe(time.perf_counter() - started)
+    except Exception as e:
+        if depth:
+            conn.execute(f'ROLLBACK TO {savepoint}')
+            conn.execute(f'RELEASE {savepoint}')
+            del conn.commit_hooks[hook_mark:]
+        else:
+            conn.rollback()
+            conn.commit_hooks.clear()
+            metrics.DB_TRANSACTIONS.labels(mode, 'rollback').observe(time.perf_counter() - started)
+            if isinstance(e, sqlite3.OperationalError) and metrics.is_locked_error(e):
+                metrics.DB_LOCKED.inc()
         raise
     finally:
+        conn.tx_depth = depth
         conn.close()
+    
+    for hook in hooks:
+        hook()
+
+def on_commit(conn, hook):
+    """Run hook() once the outermost transaction on conn has committed."""
+    conn.commit_hooks.append(hook)
+
+# Listeners notified after committed changes to rooms, beds and selections
+_inventory_listeners = []
+
+def add_inventory_listener(listener):
+    """Register listener(version, changes) for committed inventory changes."""
+    _inventory_listeners.append(listener)
+
+def record_inventory_change(conn, *changes):
+    """Bump the inventory version inside the current transaction.
+
+    Each change is a tuple such as ('occupy', bed_id, room_id, user_id,
+    user_name), ('release', bed_id, room_id), ('refresh_room', room_id) or
+    ('delete_room', room_id). Listeners receive the new version and the
+    changes after the transaction commits.
+    """
+    c = conn.cursor()
+    c.execute('UPDATE inventory_version SET version = version + 1 WHERE id = 1')
+    c.execute('SELECT version FROM inventory_version WHERE id = 1')
+    version = c.fetchone()['version']
+    
+    # Change log for clients syncing with ?since=<version>
+    c.executemany(
+        'INSERT INTO inventory_changes (version, room_id, bed_id) VALUES (?, ?, ?)',
+        [(version, change[2] if change[0] in ('occupy', 'release') else change[1],
+          change[1] if change[0] in ('occupy', 'release') else None) for change in changes]
+    )
+    if version % 100 == 0:
+        c.execute('DELETE FROM inventory_changes WHERE version <= ?',
+                  (version - Config.INVENTORY_CHANGE_RETENTION,))
+    
+    def notify():
+        for listener in _inventory_listeners:
+            listener(version, changes)
+    
+    on_commit(conn, notify)
+    return version
+
+def get_changed_rooms(conn, since):
+    """Return (version, room_ids) for rooms changed after version since.
+
+    room_ids is None when since is older than the retained change log or
+    newer than the database, in which case the caller must reload fully.
+    Run it inside a read transaction together with the follow-up queries.
+    """
+    c = conn.cursor()
+    c.execute('SELECT version FROM inventory_version WHERE id = 1')
+    version = c.fetchone()['version']
+    if since > version:
+        return version, None
+    if since == version:
+        return version, []
+    c.execute('SELECT MIN(version) as oldest FROM inventory_changes')
+    oldest = c.fetchone()['oldest']
+    if oldest is None or since < oldest - 1:
+        return version, None
+    c.execute('SELECT DISTINCT room_id FROM inventory_changes WHERE version > ?', (since,))
+    return version, [row['room_id'] for row in c.fetchall()]
+
+def close_db(e=None):
+    """Return the request's connection to the pool at app-context teardown."""
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.pool.release(conn)
+
+def init_app(app):
+    """Configure the connection pool from the app config and register teardown."""
+    pool = get_pool()
+    pool.size = app.config.get('DB_POOL_SIZE', Config.DB_POOL_SIZE)
+    pool.health_check = app.config.get('DB_POOL_HEALTH_CHECK', Config.DB_POOL_HEALTH_CHECK)
+    pool.pragmas = SQLITE_PROFILES[app.config.get('SQLITE_PROFILE', Config.SQLITE_PROFILE)]
+    # Drop connections opened with the previous profile
+    pool.close_all()
+    app.teardown_appcontext(close_db)
 
 def init_db():
     """Initialize the database by creating necessary tables if they don't exist."""
@@ -37,6 +327,7 @@ def init_db():
         password_hash TEXT NOT NULL,
         name TEXT NOT NULL,
         is_admin INTEGER DEFAULT 0,
+        priority_weight REAL NOT NULL DEFAULT 1,
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
     )''')
@@ -81,6 +372,9 @@ def init_db():
         lottery_time DATETIME NOT NULL,
         is_published INTEGER DEFAULT 0,
         room_type TEXT NOT NULL,
+        selection_start DATETIME,
+        selection_wave_size INTEGER,
+        selection_wave_interval INTEGER,
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
     )''')
@@ -99,6 +393,49 @@ def init_db():
         UNIQUE(user_id, lottery_id)
     )''')
     
+    # Compact lottery draws (seed + frozen participant ids instead of result rows)
+    c.execute('''CREATE TABLE IF NOT EXISTS lottery_draws (
+        lottery_id INTEGER PRIMARY KEY,
+        seed INTEGER NOT NULL,
+        participants BLOB NOT NULL,
+        segments TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (lottery_id) REFERENCES lottery_settings(id)
+    )''')
+    
+    # Roommate groups (registered before the lottery, drawn as one unit)
+    c.execute('''CREATE TABLE IF NOT EXISTS roommate_groups (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        created_by INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (created_by) REFERENCES users(id)
+    )''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS roommate_group_members (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL UNIQUE,
+        FOREIGN KEY (group_id) REFERENCES roommate_groups(id),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_roommate_group_members_group ON roommate_group_members (group_id)')
+    
+    # Ranked room preferences used by the batch bed assignment
+    c.execute('''CREATE TABLE IF NOT EXISTS room_preferences (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        building_id INTEGER,
+        room_id INTEGER,
+        floor INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (building_id) REFERENCES buildings(id),
+        FOREIGN KEY (room_id) REFERENCES rooms(id),
+        UNIQUE(user_id, rank)
+    )''')
+    
     # Room selections table
     c.execute('''CREATE TABLE IF NOT EXISTS room_selections (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -140,6 +477,29 @@ def init_db():
         FOREIGN KEY (operated_by) REFERENCES users(id)
     )''')
     
+    # Inventory version (bumped by every write to rooms, beds and selections)
+    c.execute('''CREATE TABLE IF NOT EXISTS inventory_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )''')
+    c.execute('INSERT OR IGNORE INTO inventory_version (id, version) VALUES (1, 0)')
+    
+    # Inventory change log (rooms and beds touched by each version)
+    c.execute('''CREATE TABLE IF NOT EXISTS inventory_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        version INTEGER NOT NULL,
+        room_id INTEGER NOT NULL,
+        bed_id INTEGER
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_inventory_changes_version ON inventory_changes (version)')
+    
+    # Lock leases table (cross-process bed selection locks)
+    c.execute('''CREATE TABLE IF NOT EXISTS lock_leases (
+        lock_key TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )''')
+    
     conn.commit()
     
     # 检查并添加新字段（数据库迁移）
@@ -152,6 +512,22 @@ def init_db():
             c.execute('ALTER TABLE lottery_results ADD COLUMN room_type TEXT')
             print("添加 room_type 字段到 lottery_results 表")
         
+        # 检查users表是否有priority_weight字段（加权抽签）
+        c.execute("PRAGMA table_info(users)")
+        if 'priority_weight' not in [column[1] for column in c.fetchall()]:
+            c.execute('ALTER TABLE users ADD COLUMN priority_weight REAL NOT NULL DEFAULT 1')
+            print("添加 priority_weight 字段到 users 表")
+        
+        # 检查lottery_settings表是否有分批选房时段字段
+        c.execute("PRAGMA table_info(lottery_settings)")
+        setting_columns = [column[1] for column in c.fetchall()]
+        for column, column_type in (('selection_start', 'DATETIME'),
+                                    ('selection_wave_size', 'INTEGER'),
+                                    ('selection_wave_interval', 'INTEGER')):
+            if column not in setting_columns:
+                c.execute(f'ALTER TABLE lottery_settings ADD COLUMN {column} {column_type}')
+                print(f"添加 {column} 字段到 lottery_settings 表")
+        
         # 检查group_number字段类型
         if 'group_number' in columns:
             # SQLite不支持直接修改字段类型，但由于我们存储的是字符串，这里不需要特殊处理
@@ -164,7 +540,7 @@ def init_db():
     # Create default admin user if not exists
     c.execute('SELECT COUNT(*) as cnt FROM users WHERE username = ?', ('admin',))
     if c.fetchone()['cnt'] == 0:
-        password_hash = bcrypt.hashpw('admin123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = hash_password('admin123')
         c.execute(
             'INSERT INTO users (username, password_hash, name, is_admin) VALUES (?, ?, ?, ?)',
             ('admin', password_hash, '管理员', 1)
@@ -174,15 +550,42 @@ def init_db():
     conn.close()
 
 # User operations
-def create_user(username, password, name, is_admin=False):
+def hash_password(password):
+    """bcrypt hash of a password, as stored in users.password_hash."""
+    password_hash, seconds = get_password_hasher().hash(password)
+    metrics.BCRYPT.labels('hash').observe(seconds)
+    return password_hash
+
+def needs_rehash(password_hash):
+    """True when a stored hash is not bcrypt at the configured cost (BCRYPT_ROUNDS)."""
+    return hash_cost(password_hash) != get_password_hasher().rounds
+
+def rehash_password(user, password):
+    """Replace user's stored hash with one at the configured cost; call after a successful check."""
+    password_hash = hash_password(password)
+    with get_db_connection() as conn:
+        # Only if unchanged meanwhile, e.g. by a concurrent password change
+        conn.execute(
+            'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+            (password_hash, user['id'], user['password_hash'])
+        )
+
+def hash_passwords(passwords):
+    """Hash a batch of passwords in parallel on the hashing pool; same order as given."""
+    results = get_password_hasher().hash_many(passwords)
+    for password_hash, seconds in results:
+        metrics.BCRYPT.labels('hash').observe(seconds)
+    return [password_hash for password_hash, seconds in results]
+
+def create_user(username, password, name, is_admin=False, priority_weight=1.0):
     """Create a new user."""
-    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    password_hash = hash_password(password)
     
     with get_db_connection() as conn:
         c = conn.cursor()
         c.execute(
-            'INSERT INTO users (username, password_hash, name, is_admin) VALUES (?, ?, ?, ?)',
-            (username, password_hash, name, 1 if is_admin else 0)
+            'INSERT INTO users (username, password_hash, name, is_admin, priority_weight) VALUES (?, ?, ?, ?, ?)',
+            (username, password_hash, name, 1 if is_admin else 0, priority_weight)
         )
         return c.lastrowid
 
@@ -207,7 +610,8 @@ def get_user_by_id(user_id):
 def check_password(user, password):
     """Check if password matches user's password hash."""
     try:
-        return bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8'))
+        with metrics.BCRYPT.labels('check').time():
+            return bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8'))
     except Exception:
         # Fallback for old password hashes
         from werkzeug.security import check_password_hash
@@ -307,8 +711,38 @@ def create_room(building_id, room_number, room_type, max_capacity):
                 (room_id, str(i))
             )
         
+        record_inventory_change(conn, ('refresh_room', room_id))
         return room_id
 
+def create_rooms(rooms):
+    """Create many rooms with beds in one transaction.
+    
+    rooms is a list of (building_id, room_number, room_type, max_capacity).
+    Rooms and beds are written with one executemany each. Returns the new
+    room ids in the same order, with None for rooms that already existed.
+    """
+    with get_db_connection(immediate=True) as conn:
+        c = conn.cursor()
+        # The write lock is held, so every id above this one is ours
+        c.execute('SELECT COALESCE(MAX(id), 0) as max_id FROM rooms')
+        max_id = c.fetchone()['max_id']
+        c.executemany(
+            'INSERT OR IGNORE INTO rooms (building_id, room_number, room_type, max_capacity) VALUES (?, ?, ?, ?)',
+            rooms
+        )
+        c.execute('SELECT id, building_id, room_number, max_capacity FROM rooms WHERE id > ?', (max_id,))
+        created = {(room['building_id'], room['room_number']): (room['id'], room['max_capacity'])
+                   for room in c.fetchall()}
+        
+        c.executemany(
+            'INSERT INTO beds (room_id, bed_number) VALUES (?, ?)',
+            ((room_id, str(i)) for room_id, max_capacity in created.values() for i in range(1, max_capacity + 1))
+        )
+        
+        if created:
+            record_inventory_change(conn, *[('refresh_room', room_id) for room_id, _ in created.values()])
+        return [created.get((room[0], room[1]), (None,))[0] for room in rooms]
+
 def get_room_with_beds(room_id):
     """Get room details with bed information."""
     conn = get_db()
@@ -384,54 +818,89 @@ def publish_lottery(lottery_id):
         c.execute('UPDATE lottery_settings SET is_published = 1 WHERE id = ?', (lottery_id,))
 
 # Room selection operations
+SELECTION_QUERY = '''
+    SELECT rs.*, r.room_number, r.room_type, b.name as building_name, bd.bed_number, u.name as user_name
+    FROM room_selections rs
+    JOIN rooms r ON rs.room_id = r.id
+    JOIN buildings b ON r.building_id = b.id
+    JOIN beds bd ON rs.bed_id = bd.id
+    JOIN users u ON rs.user_id = u.id
+    WHERE rs.user_id = ?
+'''
+
 def get_user_room_selection(user_id):
     """Get user's room selection."""
     conn = get_db()
     c = conn.cursor()
-    c.execute('''
-        SELECT rs.*, r.room_number, r.room_type, b.name as building_name, bd.bed_number
-        FROM room_selections rs
-        JOIN rooms r ON rs.room_id = r.id
-        JOIN buildings b ON r.building_id = b.id
-        JOIN beds bd ON rs.bed_id = bd.id
-        WHERE rs.user_id = ?
-    ''', (user_id,))
+    c.execute(SELECTION_QUERY, (user_id,))
     selection = c.fetchone()
     conn.close()
     return selection
 
-def select_room(user_id, room_id, bed_id):
-    """Select a room and bed for a user."""
-    with get_db_connection() as conn:
+def select_room(user_id, bed_id, action='assigned', operated_by=None, notes=None):
+    """Claim a bed for a user, replacing any previous selection.
+
+    Everything runs in one BEGIN IMMEDIATE transaction and the bed is taken
+    with a conditional UPDATE, so the first committed claim wins. Writes the
+    history row and returns the joined selection. Raises SelectionError if
+    the bed is missing, its room is closed or it is already taken.
+    """
+    with get_db_connection(immediate=True) as conn:
         c = conn.cursor()
         
-        # Check if bed is available
-        c.execute('SELECT is_occupied FROM beds WHERE id = ?', (bed_id,))
-        bed = c.fetchone()
-        if not bed or bed['is_occupied']:
-            raise ValueError('床位已被占用')
+        # Release the user's current bed
+        c.execute('SELECT room_id, bed_id FROM room_selections WHERE user_id = ?', (user_id,))
+        previous = c.fetchone()
+        if previous:
+            c.execute('UPDATE beds SET is_occupied = 0 WHERE id = ?', (previous['bed_id'],))
+            c.execute('DELETE FROM room_selections WHERE user_id = ?', (user_id,))
+            c.execute('UPDATE rooms SET current_occupancy = current_occupancy - 1 WHERE id = ?', (previous['room_id'],))
+        
+        # Claim the bed only if it is still free and its room is open
+        c.execute('''
+            UPDATE beds SET is_occupied = 1
+            WHERE id = ? AND is_occupied = 0
+            AND room_id IN (SELECT id FROM rooms WHERE is_available = 1)
+        ''', (bed_id,))
+        if c.rowcount == 0:
+            c.execute('''
+                SELECT r.is_available FROM beds b JOIN rooms r ON b.room_id = r.id WHERE b.id = ?
+            ''', (bed_id,))
+            bed = c.fetchone()
+            if not bed:
+                raise SelectionError('床位不存在', 404)
+            if not bed['is_available']:
+                raise SelectionError('房间不可用', 400)
+            raise SelectionError('床位已被占用', 409)
         
-        # Delete any existing selection
-        c.execute('DELETE FROM room_selections WHERE user_id = ?', (user_id,))
+        try:
+            c.execute(
+                'INSERT INTO room_selections (user_id, room_id, bed_id) SELECT ?, room_id, id FROM beds WHERE id = ?',
+                (user_id, bed_id)
+            )
+        except sqlite3.IntegrityError:
+            raise SelectionError('床位已被其他用户选择', 409)
         
-        # Create new selection
         c.execute(
-            'INSERT INTO room_selections (user_id, room_id, bed_id) VALUES (?, ?, ?)',
-            (user_id, room_id, bed_id)
+            'UPDATE rooms SET current_occupancy = current_occupancy + 1 WHERE id = (SELECT room_id FROM beds WHERE id = ?)',
+            (bed_id,)
         )
+        c.execute('''
+            INSERT INTO allocation_history (user_id, room_id, bed_id, action, operated_by, notes)
+            SELECT ?, room_id, id, ?, ?, ? FROM beds WHERE id = ?
+        ''', (user_id, action, operated_by, notes, bed_id))
         
-        # Mark bed as occupied
-        c.execute('UPDATE beds SET is_occupied = 1 WHERE id = ?', (bed_id,))
+        c.execute(SELECTION_QUERY, (user_id,))
+        selection = c.fetchone()
         
-        # Update room occupancy
-        c.execute('''
-            UPDATE rooms 
-            SET current_occupancy = (SELECT COUNT(*) FROM beds WHERE room_id = ? AND is_occupied = 1)
-            WHERE id = ?
-        ''', (room_id, room_id))
+        changes = [('occupy', bed_id, selection['room_id'], user_id, selection['user_name'])]
+        if previous and previous['bed_id'] != bed_id:
+            changes.insert(0, ('release', previous['bed_id'], previous['room_id']))
+        record_inventory_change(conn, *changes)
+        return selection
 
-def cancel_room_selection(user_id):
-    """Cancel user's room selection."""
+def cancel_room_selection(user_id, action=None, operated_by=None, notes=None):
+    """Cancel user's room selection, writing a history row when action is given."""
     with get_db_connection() as conn:
         c = conn.cursor()
         
@@ -440,6 +909,12 @@ def cancel_room_selection(user_id):
         selection = c.fetchone()
         
         if selection:
+            if action:
+                c.execute('''
+                    INSERT INTO allocation_history (user_id, room_id, bed_id, action, operated_by, notes)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (user_id, selection['room_id'], selection['bed_id'], action, operated_by, notes))
+            
             # Mark bed as available
             c.execute('UPDATE beds SET is_occupied = 0 WHERE id = ?', (selection['bed_id'],))
             
@@ -452,6 +927,144 @@ def cancel_room_selection(user_id):
                 SET current_occupancy = (SELECT COUNT(*) FROM beds WHERE room_id = ? AND is_occupied = 1)
                 WHERE id = ?
             ''', (selection['room_id'], selection['room_id']))
+            
+            record_inventory_change(conn, ('release', selection['bed_id'], selection['room_id']))
+
+def confirm_room_selection(user_id):
+    """Mark user's room selection as confirmed and return it."""
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('UPDATE room_selections SET is_confirmed = 1 WHERE user_id = ?', (user_id,))
+        c.execute(SELECTION_QUERY, (user_id,))
+        return c.fetchone()
+
+# Roommate group operations
+def get_roommate_group(user_id):
+    """Get the roommate group of a user with its members, or None."""
+    conn = get_db()
+    c = conn.cursor()
+    c.execute('''
+        SELECT g.id, g.name FROM roommate_groups g
+        JOIN roommate_group_members m ON m.group_id = g.id
+        WHERE m.user_id = ?
+    ''', (user_id,))
+    group = c.fetchone()
+    if not group:
+        conn.close()
+        return None
+    c.execute('''
+        SELECT u.id, u.username, u.name, rs.room_id, rs.bed_id
+        FROM roommate_group_members m
+        JOIN users u ON m.user_id = u.id
+        LEFT JOIN room_selections rs ON rs.user_id = u.id
+        WHERE m.group_id = ?
+        ORDER BY u.id
+    ''', (group['id'],))
+    members = c.fetchall()
+    conn.close()
+    return {'id': group['id'], 'name': group['name'], 'members': members}
+
+def get_free_bed_ids(room_id, limit):
+    """Ids of up to limit free beds in a room, in bed_number order."""
+    conn = get_db()
+    c = conn.cursor()
+    c.execute(
+        'SELECT id FROM beds WHERE room_id = ? AND is_occupied = 0 ORDER BY bed_number LIMIT ?',
+        (room_id, limit)
+    )
+    bed_ids = [row['id'] for row in c.fetchall()]
+    conn.close()
+    return bed_ids
+
+def select_group_room(group_id, room_id, bed_ids, operated_by=None):
+    """Claim beds in one room for every member of a roommate group.
+    
+    Runs in one BEGIN IMMEDIATE transaction; each member's claim goes
+    through select_room in a nested savepoint, and any failure rolls back
+    the whole group. Members already in the room keep their beds, the
+    others take bed_ids in order (the caller has locked them). Refuses the
+    claim if a member who would move has a confirmed selection or was
+    allocated a different room type. Returns the selections.
+    """
+    with get_db_connection(immediate=True) as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT m.user_id, u.name, rs.room_id, rs.is_confirmed, rta.room_type
+            FROM roommate_group_members m
+            JOIN users u ON u.id = m.user_id
+            LEFT JOIN room_selections rs ON rs.user_id = m.user_id
+            LEFT JOIN room_type_allocations rta ON rta.user_id = m.user_id
+            WHERE m.group_id = ?
+            ORDER BY m.user_id
+        ''', (group_id,))
+        members = c.fetchall()
+        if not members:
+            raise SelectionError('室友组不存在', 404)
+        
+        c.execute('SELECT is_available, max_capacity, room_type FROM rooms WHERE id = ?', (room_id,))
+        room = c.fetchone()
+        if not room:
+            raise SelectionError('房间不存在', 404)
+        if not room['is_available']:
+            raise SelectionError('房间不可用', 400)
+        if room['max_capacity'] < len(members):
+            raise SelectionError('房间容量不足以容纳整个室友组', 400)
+        
+        moving = [m for m in members if m['room_id'] != room_id]
+        for member in moving:
+            if member['is_confirmed']:
+                raise SelectionError(f"室友组成员{member['name']}已确认选房，不能整组调换", 409)
+            if member['room_type'] is not None and member['room_type'] != room['room_type']:
+                raise SelectionError(f"室友组成员{member['name']}分配的房型与该房间不符", 400)
+        
+        placeholders = ','.join('?' * len(bed_ids))
+        c.execute(
+            f'SELECT COUNT(*) FROM beds WHERE room_id = ? AND id IN ({placeholders})',
+            (room_id, *bed_ids)
+        )
+        if c.fetchone()[0] != len(set(bed_ids)):
+            raise SelectionError('床位不属于该房间', 400)
+        if len(bed_ids) < len(moving):
+            raise SelectionError('房间剩余床位不足', 409)
+        
+        selections = []
+        for member in members:
+            if member['room_id'] == room_id:
+                c.execute(SELECTION_QUERY, (member['user_id'],))
+                selections.append(c.fetchone())
+        for member, bed_id in zip(moving, bed_ids):
+            selections.append(select_room(member['user_id'], bed_id, operated_by=operated_by, notes='室友组整体入住'))
+        return selections
+
+# Room preference operations
+def get_room_preferences(user_id):
+    """Get a user's ranked room preferences with building and room names."""
+    conn = get_db()
+    c = conn.cursor()
+    c.execute('''
+        SELECT p.rank, p.building_id, p.room_id, p.floor,
+               COALESCE(b.name, rb.name) as building_name, r.room_number
+        FROM room_preferences p
+        LEFT JOIN buildings b ON p.building_id = b.id
+        LEFT JOIN rooms r ON p.room_id = r.id
+        LEFT JOIN buildings rb ON r.building_id = rb.id
+        WHERE p.user_id = ?
+        ORDER BY p.rank
+    ''', (user_id,))
+    preferences = c.fetchall()
+    conn.close()
+    return preferences
+
+def save_room_preferences(user_id, preferences):
+    """Replace a user's preferences with a ranked list of (building_id, room_id, floor)."""
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('DELETE FROM room_preferences WHERE user_id = ?', (user_id,))
+        c.executemany(
+            'INSERT INTO room_preferences (user_id, rank, building_id, room_id, floor) VALUES (?, ?, ?, ?, ?)',
+            [(user_id, rank, building_id, room_id, floor)
+             for rank, (building_id, room_id, floor) in enumerate(preferences, 1)]
+        )
 
 # Room type allocation operations
 def get_user_room_type(user_id):
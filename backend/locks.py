@@ -0,0 +1,280 @@
+import os
+import sqlite3
+import time
+import threading
+import uuid
+from collections import deque
+from flask import has_request_context
+from config import Config
+from . import database as db
+from . import metrics
+
+class BaseLock:
+    """Interface for named, expiring locks such as ``bed_selection:<id>``."""
+
+    def acquire(self, key, timeout=5):
+        """Try to take the lock for ``timeout`` seconds; return True on success."""
+        raise NotImplementedError
+
+    def release(self, key):
+        """Release a lock taken by this process."""
+        raise NotImplementedError
+
+    def clean_expired(self):
+        """Drop leases whose timeout has passed."""
+
+# Simple in-memory lock implementation to replace Redis
+class MemoryLock(BaseLock):
+    """Per-process lock table; only correct with a single worker process."""
+
+    def __init__(self):
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key, timeout=5):
+        with self.lock:
+            current_time = time.time()
+            if key in self.locks:
+                if current_time < self.locks[key]:
+                    return False
+            self.locks[key] = current_time + timeout
+            return True
+
+    def release(self, key):
+        with self.lock:
+            if key in self.locks:
+                del self.locks[key]
+
+    def clean_expired(self):
+        with self.lock:
+            current_time = time.time()
+            expired_keys = [k for k, v in self.locks.items() if current_time > v]
+            for key in expired_keys:
+                del self.locks[key]
+
+class SQLiteLeaseLock(BaseLock):
+    """Cross-process lock backed by the lock_leases table.
+
+    A lease is taken with a single upsert that only overwrites an expired
+    row, so every gunicorn worker sharing the database file sees the same
+    owner. Leases expire on their own if a worker dies while holding one.
+    Expired rows are pruned from acquire() at most every cleanup_interval
+    seconds, so the table stays at about the number of keys in use.
+    """
+
+    def __init__(self, cleanup_interval=60):
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.cleanup_interval = cleanup_interval
+        self.cleaned_at = time.monotonic()
+
+    def _execute(self, sql, params):
+        # Use a private pooled connection so lease commits never touch the
+        # request's own transaction
+        conn = db.get_pool().acquire()
+        try:
+            c = conn.execute(sql, params)
+            conn.commit()
+            return c.rowcount
+        except sqlite3.OperationalError as e:
+            if metrics.is_locked_error(e):
+                metrics.DB_LOCKED.inc()
+            raise
+        finally:
+            conn.close()
+
+    def acquire(self, key, timeout=5):
+        token = f'{os.getpid()}:{uuid.uuid4().hex}'
+        current_time = time.time()
+        acquired = self._execute('''
+            INSERT INTO lock_leases (lock_key, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(lock_key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE lock_leases.expires_at <= ?
+        ''', (key, token, current_time + timeout, current_time)) == 1
+        if acquired:
+            with self.lock:
+                self.tokens[key] = token
+        
+        with self.lock:
+            due = time.monotonic() - self.cleaned_at >= self.cleanup_interval
+            if due:
+                self.cleaned_at = time.monotonic()
+        if due:
+            try:
+                self.clean_expired()
+            except sqlite3.OperationalError:
+                pass  # Best effort; the next interval tries again
+        return acquired
+
+    def release(self, key):
+        with self.lock:
+            token = self.tokens.pop(key, None)
+        if token:
+            self._execute('DELETE FROM lock_leases WHERE lock_key = ? AND owner = ?', (key, token))
+
+    def clean_expired(self):
+        self._execute('DELETE FROM lock_leases WHERE expires_at <= ?', (time.time(),))
+
+class QueuedLock(BaseLock):
+    """Wrap a lock backend with a bounded FIFO wait queue per key.
+
+    Requests for a held key wait in arrival order for up to max_wait seconds
+    instead of failing at once; when max_depth requests are already queued
+    on the key, new ones fail fast. The head of the queue polls the backend,
+    so leases released by other processes are picked up within
+    poll_interval.
+    """
+
+    def __init__(self, backend, max_wait=3.0, max_depth=20, poll_interval=0.02):
+        self.backend = backend
+        self.max_wait = max_wait
+        self.max_depth = max_depth
+        self.poll_interval = poll_interval
+        self.queues = {}
+        self.cond = threading.Condition()
+        self.stats = {
+            'acquired': 0,
+            'rejected': 0,
+            'timed_out': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+        }
+
+    def acquire(self, key, timeout=5):
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        ticket = object()
+        with self.cond:
+            queue = self.queues.setdefault(key, deque())
+            if len(queue) >= self.max_depth:
+                self.stats['rejected'] += 1
+                return False
+            queue.append(ticket)
+        
+        acquired = False
+        try:
+            while True:
+                # Wait for our turn at the head of the queue
+                with self.cond:
+                    while queue[0] is not ticket:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        self.cond.wait(remaining)
+                
+                if self.backend.acquire(key, timeout):
+                    acquired = True
+                    return True
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                with self.cond:
+                    self.cond.wait(min(self.poll_interval, remaining))
+        finally:
+            waited = time.monotonic() - start
+            with self.cond:
+                queue.remove(ticket)
+                if not queue and self.queues.get(key) is queue:
+                    del self.queues[key]
+                self.stats['acquired' if acquired else 'timed_out'] += 1
+                self.stats['total_wait'] += waited
+                self.stats['max_wait'] = max(self.stats['max_wait'], waited)
+                self.cond.notify_all()
+
+    def release(self, key):
+        self.backend.release(key)
+        with self.cond:
+            self.cond.notify_all()
+
+    def clean_expired(self):
+        self.backend.clean_expired()
+
+    def metrics(self):
+        """Snapshot of queue depth and wait-time counters."""
+        with self.cond:
+            depths = [len(q) for q in self.queues.values()]
+            stats = dict(self.stats)
+        finished = stats['acquired'] + stats['timed_out']
+        return {
+            'queued_keys': len(depths),
+            'waiting_requests': sum(depths),
+            'max_queue_depth': max(depths, default=0),
+            'acquired': stats['acquired'],
+            'rejected': stats['rejected'],
+            'timed_out': stats['timed_out'],
+            'avg_wait_ms': round(stats['total_wait'] / finished * 1000, 2) if finished else 0,
+            'max_wait_ms': round(stats['max_wait'] * 1000, 2),
+        }
+
+class MeteredLock(BaseLock):
+    """Wrap a lock to export acquire results per endpoint and hold times."""
+    
+    def __init__(self, lock):
+        self.lock = lock
+        self.held = {}
+        self.held_lock = threading.Lock()
+    
+    def acquire(self, key, timeout=5):
+        acquired = self.lock.acquire(key, timeout)
+        endpoint = metrics.endpoint_label() if has_request_context() else 'none'
+        metrics.LOCK_ACQUIRES.labels(endpoint, 'acquired' if acquired else 'failed').inc()
+        if acquired:
+            with self.held_lock:
+                self.held[key] = time.monotonic()
+        return acquired
+    
+    def release(self, key):
+        self.lock.release(key)
+        with self.held_lock:
+            taken = self.held.pop(key, None)
+        if taken is not None:
+            metrics.LOCK_HOLD.observe(time.monotonic() - taken)
+    
+    def clean_expired(self):
+        self.lock.clean_expired()
+    
+    def __getattr__(self, name):
+        # Expose the wrapped lock's extras, such as QueuedLock.metrics()
+        return getattr(self.lock, name)
+
+LOCK_BACKENDS = {
+    'memory': MemoryLock,
+    'sqlite': SQLiteLeaseLock,
+}
+
+_bed_lock = LOCK_BACKENDS[Config.LOCK_BACKEND]()
+
+def worker_processes():
+    """Number of worker processes serving the app, from WEB_CONCURRENCY (set by gunicorn.conf.py)."""
+    try:
+        return max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+    except ValueError:
+        return 1
+
+def get_bed_lock():
+    """Get the lock backend guarding bed selection."""
+    return _bed_lock
+
+def init_app(app):
+    """Build the bed lock from LOCK_BACKEND and the LOCK_WAIT_* settings.
+    
+    The memory backend only excludes threads of one process, so with more
+    than one worker process the sqlite lease backend is used instead.
+    """
+    global _bed_lock
+    backend = app.config.get('LOCK_BACKEND', Config.LOCK_BACKEND)
+    workers = worker_processes()
+    if backend == 'memory' and workers > 1:
+        app.logger.warning('LOCK_BACKEND=memory does not work across %d worker processes; using sqlite', workers)
+        backend = 'sqlite'
+    lock = LOCK_BACKENDS[backend]()
+    if app.config.get('LOCK_WAIT_ENABLED', Config.LOCK_WAIT_ENABLED):
+        lock = QueuedLock(
+            lock,
+            max_wait=app.config.get('LOCK_MAX_WAIT', Config.LOCK_MAX_WAIT),
+            max_depth=app.config.get('LOCK_MAX_QUEUE_DEPTH', Config.LOCK_MAX_QUEUE_DEPTH)
+        )
+    if app.config.get('METRICS_ENABLED', Config.METRICS_ENABLED):
+        lock = MeteredLock(lock)
+    _bed_lock = lock
@@ -1,9 +1,14 @@
-import random
-from datetime import datetime
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+import queue
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, current_app, request, jsonify
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from config import Config
 from .auth import admin_required
 from . import database as db
+from . import lottery_engine
+from .availability import get_availability_index
+from .room_events import get_room_events
+from .selection_windows import get_selection_windows
 
 lottery_bp = Blueprint('lottery', __name__, url_prefix='/api/lottery')
 
@@ -14,6 +19,9 @@ def lottery_setting_to_dict(lottery):
         'lottery_time': lottery['lottery_time'],
         'is_published': bool(lottery['is_published']),
         'room_type': lottery['room_type'],
+        'selection_start': lottery['selection_start'],
+        'selection_wave_size': lottery['selection_wave_size'],
+        'selection_wave_interval': lottery['selection_wave_interval'],
         'created_at': lottery['created_at']
     }
 
@@ -103,24 +111,24 @@ def publish_lottery(setting_id):
         # Get all non-admin users
         conn = db.get_db()
         c = conn.cursor()
-        c.execute('SELECT id FROM users WHERE is_admin = 0')
-        users = c.fetchall()
+        user_ids, weights = lottery_engine.load_participants(conn, with_weights=True)
+        if not data.get('use_priority_weights', True):
+            weights = None
         
-        if not users:
+        if len(user_ids) == 0:
             return jsonify({'error': '没有可参与抽签的用户'}), 400
         
         # Check if results already exist
-        c.execute('SELECT COUNT(*) as cnt FROM lottery_results WHERE lottery_id = ?', (setting_id,))
+        c.execute('''
+            SELECT (SELECT COUNT(*) FROM lottery_results WHERE lottery_id = ?)
+                 + (SELECT COUNT(*) FROM lottery_draws WHERE lottery_id = ?) as cnt
+        ''', (setting_id, setting_id))
         if c.fetchone()['cnt'] > 0:
             conn.close()
             return jsonify({'error': '该抽签已有结果，不能重复生成'}), 400
         
         conn.close()
         
-        # Shuffle users
-        user_ids = [user['id'] for user in users]
-        random.shuffle(user_ids)
-        
         # 获取四人寝和六人寝数量
         room_4_count = data.get('room_4_count', 0)
         room_6_count = data.get('room_6_count', 0)
@@ -137,61 +145,98 @@ def publish_lottery(setting_id):
             return jsonify({'error': f'参与用户数({len(user_ids)})超过总床位数({total_beds})'}), 400
         
         with db.get_db_connection() as conn:
-            c = conn.cursor()
-            
-            # 分配用户到不同类型的寝室
-            allocated_users = 0
-            group_4_count = 0
-            group_6_count = 0
-            
-            # 先分配四人寝
-            for group in range(room_4_count):
-                start_idx = allocated_users
-                end_idx = min(allocated_users + 4, len(user_ids))
-                group_4_count += 1
-                
-                for i in range(start_idx, end_idx):
-                    c.execute(
-                        'INSERT INTO lottery_results (user_id, lottery_id, lottery_number, group_number, room_type) VALUES (?, ?, ?, ?, ?)',
-                        (user_ids[i], setting_id, i + 1, f'4-{group_4_count}', '4')
-                    )
-                
-                allocated_users = end_idx
-                if allocated_users >= len(user_ids):
-                    break
-            
-            # 再分配六人寝
-            for group in range(room_6_count):
-                start_idx = allocated_users
-                end_idx = min(allocated_users + 6, len(user_ids))
-                if start_idx >= len(user_ids):
-                    break
-                
-                group_6_count += 1
-                
-                for i in range(start_idx, end_idx):
-                    c.execute(
-                        'INSERT INTO lottery_results (user_id, lottery_id, lottery_number, group_number, room_type) VALUES (?, ?, ?, ?, ?)',
-                        (user_ids[i], setting_id, i + 1, f'6-{group_6_count}', '6')
-                    )
-                
-                allocated_users = end_idx
+            # 先分配四人寝，再分配六人寝
+            segments = [
+                ('4', total_4_beds, 4, '4-'),
+                ('6', total_6_beds, 6, '6-'),
+            ]
+            # 室友组作为整体参与抽签，并整组装入同一个四人或六人组
+            groups = lottery_engine.load_groups(conn, user_ids)
+            split_groups = 0
+            if groups:
+                (room_4_users, room_6_users), (room_4_groups, room_6_groups), split_groups = lottery_engine.draw_groups(
+                    conn, setting_id, user_ids, segments, groups, weights=weights
+                )
+            else:
+                # 不含室友组时按抽签顺序依次填满各组
+                room_4_users, room_6_users = lottery_engine.draw(conn, setting_id, user_ids, segments, weights=weights)
+                room_4_groups, room_6_groups = -(-room_4_users // 4), -(-room_6_users // 6)
             
             # Publish the lottery
-            c.execute('UPDATE lottery_settings SET is_published = 1 WHERE id = ?', (setting_id,))
+            conn.execute('UPDATE lottery_settings SET is_published = 1 WHERE id = ?', (setting_id,))
+        get_selection_windows().invalidate()
         
         return jsonify({
             'message': '抽签结果生成并公布成功',
             'total_participants': len(user_ids),
-            'allocated_participants': allocated_users,
-            'room_4_groups': group_4_count,
-            'room_6_groups': group_6_count,
+            'allocated_participants': room_4_users + room_6_users,
+            'room_4_groups': room_4_groups,
+            'room_6_groups': room_6_groups,
             'total_4_beds': total_4_beds,
-            'total_6_beds': total_6_beds
+            'total_6_beds': total_6_beds,
+            'roommate_groups': len(groups),
+            'split_roommate_groups': split_groups
         }), 200
     except Exception as e:
         return jsonify({'error': f'公布失败: {str(e)}'}), 500
 
+@lottery_bp.route('/settings/<int:setting_id>/selection-window', methods=['PUT'])
+@admin_required
+def update_selection_window(setting_id):
+    data = request.get_json()
+    if data is None:
+        return jsonify({'error': '请求数据不能为空'}), 400
+    
+    selection_start = data.get('selection_start')
+    wave_size = data.get('selection_wave_size')
+    wave_interval = data.get('selection_wave_interval')
+    if selection_start:
+        try:
+            selection_start = datetime.fromisoformat(selection_start.replace('Z', '+00:00')).isoformat()
+            wave_size = int(wave_size) if wave_size not in (None, '') else None
+            wave_interval = int(wave_interval) if wave_interval not in (None, '') else 0
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({'error': '时间或分批参数格式错误'}), 400
+        if (wave_size is not None and wave_size <= 0) or wave_interval < 0:
+            return jsonify({'error': '每批人数必须大于0，间隔分钟数不能为负'}), 400
+    else:
+        # 清空开始时间即取消分批限制
+        selection_start = wave_size = wave_interval = None
+    
+    with db.get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            UPDATE lottery_settings
+            SET selection_start = ?, selection_wave_size = ?, selection_wave_interval = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (selection_start, wave_size, wave_interval, setting_id))
+        if c.rowcount == 0:
+            return jsonify({'error': '抽签设置不存在'}), 404
+        c.execute('SELECT * FROM lottery_settings WHERE id = ?', (setting_id,))
+        setting = c.fetchone()
+    get_selection_windows().invalidate()
+    
+    return jsonify({
+        'message': '选房时段设置成功',
+        'setting': lottery_setting_to_dict(setting)
+    }), 200
+
+@lottery_bp.route('/selection-window', methods=['GET'])
+@jwt_required()
+def get_my_selection_window():
+    current_user_id = get_jwt_identity()
+    window = get_selection_windows().opens_at(current_user_id)
+    if window is None:
+        return jsonify({'restricted': False}), 200
+    
+    opens_at, rank = window
+    return jsonify({
+        'restricted': True,
+        'opens_at': opens_at.isoformat(),
+        'lottery_number': rank,
+        'is_open': opens_at <= datetime.now(opens_at.tzinfo)
+    }), 200
+
 @lottery_bp.route('/results', methods=['GET'])
 @jwt_required()
 def get_lottery_results():
@@ -204,21 +249,23 @@ def get_lottery_results():
     c = conn.cursor()
     
     if user['is_admin']:
-        if lottery_id:
-            c.execute('''
-                SELECT lr.*, u.name as user_name
-                FROM lottery_results lr
-                JOIN users u ON lr.user_id = u.id
-                WHERE lr.lottery_id = ?
-                ORDER BY lr.lottery_number
-            ''', (lottery_id,))
-        else:
-            c.execute('''
-                SELECT lr.*, u.name as user_name
-                FROM lottery_results lr
-                JOIN users u ON lr.user_id = u.id
-                ORDER BY lr.lottery_number
-            ''')
+        with lottery_engine.merged_results(conn) as results_table:
+            if lottery_id:
+                c.execute(f'''
+                    SELECT lr.*, u.name as user_name
+                    FROM {results_table} lr
+                    JOIN users u ON lr.user_id = u.id
+                    WHERE lr.lottery_id = ?
+                    ORDER BY lr.lottery_number
+                ''', (lottery_id,))
+            else:
+                c.execute(f'''
+                    SELECT lr.*, u.name as user_name
+                    FROM {results_table} lr
+                    JOIN users u ON lr.user_id = u.id
+                    ORDER BY lr.lottery_number
+                ''')
+            results = c.fetchall()
     else:
         # 学生只能查看已发布的抽签结果
         if lottery_id:
@@ -238,26 +285,19 @@ def get_lottery_results():
                 WHERE lr.user_id = ? AND ls.is_published = 1
                 ORDER BY lr.created_at DESC
             ''', (current_user_id,))
-    
-    results = c.fetchall()
+        results = c.fetchall()
+        # 紧凑模式的抽签结果直接由随机种子计算
+        results += lottery_engine.compact_results_for_user(conn, current_user_id, lottery_id)
+        results.sort(key=lambda r: r['created_at'], reverse=True)
     conn.close()
     
     return jsonify({
         'results': [lottery_result_to_dict(r) for r in results]
     }), 200
 
-@lottery_bp.route('/results/<int:result_id>', methods=['PUT'])
+@lottery_bp.route('/results/<int(signed=True):result_id>', methods=['PUT'])
 @admin_required
 def update_lottery_result(result_id):
-    conn = db.get_db()
-    c = conn.cursor()
-    c.execute('SELECT * FROM lottery_results WHERE id = ?', (result_id,))
-    result = c.fetchone()
-    conn.close()
-    
-    if not result:
-        return jsonify({'error': '抽签结果不存在'}), 404
-    
     data = request.get_json()
     if not data:
         return jsonify({'error': '请求数据不能为空'}), 400
@@ -266,6 +306,13 @@ def update_lottery_result(result_id):
         with db.get_db_connection() as conn:
             c = conn.cursor()
             
+            # A result of a compact draw: write that draw out as rows first
+            result_id = lottery_engine.materialize_result(conn, result_id)
+            c.execute('SELECT * FROM lottery_results WHERE id = ?', (result_id,))
+            result = c.fetchone()
+            if not result:
+                return jsonify({'error': '抽签结果不存在'}), 404
+            
             if 'lottery_number' in data:
                 # Check if number already exists
                 c.execute(
@@ -279,6 +326,7 @@ def update_lottery_result(result_id):
                     'UPDATE lottery_results SET lottery_number = ? WHERE id = ?',
                     (data['lottery_number'], result_id)
                 )
+                db.on_commit(conn, get_selection_windows().invalidate)
             
             if 'group_number' in data:
                 c.execute(
@@ -305,42 +353,46 @@ def update_lottery_result(result_id):
     except Exception as e:
         return jsonify({'error': '更新失败'}), 500
 
-@lottery_bp.route('/rooms/available', methods=['GET'])
-@jwt_required()
-def get_available_rooms():
-    room_type = request.args.get('room_type')
-    building_id = request.args.get('building_id', type=int)
-    
-    conn = db.get_db()
-    c = conn.cursor()
-    
-    query = '''
-        SELECT r.*, b.name as building_name,
-               (SELECT COUNT(*) FROM beds WHERE room_id = r.id AND is_occupied = 0) as available_beds
-        FROM rooms r
-        JOIN buildings b ON r.building_id = b.id
-        WHERE r.is_available = 1 AND r.current_occupancy < r.max_capacity
-    '''
-    
+def query_available_rooms(c, room_type=None, building_id=None, room_ids=None):
+    conditions = ['r.is_available = 1', 'r.current_occupancy < r.max_capacity']
     params = []
     if room_type:
-        query += ' AND r.room_type = ?'
+        conditions.append('r.room_type = ?')
         params.append(room_type)
     if building_id:
-        query += ' AND r.building_id = ?'
+        conditions.append('r.building_id = ?')
         params.append(building_id)
+    if room_ids is not None:
+        conditions.append(f'r.id IN ({",".join("?" * len(room_ids))})')
+        params.extend(room_ids)
+    where = ' AND '.join(conditions)
     
-    query += ' ORDER BY b.name, r.room_number'
-    
-    if params:
-        c.execute(query, params)
-    else:
-        c.execute(query)
-    
+    c.execute(f'''
+        SELECT r.*, b.name as building_name
+        FROM rooms r
+        JOIN buildings b ON r.building_id = b.id
+        WHERE {where}
+        ORDER BY b.name, r.room_number
+    ''', params)
     rooms = c.fetchall()
     
+    # Beds of all matching rooms in one query instead of one query per room
+    c.execute(f'''
+        SELECT bd.id, bd.room_id, bd.bed_number, bd.is_occupied, rs.user_id, u.name as user_name
+        FROM rooms r
+        JOIN beds bd ON bd.room_id = r.id
+        LEFT JOIN room_selections rs ON bd.id = rs.bed_id
+        LEFT JOIN users u ON rs.user_id = u.id
+        WHERE {where}
+        ORDER BY bd.room_id, bd.bed_number
+    ''', params)
+    beds_by_room = {}
+    for bed in c.fetchall():
+        beds_by_room.setdefault(bed['room_id'], []).append(bed)
+    
     available_rooms = []
     for room in rooms:
+        beds = beds_by_room.get(room['id'], [])
         room_data = {
             'id': room['id'],
             'building_id': room['building_id'],
@@ -350,23 +402,11 @@ def get_available_rooms():
             'max_capacity': room['max_capacity'],
             'current_occupancy': room['current_occupancy'],
             'is_available': bool(room['is_available']),
-            'available_beds': room['available_beds'],
+            'available_beds': sum(1 for bed in beds if not bed['is_occupied']),
             'beds': []
         }
         
-        # Get bed details with occupancy info
-        c.execute('''
-            SELECT b.*, rs.user_id, u.name as user_name
-            FROM beds b
-            LEFT JOIN room_selections rs ON b.id = rs.bed_id
-            LEFT JOIN users u ON rs.user_id = u.id
-            WHERE b.room_id = ?
-            ORDER BY b.bed_number
-        ''', (room['id'],))
-        
-        beds = c.fetchall()
         occupied_users = []
-        
         for bed in beds:
             bed_info = {
                 'id': bed['id'],
@@ -384,12 +424,95 @@ def get_available_rooms():
         room_data['occupied_users'] = occupied_users
         available_rooms.append(room_data)
     
+    return available_rooms
+
+@lottery_bp.route('/rooms/available', methods=['GET'])
+@jwt_required()
+def get_available_rooms():
+    room_type = request.args.get('room_type')
+    building_id = request.args.get('building_id', type=int)
+    since = request.args.get('since', type=int)
+    
+    conn = db.get_db()
+    c = conn.cursor()
+    
+    if since is not None:
+        # Incremental sync: only rooms touched after the client's version
+        c.execute('BEGIN')
+        try:
+            version, room_ids = db.get_changed_rooms(conn, since)
+            if room_ids is not None:
+                rooms = query_available_rooms(c, room_type, building_id, room_ids) if room_ids else []
+                returned = {room['id'] for room in rooms}
+                return jsonify({
+                    'rooms': rooms,
+                    'removed_room_ids': [room_id for room_id in room_ids if room_id not in returned],
+                    'version': version,
+                    'full': False
+                }), 200
+        finally:
+            conn.rollback()
+    
+    index = get_availability_index()
+    if index is not None:
+        version, rooms = index.available_rooms(room_type, building_id)
+    else:
+        c.execute('BEGIN')
+        try:
+            c.execute('SELECT version FROM inventory_version WHERE id = 1')
+            version = c.fetchone()['version']
+            rooms = query_available_rooms(c, room_type, building_id)
+        finally:
+            conn.rollback()
+    
     conn.close()
     
     return jsonify({
-        'rooms': available_rooms
+        'rooms': rooms,
+        'version': version,
+        'full': True
     }), 200
 
+# 推送令牌的 scope 声明；app.py 中的校验保证它只能用于 stream_rooms
+ROOM_STREAM_SCOPE = 'room_stream'
+
+@lottery_bp.route('/rooms/stream-token', methods=['POST'])
+@jwt_required()
+def get_room_stream_token():
+    expires = current_app.config.get('ROOM_STREAM_TOKEN_EXPIRES', Config.ROOM_STREAM_TOKEN_EXPIRES)
+    token = create_access_token(
+        identity=get_jwt_identity(),
+        expires_delta=timedelta(seconds=expires),
+        additional_claims={'scope': ROOM_STREAM_SCOPE}
+    )
+    return jsonify({'token': token, 'expires_in': expires}), 200
+
+@lottery_bp.route('/rooms/stream', methods=['GET'])
+@jwt_required(locations=['query_string'])  # EventSource 无法设置请求头，短期推送令牌通过 ?jwt= 传递
+def stream_rooms():
+    events = get_room_events()
+    keepalive = current_app.config.get('ROOM_STREAM_KEEPALIVE', 15)
+    subscription = events.subscribe()
+    if subscription is None:
+        # 每个推送连接占用一个 worker 线程；超出上限的客户端继续用 ?since= 轮询
+        return jsonify({'error': '实时推送连接已满，请稍后重试'}), 503, {'Retry-After': '60'}
+    
+    def generate():
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                yield subscription.get(timeout=keepalive)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the server closes the response, even if the body was never started
+    response.call_on_close(lambda: events.unsubscribe(subscription))
+    return response
+
 @lottery_bp.route('/my-selection', methods=['GET'])
 @jwt_required()
 def get_my_selection():
@@ -0,0 +1,522 @@
+import heapq
+import itertools
+import json
+import secrets
+import threading
+from contextlib import contextmanager
+import numpy as np
+from config import Config
+
+def load_participants(conn, with_weights=False):
+    """Ids of all non-admin users as an int64 array.
+
+    With with_weights=True returns (ids, priority weights) instead.
+    """
+    c = conn.cursor()
+    c.row_factory = None  # plain tuples are much cheaper than sqlite3.Row here
+    if not with_weights:
+        c.execute('SELECT id FROM users WHERE is_admin = 0 ORDER BY id')
+        return np.fromiter((row[0] for row in c), dtype=np.int64)
+    c.execute('SELECT id, priority_weight FROM users WHERE is_admin = 0 ORDER BY id')
+    rows = np.array(c.fetchall(), dtype=np.float64).reshape(-1, 2)
+    return rows[:, 0].astype(np.int64), rows[:, 1]
+
+def shuffle(user_ids, rng=None):
+    """Random draw order; position i gets lottery_number i + 1."""
+    if rng is None:
+        rng = np.random.default_rng()
+    return rng.permutation(user_ids)
+
+def weighted_shuffle(user_ids, weights, rng=None):
+    """Weighted random draw order (Efraimidis-Spirakis).
+
+    Each participant gets the key E / w with E ~ Exp(1); sorting by key is
+    the same as repeatedly drawing without replacement with probability
+    proportional to weight, so a user with weight 3 is three times as
+    likely as a weight-1 user to come first.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    keys = rng.standard_exponential(len(user_ids)) / np.asarray(weights, dtype=np.float64)
+    return np.asarray(user_ids)[np.argsort(keys, kind='stable')]
+
+def is_uniform(weights):
+    """True when weights is None or every participant has the same weight."""
+    return weights is None or len(weights) == 0 or bool(np.all(weights == weights[0]))
+
+def segment_sizes(count, segments):
+    """Number of draw positions each segment receives when count users are drawn."""
+    sizes = []
+    remaining = count
+    for room_type, seats, group_size, group_prefix in segments:
+        size = max(0, min(seats, remaining))
+        sizes.append(size)
+        remaining -= size
+    return sizes
+
+def assign(count, segments):
+    """Split the first draw positions into consecutive room-type segments.
+
+    segments is a list of (room_type, seats, group_size, group_prefix)
+    tuples filled in order until count positions are used. Positions in a
+    segment are grouped by group_size and labelled f'{group_prefix}{n}',
+    or with the plain group number when group_prefix is None; group_size
+    None leaves group_number empty. Returns (room_types, group_numbers,
+    sizes): one room type and group per allocated position, and the number
+    of positions each segment received.
+    """
+    room_types = []
+    group_numbers = []
+    sizes = segment_sizes(count, segments)
+    for (room_type, seats, group_size, group_prefix), size in zip(segments, sizes):
+        if size == 0:
+            continue
+        room_types.extend(itertools.repeat(room_type, size))
+        if group_size:
+            groups = (np.arange(size) // group_size + 1).tolist()
+            if group_prefix is not None:
+                groups = [f'{group_prefix}{group}' for group in groups]
+            group_numbers.extend(groups)
+        else:
+            group_numbers.extend(itertools.repeat(None, size))
+    return room_types, group_numbers, sizes
+
+def write_results(conn, lottery_id, order, room_types, group_numbers):
+    """Insert one lottery_results row per assigned position with a single executemany."""
+    allocated = len(room_types)
+    # Insert in user id order so the (user_id, lottery_id) index grows
+    # sequentially instead of taking a random page per row
+    by_user = np.argsort(order[:allocated], kind='stable').tolist()
+    user_ids = order[:allocated].tolist()
+    conn.executemany(
+        'INSERT INTO lottery_results (user_id, lottery_id, lottery_number, group_number, room_type) VALUES (?, ?, ?, ?, ?)',
+        ((user_ids[i], lottery_id, i + 1, group_numbers[i], room_types[i]) for i in by_user)
+    )
+    return allocated
+
+def load_groups(conn, user_ids):
+    """Roommate groups restricted to the given participants.
+    
+    Returns {group_id: [user_id, ...]} for groups with at least two
+    participating members; members outside user_ids are dropped.
+    """
+    participants = set(np.asarray(user_ids).tolist())
+    groups = {}
+    c = conn.cursor()
+    c.row_factory = None
+    c.execute('SELECT group_id, user_id FROM roommate_group_members ORDER BY group_id, user_id')
+    for group_id, user_id in c:
+        if user_id in participants:
+            groups.setdefault(group_id, []).append(user_id)
+    return {group_id: members for group_id, members in groups.items() if len(members) > 1}
+
+def _bins(segments):
+    """(segment index, group label, capacity) of every group slot in the segments."""
+    bins = []
+    for index, (room_type, seats, group_size, group_prefix) in enumerate(segments):
+        size = group_size or seats
+        for number in range(-(-seats // size) if size else 0):
+            label = None
+            if group_size:
+                label = f'{group_prefix}{number + 1}' if group_prefix is not None else number + 1
+            bins.append((index, label, min(size, seats - number * size)))
+    return bins
+
+def pack(units, segments):
+    """First-fit the drawn units into the group slots of the segments.
+    
+    units is a list of member lists in draw order. Each unit goes to the
+    lowest-numbered slot with room for all its members, found through one
+    heap of slot indexes per remaining capacity. A unit that fits nowhere
+    is split and its members placed one by one. Without multi-member units
+    this is the same as slicing the draw order. Returns (order, room_types,
+    group_numbers, sizes, used, split): the placed users in lottery-number
+    order, their room types and groups, the positions and the non-empty
+    groups per segment and the number of units that had to be split.
+    """
+    bins = _bins(segments)
+    heaps = {}  # remaining capacity -> heap of opened slot indexes
+    opened = 0
+    members = [[] for _ in bins]
+    
+    def place(unit):
+        nonlocal opened
+        best = None
+        for capacity, heap in heaps.items():
+            if capacity >= len(unit) and heap and (best is None or heap[0] < best[1]):
+                best = (capacity, heap[0])
+        # The first unopened slot that is large enough
+        candidate = opened
+        while candidate < len(bins) and bins[candidate][2] < len(unit):
+            candidate += 1
+        if candidate < len(bins) and (best is None or candidate < best[1]):
+            # Slots skipped on the way stay available for smaller units
+            for skipped in range(opened, candidate):
+                heapq.heappush(heaps.setdefault(bins[skipped][2], []), skipped)
+            opened = candidate + 1
+            index, remaining = candidate, bins[candidate][2]
+        elif best is not None:
+            index, remaining = best[1], best[0]
+            heapq.heappop(heaps[remaining])
+        else:
+            return False
+        members[index].extend(unit)
+        if remaining > len(unit):
+            heapq.heappush(heaps.setdefault(remaining - len(unit), []), index)
+        return True
+    
+    split = 0
+    for unit in units:
+        if not place(unit):
+            if len(unit) > 1:
+                split += 1
+                for user_id in unit:
+                    place([user_id])
+    
+    order, room_types, group_numbers = [], [], []
+    sizes = [0] * len(segments)
+    used = [0] * len(segments)
+    for (segment, label, capacity), placed in zip(bins, members):
+        order.extend(placed)
+        room_types.extend(itertools.repeat(segments[segment][0], len(placed)))
+        group_numbers.extend(itertools.repeat(label, len(placed)))
+        sizes[segment] += len(placed)
+        used[segment] += bool(placed)
+    return np.array(order, dtype=np.int64), room_types, group_numbers, sizes, used, split
+
+def draw_groups(conn, lottery_id, user_ids, segments, groups, rng=None, weights=None):
+    """Draw roommate groups as units and pack them into the segment groups.
+    
+    Every group from load_groups() and every other participant is one unit;
+    units are shuffled (weighted by the mean member weight when weights
+    differ) and packed with pack(). Always writes lottery_results rows.
+    Returns (sizes, used, split) like pack().
+    """
+    grouped = {user_id for members in groups.values() for user_id in members}
+    user_ids = np.asarray(user_ids)
+    units = list(groups.values()) + [[user_id] for user_id in user_ids.tolist() if user_id not in grouped]
+    indexes = np.arange(len(units))
+    if is_uniform(weights):
+        indexes = shuffle(indexes, rng)
+    else:
+        weight_of = dict(zip(user_ids.tolist(), np.asarray(weights, dtype=np.float64).tolist()))
+        unit_weights = [sum(weight_of[u] for u in unit) / len(unit) for unit in units]
+        indexes = weighted_shuffle(indexes, unit_weights, rng)
+    
+    order, room_types, group_numbers, sizes, used, split = pack([units[i] for i in indexes.tolist()], segments)
+    conn.execute('DELETE FROM lottery_draws WHERE lottery_id = ?', (lottery_id,))
+    write_results(conn, lottery_id, order, room_types, group_numbers)
+    return sizes, used, split
+
+_compact = Config.LOTTERY_COMPACT_ENABLED
+
+def draw(conn, lottery_id, user_ids, segments, rng=None, weights=None):
+    """Shuffle user_ids, assign segments and write the results.
+
+    With priority weights that are not all equal the order is a weighted
+    permutation. Stores a compact draw instead when LOTTERY_COMPACT_ENABLED
+    is set and the draw is unweighted (a seeded permutation cannot express
+    weights). Runs inside the caller's transaction and returns the number
+    of positions each segment received.
+    """
+    uniform = is_uniform(weights)
+    if _compact and uniform:
+        return draw_compact(conn, lottery_id, user_ids, segments)
+    conn.execute('DELETE FROM lottery_draws WHERE lottery_id = ?', (lottery_id,))
+    order = shuffle(user_ids, rng) if uniform else weighted_shuffle(user_ids, weights, rng)
+    room_types, group_numbers, sizes = assign(len(order), segments)
+    write_results(conn, lottery_id, order, room_types, group_numbers)
+    return sizes
+
+# Compact lotteries: instead of one lottery_results row per participant a
+# draw stores its seed and the frozen participant list in lottery_draws.
+# Ranks come from a keyed Feistel permutation over participant indexes, so
+# one user's result is computed without touching the other participants.
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+def _mix(values, key):
+    # splitmix64 finalizer; uint64 arithmetic wraps on purpose
+    with np.errstate(over='ignore'):
+        x = (values ^ key) * np.uint64(0x9E3779B97F4A7C15)
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return x & _MASK64
+
+def _mix_int(value, key):
+    # Same as _mix for a single Python int
+    x = ((value ^ key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    x ^= x >> 30
+    x = (x * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x ^= x >> 27
+    x = (x * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return x ^ (x >> 31)
+
+class FeistelPermutation:
+    """Keyed bijection on range(n) built from a balanced Feistel network.
+
+    The network permutes the smallest even-bit domain covering n; values
+    that land outside range(n) are encrypted again (cycle walking), which
+    keeps it a bijection on range(n). forward() and inverse() accept a
+    scalar (pure Python, a few microseconds) or an array (vectorized).
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, n, seed):
+        self.n = n
+        bits = max(2, int(n - 1).bit_length())
+        self.half = np.uint64((bits + 1) // 2)
+        self.mask = np.uint64((1 << int(self.half)) - 1)
+        seeds = np.arange(self.ROUNDS, dtype=np.uint64) + np.uint64(seed & 0xFFFFFFFFFFFFFFFF)
+        self.keys = _mix(seeds, np.uint64(0x5DEECE66D)).tolist()
+
+    def _encrypt(self, x):
+        left, right = x >> self.half, x & self.mask
+        for key in self.keys:
+            left, right = right, left ^ (_mix(right, np.uint64(key)) & self.mask)
+        return (left << self.half) | right
+
+    def _decrypt(self, x):
+        left, right = x >> self.half, x & self.mask
+        for key in reversed(self.keys):
+            left, right = right ^ (_mix(left, np.uint64(key)) & self.mask), left
+        return (left << self.half) | right
+
+    def _walk_int(self, value, inverse):
+        half, mask = int(self.half), int(self.mask)
+        keys = self.keys[::-1] if inverse else self.keys
+        while True:
+            left, right = value >> half, value & mask
+            for key in keys:
+                if inverse:
+                    left, right = right ^ (_mix_int(left, key) & mask), left
+                else:
+                    left, right = right, left ^ (_mix_int(right, key) & mask)
+            value = (left << half) | right
+            if value < self.n:
+                return value
+
+    def _walk(self, values, step):
+        x = step(np.asarray(values, dtype=np.uint64))
+        outside = x >= np.uint64(self.n)
+        while outside.any():
+            x[outside] = step(x[outside])
+            outside = x >= np.uint64(self.n)
+        return x.astype(np.int64)
+
+    def forward(self, index):
+        """Draw position (0-based) of the participant at index."""
+        if np.ndim(index) == 0:
+            return self._walk_int(int(index), inverse=False)
+        return self._walk(index, self._encrypt)
+
+    def inverse(self, position):
+        """Participant index drawn at position (0-based)."""
+        if np.ndim(position) == 0:
+            return self._walk_int(int(position), inverse=True)
+        return self._walk(position, self._decrypt)
+
+def position_result(position, segments):
+    """(room_type, group_number) for a 0-based draw position, or None if unallocated."""
+    offset = position
+    for room_type, seats, group_size, group_prefix in segments:
+        if offset < seats:
+            if not group_size:
+                return room_type, None
+            group = offset // group_size + 1
+            return room_type, group if group_prefix is None else f'{group_prefix}{group}'
+        offset -= seats
+    return None
+
+def draw_compact(conn, lottery_id, user_ids, segments, seed=None):
+    """Store a compact draw (seed and frozen participants) instead of rows.
+
+    Replaces any previous draw of the lottery and returns the number of
+    positions each segment received, like draw().
+    """
+    if seed is None:
+        seed = secrets.randbits(63)
+    participants = np.sort(np.asarray(user_ids, dtype=np.int64))
+    conn.execute('DELETE FROM lottery_results WHERE lottery_id = ?', (lottery_id,))
+    conn.execute(
+        'INSERT OR REPLACE INTO lottery_draws (lottery_id, seed, participants, segments) VALUES (?, ?, ?, ?)',
+        (lottery_id, seed, participants.astype('<i8').tobytes(), json.dumps(segments))
+    )
+    return segment_sizes(len(participants), segments)
+
+# lottery_id -> (seed, participants, segments, permutation)
+_draw_cache = {}
+_draw_cache_lock = threading.Lock()
+
+def _load_draw(conn, lottery_id, seed):
+    with _draw_cache_lock:
+        cached = _draw_cache.get(lottery_id)
+        if cached and cached[0] == seed:
+            return cached
+    c = conn.execute('SELECT seed, participants, segments FROM lottery_draws WHERE lottery_id = ?', (lottery_id,))
+    row = c.fetchone()
+    if not row:
+        return None
+    participants = np.frombuffer(row['participants'], dtype='<i8').astype(np.int64)
+    segments = [tuple(segment) for segment in json.loads(row['segments'])]
+    entry = (row['seed'], participants, segments, FeistelPermutation(len(participants), row['seed']))
+    with _draw_cache_lock:
+        _draw_cache[lottery_id] = entry
+    return entry
+
+def get_compact_draw(conn, lottery_id):
+    """(seed, participants, segments, permutation) of a compact draw, or None."""
+    row = conn.execute('SELECT seed FROM lottery_draws WHERE lottery_id = ?', (lottery_id,)).fetchone()
+    return _load_draw(conn, lottery_id, row['seed']) if row else None
+
+def compact_results_for_user(conn, user_id, lottery_id=None, published_only=True):
+    """Compute a user's results in compact lotteries without any result rows.
+
+    Returns dicts shaped like lottery_results rows joined with the user and
+    lottery names; id is None because nothing is stored.
+    """
+    query = '''
+        SELECT d.lottery_id, d.seed, d.created_at, ls.lottery_name, ls.is_published, u.name as user_name
+        FROM lottery_draws d
+        JOIN lottery_settings ls ON d.lottery_id = ls.id
+        JOIN users u ON u.id = ?
+        WHERE 1 = 1
+    '''
+    params = [user_id]
+    if published_only:
+        query += ' AND ls.is_published = 1'
+    if lottery_id:
+        query += ' AND d.lottery_id = ?'
+        params.append(lottery_id)
+    results = []
+    for draw_row in conn.execute(query, params).fetchall():
+        entry = _load_draw(conn, draw_row['lottery_id'], draw_row['seed'])
+        if entry is None:
+            continue
+        seed, participants, segments, permutation = entry
+        index = int(np.searchsorted(participants, user_id))
+        if index >= len(participants) or participants[index] != user_id:
+            continue
+        position = permutation.forward(index)
+        assigned = position_result(position, segments)
+        if assigned is None:
+            continue
+        results.append({
+            'id': None,
+            'user_id': user_id,
+            'user_name': draw_row['user_name'],
+            'lottery_id': draw_row['lottery_id'],
+            'lottery_number': position + 1,
+            'group_number': assigned[1],
+            'room_type': assigned[0],
+            'created_at': draw_row['created_at'],
+            'is_published': draw_row['is_published'],
+            'lottery_name': draw_row['lottery_name']
+        })
+    return results
+
+def materialize(conn, lottery_id):
+    """Turn a compact draw into ordinary lottery_results rows.
+
+    Used before a result of the draw is edited; a no-op for lotteries that
+    already have rows. Runs inside the caller's transaction.
+    """
+    c = conn.execute('SELECT seed FROM lottery_draws WHERE lottery_id = ?', (lottery_id,))
+    row = c.fetchone()
+    if not row:
+        return False
+    seed, participants, segments, permutation = _load_draw(conn, lottery_id, row['seed'])
+    order = np.empty_like(participants)
+    order[permutation.forward(np.arange(len(participants)))] = participants
+    room_types, group_numbers, sizes = assign(len(order), segments)
+    write_results(conn, lottery_id, order, room_types, group_numbers)
+    conn.execute('DELETE FROM lottery_draws WHERE lottery_id = ?', (lottery_id,))
+    return True
+
+# Computed results of compact draws get negative ids that name the lottery
+# and the user, so an admin can pick one for editing like a stored row
+COMPACT_ID_STRIDE = 1 << 32
+
+def compact_result_id(lottery_id, user_id):
+    return -(lottery_id * COMPACT_ID_STRIDE + user_id)
+
+def materialize_result(conn, result_id):
+    """lottery_results id for result_id, materializing its compact draw first.
+    
+    Stored ids pass through unchanged. A compact_result_id() materializes
+    only the draw it belongs to, inside the caller's transaction, and
+    returns the id of the user's new row (None if there is none).
+    """
+    if result_id >= 0:
+        return result_id
+    lottery_id, user_id = divmod(-result_id, COMPACT_ID_STRIDE)
+    materialize(conn, lottery_id)
+    row = conn.execute('SELECT id FROM lottery_results WHERE lottery_id = ? AND user_id = ?',
+                       (lottery_id, user_id)).fetchone()
+    return row['id'] if row else None
+
+def compact_rows(conn):
+    """lottery_results rows of every compact draw, computed from the seeds.
+    
+    Returns (id, user_id, lottery_id, lottery_number, group_number,
+    room_type, created_at) tuples with compact_result_id() ids.
+    """
+    rows = []
+    for draw_row in conn.execute('SELECT lottery_id, seed, created_at FROM lottery_draws').fetchall():
+        lottery_id = draw_row['lottery_id']
+        entry = _load_draw(conn, lottery_id, draw_row['seed'])
+        if entry is None:
+            continue
+        seed, participants, segments, permutation = entry
+        room_types, group_numbers, sizes = assign(len(participants), segments)
+        user_ids = participants[permutation.inverse(np.arange(len(room_types)))].tolist()
+        rows.extend(
+            (compact_result_id(lottery_id, user_id), user_id, lottery_id, position + 1,
+             group_numbers[position], room_types[position], draw_row['created_at'])
+            for position, user_id in enumerate(user_ids)
+        )
+    return rows
+
+RESULT_COLUMNS = 'id, user_id, lottery_id, lottery_number, group_number, room_type, created_at'
+
+@contextmanager
+def merged_results(conn):
+    """Name of a table with the stored and the compact lottery results.
+    
+    For report queries that join lottery_results in SQL. Without compact
+    draws this is just 'lottery_results'. Otherwise the compact rows are
+    computed into a temp table of conn (temp_store is MEMORY, nothing
+    reaches the database file) and the temp view 'all_lottery_results'
+    over both is used; the temp table is emptied again afterwards.
+    """
+    rows = compact_rows(conn)
+    if not rows:
+        yield 'lottery_results'
+        return
+    own_transaction = not conn.in_transaction
+    conn.execute("""CREATE TEMP TABLE IF NOT EXISTS compact_lottery_results (
+        id INTEGER, user_id INTEGER, lottery_id INTEGER, lottery_number INTEGER,
+        group_number TEXT, room_type TEXT, created_at DATETIME
+    )""")
+    conn.execute(f"""CREATE TEMP VIEW IF NOT EXISTS all_lottery_results AS
+        SELECT {RESULT_COLUMNS} FROM main.lottery_results
+        UNION ALL
+        SELECT {RESULT_COLUMNS} FROM temp.compact_lottery_results""")
+    conn.execute('DELETE FROM temp.compact_lottery_results')
+    conn.executemany(f'INSERT INTO temp.compact_lottery_results ({RESULT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    try:
+        yield 'all_lottery_results'
+    finally:
+        conn.execute('DELETE FROM temp.compact_lottery_results')
+        if own_transaction:
+            # Only temp rows were written; ends the transaction they opened
+            conn.commit()
+
+def init_app(app):
+    """Read LOTTERY_COMPACT_ENABLED from the app config."""
+    global _compact
+    _compact = app.config.get('LOTTERY_COMPACT_ENABLED', Config.LOTTERY_COMPACT_ENABLED)
@@ -0,0 +1,86 @@
+import os
+import time
+from flask import g, request, Response
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+from config import Config
+
+# Under gunicorn PROMETHEUS_MULTIPROC_DIR must name an empty directory before
+# the workers start: every process then writes its samples to files there
+# and /metrics on any worker adds them up. gunicorn.conf.py sets and empties
+# it and marks exited workers dead so their live gauges are dropped.
+
+REQUEST_LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests by endpoint, method and status',
+    ['endpoint', 'method', 'status']
+)
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time until the response is returned',
+    ['endpoint', 'method'], buckets=REQUEST_LATENCY_BUCKETS
+)
+IN_PROGRESS = Gauge(
+    'http_requests_in_progress', 'Requests being handled', multiprocess_mode='livesum'
+)
+LOCK_ACQUIRES = Counter(
+    'bed_lock_acquire_total', 'Bed lock acquire attempts by endpoint and result',
+    ['endpoint', 'result']
+)
+LOCK_HOLD = Histogram(
+    'bed_lock_hold_seconds', 'Time between taking and releasing a bed lock',
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+)
+DB_CONNECTIONS = Counter('sqlite_connections_opened_total', 'SQLite connections opened by the pool')
+DB_TRANSACTIONS = Histogram(
+    'sqlite_transaction_duration_seconds', 'Outermost get_db_connection() blocks, BEGIN to COMMIT or ROLLBACK',
+    ['mode', 'outcome'], buckets=(.0005, .001, .005, .01, .025, .05, .1, .25, .5, 1, 5)
+)
+DB_LOCKED = Counter(
+    'sqlite_locked_errors_total', 'Statements that gave up with "database is locked" after busy_timeout'
+)
+BCRYPT = Histogram(
+    'bcrypt_duration_seconds', 'Time spent hashing and checking passwords', ['operation'],
+    buckets=(.001, .005, .01, .05, .1, .25, .5, 1, 2.5)
+)
+
+def endpoint_label():
+    """Flask endpoint of the current request, e.g. 'room_selection.select_room'."""
+    return request.endpoint or 'unmatched'
+
+def is_locked_error(error):
+    return 'database is locked' in str(error)
+
+def _start():
+    g.metrics_started = time.perf_counter()
+    IN_PROGRESS.inc()
+
+def _finish(response):
+    started = g.get('metrics_started')
+    if started is not None:
+        endpoint = endpoint_label()
+        REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint, request.method, response.status_code).inc()
+    return response
+
+def _teardown(error=None):
+    if g.pop('metrics_started', None) is not None:
+        IN_PROGRESS.dec()
+
+def metrics_view():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+def init_app(app):
+    """Serve /metrics and time every request when METRICS_ENABLED is set."""
+    if not app.config.get('METRICS_ENABLED', Config.METRICS_ENABLED):
+        return
+    app.before_request(_start)
+    app.after_request(_finish)
+    app.teardown_request(_teardown)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
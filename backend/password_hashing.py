@@ -0,0 +1,101 @@
+import itertools
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from config import Config
+
+BCRYPT_HASH = re.compile(r'^\$2[aby]\$(\d{2})\$[./A-Za-z0-9]{53}$')
+
+def is_bcrypt_hash(value):
+    """True for a well-formed bcrypt hash such as '$2b$12$' plus 53 characters."""
+    match = BCRYPT_HASH.match(value)
+    return match is not None and 4 <= int(match.group(1)) <= 31
+
+def hash_cost(password_hash):
+    """Cost factor of a bcrypt hash, or None if it is not one."""
+    match = BCRYPT_HASH.match(password_hash or '')
+    return int(match.group(1)) if match else None
+
+def _hash(password, rounds):
+    """Worker side: hash one password and report the time it took."""
+    start = time.perf_counter()
+    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    return password_hash, time.perf_counter() - start
+
+def default_workers():
+    """This process's share of the CPUs when WEB_CONCURRENCY gunicorn workers run side by side."""
+    return max(1, (os.cpu_count() or 1) // max(1, int(os.environ.get('WEB_CONCURRENCY', 1))))
+
+class PasswordHasher:
+    """bcrypt hashing on a pool of worker processes.
+
+    bcrypt is CPU-bound by design, so hashing a whole import on the request
+    thread uses one core. The pool has workers processes, by default this
+    process's share of the CPUs (default_workers()), and hash_many() spreads
+    a batch over all of them. A single hash() runs inline: bcrypt releases
+    the GIL, and a login gains nothing from a round trip to another process.
+    The pool is started on first use with the forkserver method where
+    available, which avoids forking a process that is already running
+    threads. With workers=1 everything is hashed inline. New hashes use cost
+    factor rounds. Returns (hash, seconds) pairs so the caller can record
+    the bcrypt time itself.
+    """
+
+    def __init__(self, workers=0, rounds=12):
+        self.workers = workers or default_workers()
+        self.rounds = rounds
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=context)
+            return self.executor
+
+    def hash_many(self, passwords):
+        """Hash a list of passwords in parallel; returns [(hash, seconds)] in the same order."""
+        if self.workers == 1 or len(passwords) == 0:
+            return [_hash(password, self.rounds) for password in passwords]
+        # Hand out a few chunks per process so the slowest one does not lag far behind
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._executor().map(_hash, passwords, itertools.repeat(self.rounds), chunksize=chunksize))
+
+    def hash(self, password):
+        return _hash(password, self.rounds)
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+def get_password_hasher():
+    """Get the process-wide password hasher, sized from PASSWORD_HASH_WORKERS."""
+    global _hasher
+    with _hasher_lock:
+        if _hasher is None:
+            _hasher = PasswordHasher(Config.PASSWORD_HASH_WORKERS, Config.BCRYPT_ROUNDS)
+        return _hasher
+
+def init_app(app):
+    """Size the hasher and set the bcrypt cost from the app config; the pool starts on first use."""
+    global _hasher
+    workers = app.config.get('PASSWORD_HASH_WORKERS', Config.PASSWORD_HASH_WORKERS)
+    rounds = app.config.get('BCRYPT_ROUNDS', Config.BCRYPT_ROUNDS)
+    with _hasher_lock:
+        if _hasher is not None:
+            _hasher.rounds = rounds
+            if _hasher.workers == (workers or default_workers()):
+                return
+            _hasher.shutdown()
+        _hasher = PasswordHasher(workers, rounds)
@@ -0,0 +1,193 @@
+import json
+import queue
+import threading
+import time
+from config import Config
+from . import database as db
+
+def format_event(event, data, event_id=None):
+    """Format one Server-Sent Events message."""
+    message = ''
+    if event_id is not None:
+        message += f'id: {event_id}\n'
+    message += f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+    return message
+
+class RoomEventBroadcaster:
+    """Fan committed bed changes out to Server-Sent Events subscribers.
+
+    Changes committed in this process arrive through the inventory listener,
+    which only queues them; a dispatcher thread looks up the beds and turns
+    them into 'bed' deltas (bed id, occupied flag, room occupancy), so the
+    committing request never waits for that query. Room edits become
+    'resync' events, telling clients to reload the list. A background
+    poller watches inventory_version for commits from other worker
+    processes and sends 'resync' for those as well.
+    
+    Every open stream holds a server thread, so at most max_subscribers
+    clients are served per process; subscribe() refuses the rest, which
+    keep polling ?since= instead.
+    """
+
+    def __init__(self, app=None, poll_interval=2.0, queue_size=256, max_subscribers=4):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.version = 0
+        self.pending = queue.Queue(queue_size)
+        self.poller = None
+        self.dispatcher = None
+
+    def subscribe(self):
+        """Register a new client and return its message queue, or None when max_subscribers are connected."""
+        subscription = queue.Queue(self.queue_size)
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            self.subscribers.add(subscription)
+            if self.poller is None or not self.poller.is_alive():
+                self.poller = threading.Thread(target=self._poll, name='room-events-poller', daemon=True)
+                self.poller.start()
+            if self.dispatcher is None or not self.dispatcher.is_alive():
+                self.dispatcher = threading.Thread(target=self._dispatch, name='room-events-dispatcher', daemon=True)
+                self.dispatcher.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def _broadcast(self, messages):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                for message in messages:
+                    subscription.put_nowait(message)
+            except queue.Full:
+                # Slow client: drop its backlog and make it reload instead
+                while not subscription.empty():
+                    try:
+                        subscription.get_nowait()
+                    except queue.Empty:
+                        break
+                subscription.put_nowait(format_event('resync', {'version': self.version}))
+
+    def _bed_states(self, bed_ids):
+        conn = db.get_pool().acquire()
+        try:
+            placeholders = ','.join('?' * len(bed_ids))
+            c = conn.execute(f'''
+                SELECT bd.id, bd.room_id, bd.bed_number, bd.is_occupied,
+                       r.current_occupancy, r.max_capacity,
+                       (SELECT COUNT(*) FROM beds WHERE room_id = r.id AND is_occupied = 0) as available_beds
+                FROM beds bd
+                JOIN rooms r ON bd.room_id = r.id
+                WHERE bd.id IN ({placeholders})
+            ''', bed_ids)
+            return {row['id']: row for row in c.fetchall()}
+        finally:
+            conn.close()
+
+    def on_change(self, version, changes):
+        """Inventory listener: queue committed changes for the dispatcher thread."""
+        with self.lock:
+            self.version = max(self.version, version)
+            if not self.subscribers:
+                return
+        if len(changes) >= self.queue_size:
+            # Bulk write (batch assignment, room import): one reload beats a flood of deltas
+            changes = None
+        try:
+            self.pending.put_nowait((version, changes))
+        except queue.Full:
+            # Dispatcher far behind: skip the deltas and make clients reload
+            self._broadcast([format_event('resync', {'version': version}, version)])
+    
+    def _messages(self, version, changes):
+        if changes is None:
+            return [format_event('resync', {'version': version}, version)]
+        bed_ids = [change[1] for change in changes if change[0] in ('occupy', 'release')]
+        states = self._bed_states(bed_ids) if bed_ids else {}
+        messages = []
+        for change in changes:
+            if change[0] in ('occupy', 'release'):
+                state = states.get(change[1])
+                if state is None:
+                    continue
+                messages.append(format_event('bed', {
+                    'bed_id': state['id'],
+                    'bed_number': state['bed_number'],
+                    'room_id': state['room_id'],
+                    'is_occupied': bool(state['is_occupied']),
+                    'user_name': change[4] if change[0] == 'occupy' else None,
+                    'current_occupancy': state['current_occupancy'],
+                    'max_capacity': state['max_capacity'],
+                    'available_beds': state['available_beds']
+                }, version))
+            else:
+                messages.append(format_event('resync', {'version': version}, version))
+        return messages
+    
+    def _dispatch(self):
+        while True:
+            try:
+                version, changes = self.pending.get(timeout=self.poll_interval)
+            except queue.Empty:
+                with self.lock:
+                    if not self.subscribers:
+                        self.dispatcher = None
+                        return
+                continue
+            try:
+                messages = self._messages(version, changes)
+            except Exception:
+                if self.app is not None:
+                    self.app.logger.exception('room event dispatch failed')
+                messages = [format_event('resync', {'version': version}, version)]
+            self._broadcast(messages)
+
+    def _poll(self):
+        conn = db.get_pool().acquire()
+        data_version = None
+        lagging = None
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.poller = None
+                    conn.close()
+                    return
+            current = conn.execute('PRAGMA data_version').fetchone()[0]
+            if current != data_version or lagging is not None:
+                data_version = current
+                version = conn.execute('SELECT version FROM inventory_version WHERE id = 1').fetchone()['version']
+                if version <= self.version:
+                    lagging = None
+                elif lagging is not None and lagging <= version:
+                    # Still behind after a full interval: written by another process
+                    with self.lock:
+                        self.version = max(self.version, version)
+                    self._broadcast([format_event('resync', {'version': version}, version)])
+                    lagging = None
+                else:
+                    # Local commit hooks may just not have run yet
+                    lagging = version
+            time.sleep(self.poll_interval)
+
+_broadcaster = None
+
+def get_room_events():
+    """Get the process-wide room event broadcaster."""
+    return _broadcaster
+
+def init_app(app):
+    """Create the broadcaster and subscribe it to inventory changes."""
+    global _broadcaster
+    if _broadcaster is None:
+        _broadcaster = RoomEventBroadcaster(app)
+        db.add_inventory_listener(_broadcaster.on_change)
+    _broadcaster.poll_interval = app.config.get('ROOM_STREAM_POLL_INTERVAL', Config.ROOM_STREAM_POLL_INTERVAL)
+    _broadcaster.max_subscribers = app.config.get('ROOM_STREAM_MAX_CONNECTIONS', Config.ROOM_STREAM_MAX_CONNECTIONS)
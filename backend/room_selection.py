@@ -1,40 +1,13 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from config import Config
 from . import database as db
-import time
-import threading
+from .locks import get_bed_lock
+from .selection_engine import get_selection_engine, run_write
+from .selection_windows import get_selection_windows
 
 room_selection_bp = Blueprint('room_selection', __name__, url_prefix='/api/room-selection')
 
-# Simple in-memory lock implementation to replace Redis
-class MemoryLock:
-    def __init__(self):
-        self.locks = {}
-        self.lock = threading.Lock()
-    
-    def acquire(self, key, timeout=5):
-        with self.lock:
-            current_time = time.time()
-            if key in self.locks:
-                if current_time < self.locks[key]:
-                    return False
-            self.locks[key] = current_time + timeout
-            return True
-    
-    def release(self, key):
-        with self.lock:
-            if key in self.locks:
-                del self.locks[key]
-    
-    def clean_expired(self):
-        with self.lock:
-            current_time = time.time()
-            expired_keys = [k for k, v in self.locks.items() if current_time > v]
-            for key in expired_keys:
-                del self.locks[key]
-
-memory_lock = MemoryLock()
-
 @room_selection_bp.route('/select', methods=['POST'])
 @jwt_required()
 def select_room():
@@ -51,88 +24,45 @@ def select_room():
     if not data or not data.get('bed_id'):
         return jsonify({'error': '床位ID不能为空'}), 400
     
+    # 分批选房：未到该抽签号的开放时间时拒绝（内存查表，不额外查询数据库）
+    try:
+        get_selection_windows().check(current_user_id)
+    except db.SelectionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    
     bed_id = data.get('bed_id')
     lock_key = f"bed_selection:{bed_id}"
+    bed_lock = get_bed_lock()
     
-    # Clean expired locks
-    memory_lock.clean_expired()
-    
-    if not memory_lock.acquire(lock_key):
+    if not bed_lock.acquire(lock_key):
         return jsonify({'error': '系统繁忙，请稍后重试'}), 503
     
     try:
-        # Check if user already has a selection and cancel it if exists
-        existing_selection = db.get_user_room_selection(current_user_id)
-        if existing_selection:
-            # Cancel existing selection
-            db.cancel_room_selection(current_user_id)
-        
-        # Check bed availability
-        conn = db.get_db()
-        c = conn.cursor()
-        c.execute('''
-            SELECT b.*, r.id as room_id, r.is_available as room_available
-            FROM beds b
-            JOIN rooms r ON b.room_id = r.id
-            WHERE b.id = ?
-        ''', (bed_id,))
-        bed_info = c.fetchone()
-        conn.close()
-        
-        if not bed_info:
-            return jsonify({'error': '床位不存在'}), 404
-        
-        if not bed_info['room_available']:
-            return jsonify({'error': '房间不可用'}), 400
-        
-        if bed_info['is_occupied']:
-            return jsonify({'error': '床位已被占用'}), 409
-        
-        # Check if bed is already selected by another user
-        conn = db.get_db()
-        c = conn.cursor()
-        c.execute('SELECT id FROM room_selections WHERE bed_id = ?', (bed_id,))
-        if c.fetchone():
-            conn.close()
-            return jsonify({'error': '床位已被其他用户选择'}), 409
-        conn.close()
-        
-        try:
-            # Select the room
-            db.select_room(current_user_id, bed_info['room_id'], bed_id)
-            
-            # Add history
-            with db.get_db_connection() as conn:
-                c = conn.cursor()
-                c.execute('''
-                    INSERT INTO allocation_history (user_id, room_id, bed_id, action, operated_by, notes)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (current_user_id, bed_info['room_id'], bed_id, 'assigned', current_user_id, '用户自主选择'))
-            
-            # Get the selection details
-            selection = db.get_user_room_selection(current_user_id)
-            
-            return jsonify({
-                'message': '宿舍选择成功',
-                'selection': {
-                    'id': selection['id'],
-                    'user_id': selection['user_id'],
-                    'room_id': selection['room_id'],
-                    'room_number': selection['room_number'],
-                    'room_type': selection['room_type'],
-                    'building_name': selection['building_name'],
-                    'bed_id': selection['bed_id'],
-                    'bed_number': selection['bed_number'],
-                    'selected_at': selection['selected_at'],
-                    'is_confirmed': bool(selection['is_confirmed'])
-                }
-            }), 201
-            
-        except Exception as e:
-            return jsonify({'error': '选择失败，请重试'}), 500
-    
+        # The claim, the previous-selection release and the history row
+        # commit together; the conditional UPDATE decides who wins the bed
+        selection = run_write(db.select_room, current_user_id, bed_id, operated_by=current_user_id, notes='用户自主选择')
+    except db.SelectionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({'error': '选择失败，请重试'}), 500
     finally:
-        memory_lock.release(lock_key)
+        bed_lock.release(lock_key)
+    
+    return jsonify({
+        'message': '宿舍选择成功',
+        'selection': {
+            'id': selection['id'],
+            'user_id': selection['user_id'],
+            'room_id': selection['room_id'],
+            'room_number': selection['room_number'],
+            'room_type': selection['room_type'],
+            'building_name': selection['building_name'],
+            'bed_id': selection['bed_id'],
+            'bed_number': selection['bed_number'],
+            'selected_at': selection['selected_at'],
+            'is_confirmed': bool(selection['is_confirmed'])
+        }
+    }), 201
 
 @room_selection_bp.route('/cancel', methods=['POST'])
 @jwt_required()
@@ -148,29 +78,25 @@ def cancel_selection():
         return jsonify({'error': '您还没有选择宿舍'}), 404
     
     lock_key = f"bed_selection:{selection['bed_id']}"
+    bed_lock = get_bed_lock()
     
-    if not memory_lock.acquire(lock_key):
+    if not bed_lock.acquire(lock_key):
         return jsonify({'error': '系统繁忙，请稍后重试'}), 503
     
     try:
-        # Add history
-        with db.get_db_connection() as conn:
-            c = conn.cursor()
-            c.execute('''
-                INSERT INTO allocation_history (user_id, room_id, bed_id, action, operated_by, notes)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (current_user_id, selection['room_id'], selection['bed_id'], 'removed', current_user_id, '用户取消选择'))
-        
-        # Cancel the selection
-        db.cancel_room_selection(current_user_id)
+        # Cancel the selection and add history
+        run_write(db.cancel_room_selection, current_user_id, action='removed',
+                  operated_by=current_user_id, notes='用户取消选择')
         
         return jsonify({'message': '选择已取消'}), 200
         
+    except db.SelectionError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         return jsonify({'error': '取消失败，请重试'}), 500
     
     finally:
-        memory_lock.release(lock_key)
+        bed_lock.release(lock_key)
 
 @room_selection_bp.route('/confirm', methods=['POST'])
 @jwt_required()
@@ -189,12 +115,7 @@ def confirm_selection():
         return jsonify({'error': '选择已经确认'}), 400
     
     try:
-        with db.get_db_connection() as conn:
-            c = conn.cursor()
-            c.execute('UPDATE room_selections SET is_confirmed = 1 WHERE user_id = ?', (current_user_id,))
-        
-        # Get updated selection
-        selection = db.get_user_room_selection(current_user_id)
+        selection = run_write(db.confirm_room_selection, current_user_id)
         
         return jsonify({
             'message': '选择确认成功',
@@ -212,6 +133,8 @@ def confirm_selection():
             }
         }), 200
         
+    except db.SelectionError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         return jsonify({'error': '确认失败，请重试'}), 500
 
@@ -238,89 +161,233 @@ def change_selection():
     if selection['bed_id'] == new_bed_id:
         return jsonify({'error': '新床位与当前床位相同'}), 400
     
+    try:
+        get_selection_windows().check(current_user_id)
+    except db.SelectionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    
     old_lock_key = f"bed_selection:{selection['bed_id']}"
     new_lock_key = f"bed_selection:{new_bed_id}"
     
-    # Try to acquire both locks
-    if not memory_lock.acquire(old_lock_key):
+    bed_lock = get_bed_lock()
+    
+    # Try to acquire both locks, in a fixed order so two swaps between the
+    # same beds cannot wait on each other
+    first_key, second_key = sorted([old_lock_key, new_lock_key])
+    if not bed_lock.acquire(first_key):
         return jsonify({'error': '系统繁忙，请稍后重试'}), 503
     
-    if not memory_lock.acquire(new_lock_key):
-        memory_lock.release(old_lock_key)
+    if not bed_lock.acquire(second_key):
+        bed_lock.release(first_key)
         return jsonify({'error': '系统繁忙，请稍后重试'}), 503
     
     try:
-        # Check new bed availability
-        conn = db.get_db()
-        c = conn.cursor()
-        c.execute('''
-            SELECT b.*, r.id as room_id, r.is_available as room_available
-            FROM beds b
-            JOIN rooms r ON b.room_id = r.id
-            WHERE b.id = ?
-        ''', (new_bed_id,))
-        new_bed_info = c.fetchone()
-        
-        if not new_bed_info:
-            conn.close()
-            return jsonify({'error': '新床位不存在'}), 404
-        
-        if new_bed_info['is_occupied']:
-            conn.close()
-            return jsonify({'error': '新床位已被占用'}), 409
-        
-        # Check if new bed is already selected
-        c.execute('SELECT id FROM room_selections WHERE bed_id = ?', (new_bed_id,))
-        if c.fetchone():
-            conn.close()
-            return jsonify({'error': '新床位已被其他用户选择'}), 409
-        
-        if not new_bed_info['room_available']:
-            conn.close()
-            return jsonify({'error': '新房间不可用'}), 400
-        
-        conn.close()
-        
         try:
-            # Cancel old selection
-            db.cancel_room_selection(current_user_id)
-            
-            # Make new selection
-            db.select_room(current_user_id, new_bed_info['room_id'], new_bed_id)
-            
-            # Add history
-            with db.get_db_connection() as conn:
-                c = conn.cursor()
-                c.execute('''
-                    INSERT INTO allocation_history (user_id, room_id, bed_id, action, operated_by, notes)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (current_user_id, new_bed_info['room_id'], new_bed_id, 'modified', current_user_id, '用户更改选择'))
-            
-            # Get updated selection
-            selection = db.get_user_room_selection(current_user_id)
-            
-            return jsonify({
-                'message': '选择更改成功',
-                'selection': {
-                    'id': selection['id'],
-                    'user_id': selection['user_id'],
-                    'room_id': selection['room_id'],
-                    'room_number': selection['room_number'],
-                    'room_type': selection['room_type'],
-                    'building_name': selection['building_name'],
-                    'bed_id': selection['bed_id'],
-                    'bed_number': selection['bed_number'],
-                    'selected_at': selection['selected_at'],
-                    'is_confirmed': bool(selection['is_confirmed'])
-                }
-            }), 200
-            
+            selection = run_write(db.select_room, current_user_id, new_bed_id, action='modified',
+                                  operated_by=current_user_id, notes='用户更改选择')
+        except db.SelectionError as e:
+            return jsonify({'error': str(e)}), e.status_code
         except Exception as e:
             return jsonify({'error': '更改失败，请重试'}), 500
+        
+        return jsonify({
+            'message': '选择更改成功',
+            'selection': {
+                'id': selection['id'],
+                'user_id': selection['user_id'],
+                'room_id': selection['room_id'],
+                'room_number': selection['room_number'],
+                'room_type': selection['room_type'],
+                'building_name': selection['building_name'],
+                'bed_id': selection['bed_id'],
+                'bed_number': selection['bed_number'],
+                'selected_at': selection['selected_at'],
+                'is_confirmed': bool(selection['is_confirmed'])
+            }
+        }), 200
     
     finally:
-        memory_lock.release(old_lock_key)
-        memory_lock.release(new_lock_key)
+        bed_lock.release(old_lock_key)
+        bed_lock.release(new_lock_key)
+
+@room_selection_bp.route('/group', methods=['GET'])
+@jwt_required()
+def get_my_roommate_group():
+    current_user_id = get_jwt_identity()
+    group = db.get_roommate_group(current_user_id)
+    if not group:
+        return jsonify({'group': None}), 200
+    
+    return jsonify({
+        'group': {
+            'id': group['id'],
+            'name': group['name'],
+            'members': [{
+                'id': member['id'],
+                'username': member['username'],
+                'name': member['name'],
+                'room_id': member['room_id'],
+                'bed_id': member['bed_id']
+            } for member in group['members']]
+        }
+    }), 200
+
+@room_selection_bp.route('/select-group', methods=['POST'])
+@jwt_required()
+def select_group_room():
+    current_user_id = get_jwt_identity()
+    user = db.get_user_by_id(current_user_id)
+    
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    data = request.get_json()
+    if not data or not data.get('room_id'):
+        return jsonify({'error': '房间ID不能为空'}), 400
+    
+    group = db.get_roommate_group(current_user_id)
+    if not group:
+        return jsonify({'error': '您不在任何室友组中'}), 404
+    
+    try:
+        room_id = int(data.get('room_id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': '房间ID无效'}), 400
+    
+    # 每个要搬入的成员都必须已到自己的选房时间
+    moving = [member for member in group['members'] if member['room_id'] != room_id]
+    try:
+        for member in moving:
+            get_selection_windows().check(member['id'])
+    except db.SelectionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    
+    # 和 /change 一样按床位加锁：搬出的旧床位和要占用的空床位，按固定顺序
+    # 逐个获取，避免和单人选房、换房互相等待；床位归属仍由条件 UPDATE 决定
+    bed_ids = db.get_free_bed_ids(room_id, len(moving))
+    lock_keys = sorted({f"bed_selection:{bed_id}" for bed_id in bed_ids} |
+                       {f"bed_selection:{member['bed_id']}" for member in moving if member['bed_id']})
+    bed_lock = get_bed_lock()
+    acquired = []
+    try:
+        for lock_key in lock_keys:
+            if not bed_lock.acquire(lock_key):
+                return jsonify({'error': '系统繁忙，请稍后重试'}), 503
+            acquired.append(lock_key)
+        
+        # All members' claims commit together or not at all
+        selections = run_write(db.select_group_room, group['id'], room_id, bed_ids, operated_by=current_user_id)
+    except db.SelectionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({'error': '整组选择失败，请重试'}), 500
+    finally:
+        for lock_key in acquired:
+            bed_lock.release(lock_key)
+    
+    return jsonify({
+        'message': '室友组整体入住成功',
+        'selections': [{
+            'user_id': selection['user_id'],
+            'user_name': selection['user_name'],
+            'room_id': selection['room_id'],
+            'room_number': selection['room_number'],
+            'building_name': selection['building_name'],
+            'bed_id': selection['bed_id'],
+            'bed_number': selection['bed_number']
+        } for selection in selections]
+    }), 201
+
+@room_selection_bp.route('/preferences', methods=['GET'])
+@jwt_required()
+def get_room_preferences():
+    current_user_id = get_jwt_identity()
+    preferences = db.get_room_preferences(current_user_id)
+    
+    return jsonify({
+        'preferences': [{
+            'rank': p['rank'],
+            'building_id': p['building_id'],
+            'building_name': p['building_name'],
+            'room_id': p['room_id'],
+            'room_number': p['room_number'],
+            'floor': p['floor']
+        } for p in preferences],
+        'limit': Config.ROOM_PREFERENCE_LIMIT
+    }), 200
+
+@room_selection_bp.route('/preferences', methods=['PUT'])
+@jwt_required()
+def save_room_preferences():
+    current_user_id = get_jwt_identity()
+    user = db.get_user_by_id(current_user_id)
+    
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    if user['is_admin']:
+        return jsonify({'error': '管理员不能填写志愿'}), 400
+    
+    data = request.get_json()
+    if not data or not isinstance(data.get('preferences'), list):
+        return jsonify({'error': '志愿列表不能为空'}), 400
+    
+    if len(data['preferences']) > Config.ROOM_PREFERENCE_LIMIT:
+        return jsonify({'error': f'最多填写 {Config.ROOM_PREFERENCE_LIMIT} 个志愿'}), 400
+    
+    preferences = []
+    for index, item in enumerate(data['preferences'], 1):
+        try:
+            building_id, room_id, floor = (
+                int(item[key]) if item.get(key) not in (None, '') else None
+                for key in ('building_id', 'room_id', 'floor')
+            )
+        except (TypeError, ValueError, AttributeError):
+            return jsonify({'error': f'第{index}志愿格式错误'}), 400
+        if building_id is None and room_id is None and floor is None:
+            return jsonify({'error': f'第{index}志愿至少需要指定楼栋、房间或楼层'}), 400
+        preferences.append((building_id, room_id, floor))
+    
+    # 一次查询校验所有引用的楼栋和房间
+    conn = db.get_db()
+    buildings = {row['id'] for row in conn.execute('SELECT id FROM buildings')}
+    room_ids = [p[1] for p in preferences if p[1] is not None]
+    rooms = set()
+    if room_ids:
+        rooms = {row['id'] for row in conn.execute(
+            f'SELECT id FROM rooms WHERE id IN ({",".join("?" * len(room_ids))})', room_ids
+        )}
+    conn.close()
+    for index, (building_id, room_id, floor) in enumerate(preferences, 1):
+        if building_id is not None and building_id not in buildings:
+            return jsonify({'error': f'第{index}志愿的楼栋不存在'}), 400
+        if room_id is not None and room_id not in rooms:
+            return jsonify({'error': f'第{index}志愿的房间不存在'}), 400
+    
+    try:
+        db.save_room_preferences(current_user_id, preferences)
+        return jsonify({'message': '志愿保存成功'}), 200
+    except Exception as e:
+        return jsonify({'error': '志愿保存失败'}), 500
+
+@room_selection_bp.route('/lock-metrics', methods=['GET'])
+@jwt_required()
+def get_lock_metrics():
+    current_user_id = get_jwt_identity()
+    user = db.get_user_by_id(current_user_id)
+    
+    if not user or not user['is_admin']:
+        return jsonify({'error': '需要管理员权限'}), 403
+    
+    bed_lock = get_bed_lock()
+    if not hasattr(bed_lock, 'metrics'):
+        return jsonify({'enabled': False}), 200
+    
+    response = {'enabled': True, 'metrics': bed_lock.metrics()}
+    engine = get_selection_engine()
+    if engine is not None:
+        response['selection_engine'] = engine.metrics()
+    return jsonify(response), 200
 
 @room_selection_bp.route('/statistics', methods=['GET'])
 @jwt_required()
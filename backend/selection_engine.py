@@ -0,0 +1,145 @@
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError
+from config import Config
+from . import database as db
+
+class SelectionEngine:
+    """Group-commit writer for room selection commands.
+
+    Request handlers submit database write functions (select, cancel,
+    change, confirm) and block on the returned future. A single writer
+    thread drains the queue and applies up to max_batch commands inside one
+    BEGIN IMMEDIATE transaction, each in its own savepoint, so a failing
+    command only rolls back itself. Futures are resolved once the batch has
+    committed, which turns dozens of fsyncs into one. A request that times
+    out is only told so when its command was still queued and could be
+    withdrawn; otherwise it waits for the outcome.
+    """
+
+    def __init__(self, app=None, max_batch=64, timeout=10):
+        self.app = app
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.commands = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {'batches': 0, 'commands': 0, 'max_batch_seen': 0}
+
+    def start(self):
+        """Start the writer thread if it is not already running."""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='selection-writer', daemon=True)
+                self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a write function and return a Future for its result."""
+        future = Future()
+        self.start()
+        self.commands.put((future, fn, args, kwargs))
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """Submit a write and wait for its committed result.
+        
+        Raises SelectionError (503) if the command was still waiting in the
+        queue after timeout seconds; it is withdrawn and never applied. A
+        command that is already being applied gets another timeout seconds;
+        if it still has no outcome the request stops waiting and the client
+        is told the result is unknown (503), so a stuck writer cannot hold
+        request threads forever.
+        """
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise db.SelectionError('系统繁忙，操作未执行，请重试', 503)
+        try:
+            # Already being applied: its outcome is coming, report that one
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise db.SelectionError('系统繁忙，操作结果未知，请刷新页面查看您的选房结果', 503)
+    
+    def metrics(self):
+        """Snapshot of the batch counters."""
+        with self.lock:
+            return dict(self.stats)
+
+    def _next_batch(self):
+        batch = [self.commands.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.commands.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                with self.app.app_context():
+                    self._apply(batch)
+            except Exception as e:
+                # Keep the only writer alive; fail whatever of this batch is unresolved
+                self.app.logger.exception('selection engine batch failed')
+                for future, fn, args, kwargs in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _apply(self, batch):
+        outcomes = []
+        try:
+            with db.get_db_connection(immediate=True):
+                for future, fn, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        # Savepoint per command
+                        with db.get_db_connection():
+                            result = fn(*args, **kwargs)
+                        outcomes.append((future, result, None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            # Commit failed: nothing in this batch was written
+            for future, fn, args, kwargs in batch:
+                if future.running():
+                    future.set_exception(e)
+            return
+
+        with self.lock:
+            self.stats['batches'] += 1
+            self.stats['commands'] += len(outcomes)
+            self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(outcomes))
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+_engine = None
+
+def get_selection_engine():
+    """Get the group-commit engine, or None when it is disabled."""
+    return _engine
+
+def run_write(fn, *args, **kwargs):
+    """Run a selection write through the engine when enabled, else inline."""
+    if _engine is None:
+        return fn(*args, **kwargs)
+    return _engine.run(fn, *args, **kwargs)
+
+def init_app(app):
+    """Create the engine when SELECTION_ENGINE_ENABLED is set."""
+    global _engine
+    if app.config.get('SELECTION_ENGINE_ENABLED', Config.SELECTION_ENGINE_ENABLED):
+        _engine = SelectionEngine(
+            app,
+            max_batch=app.config.get('SELECTION_ENGINE_MAX_BATCH', Config.SELECTION_ENGINE_MAX_BATCH),
+            timeout=app.config.get('SELECTION_ENGINE_TIMEOUT', Config.SELECTION_ENGINE_TIMEOUT)
+        )
+    else:
+        _engine = None
@@ -0,0 +1,155 @@
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from config import Config
+from . import database as db
+from . import lottery_engine
+
+def parse_time(value):
+    """Parse an ISO timestamp as stored in lottery_settings."""
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+
+class SelectionWindows:
+    """In-memory map from students to the time their selection window opens.
+
+    Published lotteries with a selection_start are loaded once: each
+    student's lottery_number opens at selection_start plus one
+    selection_wave_interval (minutes) per selection_wave_size ranks before
+    it. The latest such lottery a student took part in applies; students
+    outside it open after its last wave. Checks are a dict lookup (or one
+    Feistel step for compact draws), never a query. The map is rebuilt after
+    invalidate() and at most SELECTION_WINDOW_REFRESH seconds after loading,
+    which picks up changes made by other worker processes. One thread
+    reloads at a time: while it does, others keep using an expired map, and
+    wait for it only after invalidate() or before the first load.
+    """
+
+    def __init__(self, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.reloaded = threading.Condition(self.lock)
+        self.loading = False
+        self.generation = 0  # bumped by invalidate(), so a load that overlaps it is not trusted
+        self.loaded_at = None
+        self.lotteries = []
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+            self.generation += 1
+
+    def _load(self):
+        lotteries = []
+        conn = db.get_pool().acquire()
+        try:
+            c = conn.execute('''
+                SELECT ls.id, ls.selection_start, ls.selection_wave_size, ls.selection_wave_interval, d.seed
+                FROM lottery_settings ls
+                LEFT JOIN lottery_draws d ON d.lottery_id = ls.id
+                WHERE ls.is_published = 1 AND ls.selection_start IS NOT NULL
+                ORDER BY ls.id DESC
+            ''')
+            for setting in c.fetchall():
+                entry = {
+                    'lottery_id': setting['id'],
+                    'start': parse_time(setting['selection_start']),
+                    'wave_size': setting['selection_wave_size'],
+                    'interval': timedelta(minutes=setting['selection_wave_interval'] or 0),
+                    'ranks': None,
+                    'draw': None
+                }
+                if setting['seed'] is not None:
+                    entry['draw'] = lottery_engine.get_compact_draw(conn, setting['id'])
+                    seed, participants, segments, permutation = entry['draw']
+                    # Only allocated positions have a rank, as with stored rows
+                    ranked = sum(lottery_engine.segment_sizes(len(participants), segments))
+                else:
+                    cursor = conn.cursor()
+                    cursor.row_factory = None
+                    cursor.execute('SELECT user_id, lottery_number FROM lottery_results WHERE lottery_id = ?', (setting['id'],))
+                    entry['ranks'] = dict(cursor.fetchall())
+                    ranked = max(entry['ranks'].values(), default=0)
+                entry['ranked'] = ranked
+                lotteries.append(entry)
+        finally:
+            conn.close()
+        return lotteries
+
+    def _current(self):
+        with self.lock:
+            while True:
+                if self.loaded_at is not None:
+                    # Still fresh, or expired while another thread is already reloading
+                    if self.loading or time.monotonic() - self.loaded_at < self.refresh_interval:
+                        return self.lotteries
+                if not self.loading:
+                    break
+                self.reloaded.wait()
+            self.loading = True
+            generation = self.generation
+        lotteries = None
+        try:
+            lotteries = self._load()
+        finally:
+            with self.lock:
+                self.loading = False
+                if lotteries is not None:
+                    self.lotteries = lotteries
+                    if generation == self.generation:
+                        self.loaded_at = time.monotonic()
+                self.reloaded.notify_all()
+        return lotteries
+
+    def _rank(self, lottery, user_id):
+        if lottery['ranks'] is not None:
+            return lottery['ranks'].get(user_id)
+        seed, participants, segments, permutation = lottery['draw']
+        index = int(np.searchsorted(participants, user_id))
+        if index >= len(participants) or participants[index] != user_id:
+            return None
+        position = permutation.forward(index)
+        if lottery_engine.position_result(position, segments) is None:
+            return None
+        return position + 1
+
+    def opens_at(self, user_id):
+        """(datetime, lottery_number) when the user may start selecting, or None if unrestricted."""
+        lotteries = self._current()
+        if not lotteries:
+            return None
+        # The most recent lottery the user was drawn in decides
+        for lottery in lotteries:
+            rank = self._rank(lottery, user_id)
+            if rank is not None:
+                break
+        else:
+            lottery, rank = lotteries[0], None
+        wave = 0
+        if lottery['wave_size']:
+            if rank:
+                wave = (rank - 1) // lottery['wave_size']
+            else:
+                # The wave after the one holding the last rank
+                wave = -(-lottery['ranked'] // lottery['wave_size'])
+        return lottery['start'] + wave * lottery['interval'], rank
+
+    def check(self, user_id):
+        """Raise SelectionError (403) when the user's window has not opened yet."""
+        window = self.opens_at(user_id)
+        if window is None:
+            return
+        opens_at, rank = window
+        if datetime.now(opens_at.tzinfo) < opens_at:
+            raise db.SelectionError(f"您的选房时间为 {opens_at.strftime('%m-%d %H:%M')} 起，请届时再试", 403)
+
+_windows = SelectionWindows(Config.SELECTION_WINDOW_REFRESH)
+
+def get_selection_windows():
+    """Get the process-wide selection window lookup."""
+    return _windows
+
+def init_app(app):
+    """Apply SELECTION_WINDOW_REFRESH from the app config and drop cached windows."""
+    _windows.refresh_interval = app.config.get('SELECTION_WINDOW_REFRESH', Config.SELECTION_WINDOW_REFRESH)
+    _windows.invalidate()
@@ -0,0 +1,116 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from flask import g, request, current_app
+from config import Config
+
+# EXPLAIN QUERY PLAN results by SQL text; plans do not change between requests
+_plans = {}
+_plans_lock = threading.Lock()
+
+def full_scans(plan):
+    """Plan steps that read a whole table rather than seek through an index."""
+    return [detail for detail in plan
+            if detail.startswith('SCAN ') and ' USING ' not in detail and detail != 'SCAN CONSTANT ROW']
+
+class QueryProfile:
+    """Statement statistics for one request.
+
+    Filled by database.ProfilingCursor for every statement run on the
+    request's get_db() connection. Statements slower than slow_ms keep
+    their SQL text; with explain=True each distinct SELECT is run once
+    through EXPLAIN QUERY PLAN and full table scans are noted.
+    """
+
+    def __init__(self, slow_ms, explain=False):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = []
+        self.scans = {}
+
+    def record(self, conn, sql, parameters, elapsed):
+        ms = elapsed * 1000
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        if ms >= self.slow_ms:
+            self.slow.append({'ms': round(ms, 2), 'sql': ' '.join(sql.split())})
+        if self.explain and parameters is not None and sql not in self.scans:
+            self.scans[sql] = self._full_scans(conn, sql, parameters)
+
+    def _full_scans(self, conn, sql, parameters):
+        statement = sql.lstrip().upper()
+        if not (statement.startswith('SELECT') or statement.startswith('WITH')):
+            return []
+        with _plans_lock:
+            plan = _plans.get(sql)
+        if plan is None:
+            try:
+                # Plain sqlite3 cursor: the EXPLAIN itself is not counted
+                cursor = sqlite3.Connection.cursor(conn)
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parameters)
+                plan = [row[3] for row in cursor.fetchall()]
+            except Exception:
+                plan = []
+            with _plans_lock:
+                _plans[sql] = plan
+        return full_scans(plan)
+
+    def to_dict(self):
+        return {
+            'queries': self.count,
+            'total_ms': round(self.total, 2),
+            'max_ms': round(self.max, 2),
+            'slow': self.slow,
+            'full_scans': [{'sql': ' '.join(sql.split()), 'scans': scans}
+                           for sql, scans in self.scans.items() if scans]
+        }
+
+def _start():
+    g.sql_profile = QueryProfile(
+        current_app.config.get('SQL_SLOW_QUERY_MS', Config.SQL_SLOW_QUERY_MS),
+        current_app.config.get('SQL_PROFILE_EXPLAIN', Config.SQL_PROFILE_EXPLAIN)
+    )
+    g.sql_profile_started = time.perf_counter()
+
+def _finish(response):
+    profile = g.get('sql_profile')
+    if profile is None or profile.count == 0:
+        return response
+    stats = profile.to_dict()
+    line = {
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'request_ms': round((time.perf_counter() - g.sql_profile_started) * 1000, 2),
+        **stats
+    }
+    current_app.logger.info('sql_profile %s', json.dumps(line, ensure_ascii=False))
+    if current_app.debug:
+        response.headers['X-SQL-Profile'] = (
+            f"queries={stats['queries']} total_ms={stats['total_ms']} max_ms={stats['max_ms']} "
+            f"slow={len(stats['slow'])} full_scans={len(stats['full_scans'])}"
+        )
+    return response
+
+def init_app(app):
+    """Profile the SQL of every request when SQL_PROFILE_ENABLED is set.
+
+    Each request ends with one 'sql_profile {...}' JSON log line (statement
+    count, total and max milliseconds, slow statements and, with
+    SQL_PROFILE_EXPLAIN, full table scans); in debug mode the summary is
+    also sent as the X-SQL-Profile response header. Statements run on other
+    connections, such as the selection engine's writer, are not included.
+    """
+    if not app.config.get('SQL_PROFILE_ENABLED', Config.SQL_PROFILE_ENABLED):
+        return
+    # The log line is INFO; make sure it is not dropped when nothing set a level
+    if app.logger.level == logging.NOTSET:
+        app.logger.setLevel(logging.INFO)
+    app.before_request(_start)
+    app.after_request(_finish)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Regression benchmark for GET /api/lottery/rooms/available.
+
+Counts SQL statements per request and measures latency for campus sizes
+given by --rooms, once with the SQL path (availability index disabled) and
+once with the in-memory index. Half of the beds are occupied so the
+occupant join has work to do. Exits non-zero when the SQL path issues more
+than --max-queries statements per request or when the count grows with the
+number of rooms, i.e. when an N+1 query pattern creeps back in. Usage:
+
+    python benchmarks/bench_available_rooms.py --rooms 500 2000 10000
+"""
+import argparse
+import sys
+
+from common import use_temp_database, seed_rooms, percentile, Timer
+
+
+def setup(rooms):
+    use_temp_database()
+    from backend.app import create_app
+    from backend import database as db
+    app = create_app('production')
+    with app.app_context():
+        conn = db.get_db()
+        seed_rooms(conn, buildings=10, rooms_per_building=rooms // 10)
+        beds = [r['id'] for r in conn.execute('SELECT id FROM beds ORDER BY id')][::2]
+        conn.executemany(
+            'INSERT INTO users (username, password_hash, name) VALUES (?, ?, ?)',
+            [(f'bench{i}', 'x', f'Bench {i}') for i in range(len(beds))]
+        )
+        users = [r['id'] for r in conn.execute('SELECT id FROM users WHERE is_admin = 0 ORDER BY id')]
+        conn.executemany(
+            'INSERT INTO room_selections (user_id, room_id, bed_id) SELECT ?, room_id, id FROM beds WHERE id = ?',
+            list(zip(users, beds))
+        )
+        conn.executemany('UPDATE beds SET is_occupied = 1 WHERE id = ?', [(b,) for b in beds])
+        conn.execute('''
+            UPDATE rooms SET current_occupancy =
+                (SELECT COUNT(*) FROM beds WHERE room_id = rooms.id AND is_occupied = 1)
+        ''')
+        conn.commit()
+    return app, db
+
+
+def count_statements(db):
+    """Trace every statement run on connections handed out by the pool."""
+    counter = {'statements': 0}
+    pool = db.get_pool()
+    acquire = pool.acquire
+
+    def traced_acquire():
+        conn = acquire()
+        conn.set_trace_callback(lambda sql: counter.__setitem__('statements', counter['statements'] + 1))
+        return conn
+
+    pool.acquire = traced_acquire
+    return counter
+
+
+def measure(app, client, headers, counter, requests):
+    # Warm up (and load the index when it is enabled)
+    client.get('/api/lottery/rooms/available', headers=headers)
+    samples = []
+    counter['statements'] = 0
+    for _ in range(requests):
+        with Timer() as t:
+            response = client.get('/api/lottery/rooms/available', headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        samples.append(t.elapsed * 1000)
+    return counter['statements'] / requests, samples, len(response.get_json()['rooms'])
+
+
+def run(rooms, requests):
+    app, db = setup(rooms)
+    from backend import availability
+    client = app.test_client()
+    token = client.post('/api/auth/login', json={'username': 'admin', 'password': 'admin123'}).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    counter = count_statements(db)
+
+    results = {}
+    for mode, enabled in (('sql', False), ('index', True)):
+        app.config['AVAILABILITY_INDEX_ENABLED'] = enabled
+        availability.init_app(app)
+        results[mode] = measure(app, client, headers, counter, requests)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, nargs='*', default=[500, 2000, 10000])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--max-queries', type=int, default=6)
+    args = parser.parse_args()
+
+    print(f'{"rooms":>8}{"mode":>8}{"returned":>10}{"stmts/req":>11}{"p50 ms":>10}{"p95 ms":>10}')
+    sql_counts = []
+    for rooms in args.rooms:
+        for mode, (statements, samples, returned) in run(rooms, args.requests).items():
+            print(f'{rooms:>8}{mode:>8}{returned:>10}{statements:>11.1f}'
+                  f'{percentile(samples, 50):>10.1f}{percentile(samples, 95):>10.1f}')
+            if mode == 'sql':
+                sql_counts.append(statements)
+
+    if max(sql_counts) > args.max_queries or len(set(sql_counts)) > 1:
+        print(f'FAIL: SQL path statements per request {sql_counts} (limit {args.max_queries}, must not grow with rooms)')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Time the batch bed assignment against one select_room call per student.
+
+Seeds --beds beds in 4-person rooms over 10 buildings, the same number of
+students and a published lottery. Half of the students rank three random
+(building, floor) preferences. The batch path is batch_assign.assign_beds
+(one transaction); the per-student path calls db.select_room in lottery
+order, which is what thousands of /select requests amount to without the
+HTTP and lock overhead, and is skipped above --max-per-student beds. Also
+checks that occupancy counters and selections agree afterwards. Usage:
+
+    python benchmarks/bench_batch_assign.py --beds 2000 20000
+"""
+import argparse
+import random
+
+from common import use_temp_database, seed_rooms, Timer
+
+
+def setup(beds):
+    use_temp_database()
+    from backend.app import create_app
+    from backend import database as db, lottery_engine
+    app = create_app('production')
+    rng = random.Random(1)
+    with app.app_context():
+        conn = db.get_db()
+        buildings = 10
+        seed_rooms(conn, buildings=buildings, rooms_per_building=beds // 4 // buildings)
+        conn.executemany(
+            'INSERT INTO users (username, password_hash, name) VALUES (?, ?, ?)',
+            [(f'bench{i}', 'x', f'Bench {i}') for i in range(beds)]
+        )
+        c = conn.execute(
+            "INSERT INTO lottery_settings (lottery_name, lottery_time, room_type, is_published) VALUES ('bench', '2026-01-01', '4', 1)"
+        )
+        lottery_id = c.lastrowid
+        user_ids = lottery_engine.load_participants(conn)
+        lottery_engine.draw(conn, lottery_id, user_ids, [('4', beds, 4, '4-')])
+        building_ids = [r['id'] for r in conn.execute('SELECT id FROM buildings')]
+        conn.executemany(
+            'INSERT INTO room_preferences (user_id, rank, building_id, floor) VALUES (?, ?, ?, ?)',
+            [(user_id, rank, rng.choice(building_ids), rng.randint(1, 5))
+             for user_id in user_ids.tolist()[::2] for rank in (1, 2, 3)]
+        )
+        conn.commit()
+    return app, lottery_id
+
+
+def check(db):
+    conn = db.get_db()
+    selections = conn.execute('SELECT COUNT(*) FROM room_selections').fetchone()[0]
+    occupied = conn.execute('SELECT COUNT(*) FROM beds WHERE is_occupied = 1').fetchone()[0]
+    occupancy = conn.execute('SELECT SUM(current_occupancy) FROM rooms').fetchone()[0]
+    assert selections == occupied == occupancy, (selections, occupied, occupancy)
+    return selections
+
+
+def bench_batch(beds):
+    app, lottery_id = setup(beds)
+    from backend import batch_assign, database as db
+    with app.app_context():
+        with Timer() as t:
+            summary = batch_assign.assign_beds(lottery_id)
+        check(db)
+    return t.elapsed, summary
+
+
+def bench_per_student(beds):
+    app, lottery_id = setup(beds)
+    from backend import database as db
+    with app.app_context():
+        conn = db.get_db()
+        order = [r['user_id'] for r in conn.execute(
+            'SELECT user_id FROM lottery_results WHERE lottery_id = ? ORDER BY lottery_number', (lottery_id,))]
+        free = [r['id'] for r in conn.execute('SELECT id FROM beds ORDER BY id')]
+        with Timer() as t:
+            for user_id, bed_id in zip(order, free):
+                db.select_room(user_id, bed_id)
+        check(db)
+    return t.elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--beds', type=int, nargs='*', default=[2000, 20000])
+    parser.add_argument('--max-per-student', type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f'{"beds":>8}{"per-student s":>15}{"batch s":>10}{"assigned":>10}{"pref hit":>10}{"1st choice":>12}')
+    for beds in args.beds:
+        per_student = '-'
+        if beds <= args.max_per_student:
+            per_student = f'{bench_per_student(beds):.2f}'
+        elapsed, summary = bench_batch(beds)
+        print(f'{beds:>8}{per_student:>15}{elapsed:>10.2f}{summary["assigned"]:>10}'
+              f'{summary["preference_matched"]:>10}{summary["first_choice"]:>12}')
+
+
+if __name__ == '__main__':
+    main()
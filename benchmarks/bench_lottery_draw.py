@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Time lottery draws with the shared engine against the old row-by-row path.
+
+For each participant count the draw (shuffle, 4-/6-person groups, insert
+of every lottery_results row in one transaction) runs against a fresh
+database. The row-by-row path is what publish_lottery and quick_lottery_draw
+did (random.shuffle, one INSERT per participant, one transaction); the
+per-row-commit path is what generate_lottery_results did through
+db.save_lottery_result (one connection and commit per participant) and is
+skipped above --max-per-row-commit participants. Usage:
+
+    python benchmarks/bench_lottery_draw.py --participants 1000 10000 100000
+"""
+import argparse
+import random
+
+from common import use_temp_database, Timer
+
+
+def setup(participants):
+    use_temp_database()
+    from backend import database as db
+    db.init_db()
+    conn = db.get_pool().acquire()
+    conn.executemany(
+        'INSERT INTO users (username, password_hash, name) VALUES (?, ?, ?)',
+        [(f'bench{i}', 'x', f'Bench {i}') for i in range(participants)]
+    )
+    conn.commit()
+    return conn
+
+
+def new_lottery(conn):
+    c = conn.execute(
+        "INSERT INTO lottery_settings (lottery_name, lottery_time, room_type) VALUES ('bench', '2026-01-01', '4')"
+    )
+    conn.commit()
+    return c.lastrowid
+
+
+def segments(participants):
+    half = (participants // 2 + 3) // 4 * 4
+    return [('4', half, 4, '4-'), ('6', participants - half, 6, '6-')]
+
+
+def bench_engine(conn, participants):
+    from backend import lottery_engine
+    lottery_id = new_lottery(conn)
+    with Timer() as t:
+        user_ids = lottery_engine.load_participants(conn)
+        lottery_engine.draw(conn, lottery_id, user_ids, segments(participants))
+        conn.commit()
+    return t.elapsed
+
+
+def bench_row_by_row(conn, participants):
+    lottery_id = new_lottery(conn)
+    with Timer() as t:
+        user_ids = [row['id'] for row in conn.execute('SELECT id FROM users WHERE is_admin = 0')]
+        random.shuffle(user_ids)
+        position = 0
+        for room_type, seats, group_size, prefix in segments(participants):
+            for i in range(seats):
+                conn.execute(
+                    'INSERT INTO lottery_results (user_id, lottery_id, lottery_number, group_number, room_type) VALUES (?, ?, ?, ?, ?)',
+                    (user_ids[position], lottery_id, position + 1, f'{prefix}{i // group_size + 1}', room_type)
+                )
+                position += 1
+        conn.commit()
+    return t.elapsed
+
+
+def bench_per_row_commit(conn, participants):
+    from backend import database as db
+    lottery_id = new_lottery(conn)
+    with Timer() as t:
+        user_ids = [row['id'] for row in conn.execute('SELECT id FROM users WHERE is_admin = 0')]
+        random.shuffle(user_ids)
+        for i, user_id in enumerate(user_ids):
+            db.save_lottery_result(user_id, lottery_id, i + 1, i // 4 + 1)
+    return t.elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', type=int, nargs='*', default=[1000, 10000, 100000])
+    parser.add_argument('--max-per-row-commit', type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f'{"participants":>13}{"per-row commit s":>18}{"row-by-row s":>14}{"engine s":>10}')
+    for participants in args.participants:
+        conn = setup(participants)
+        per_row = '-'
+        if participants <= args.max_per_row_commit:
+            per_row = f'{bench_per_row_commit(conn, participants):.3f}'
+        old = bench_row_by_row(conn, participants)
+        new = bench_engine(conn, participants)
+        conn.close()
+        print(f'{participants:>13}{per_row:>18}{old:>14.3f}{new:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
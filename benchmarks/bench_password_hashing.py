@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Throughput of the bcrypt hashing pool by number of worker processes.
+
+Hashes --passwords passwords with PasswordHasher.hash_many for each worker
+count, from 1 (inline on the calling thread) up to the CPU count, and
+prints hashes per second and the speedup over one worker. The speedup
+should track the number of cores until the pool has more processes than
+the machine has CPUs. Usage:
+
+    python benchmarks/bench_password_hashing.py --passwords 64 --workers 1 2 4 8
+"""
+import argparse
+import os
+
+from common import Timer
+
+from backend.password_hashing import PasswordHasher
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    default_workers = sorted({1, *[2 ** i for i in range(1, cpus.bit_length()) if 2 ** i <= cpus], cpus})
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--passwords', type=int, default=64)
+    parser.add_argument('--workers', type=int, nargs='*', default=default_workers)
+    args = parser.parse_args()
+
+    passwords = [f'password{i}' for i in range(args.passwords)]
+    print(f'{cpus} CPUs, {args.passwords} passwords per run')
+    print(f'{"workers":>8}{"seconds":>10}{"hash/s":>9}{"speedup":>9}')
+    baseline = None
+    for workers in args.workers:
+        hasher = PasswordHasher(workers)
+        hasher.hash_many(passwords[:workers])  # start the processes outside the timing
+        with Timer() as t:
+            hasher.hash_many(passwords)
+        hasher.shutdown()
+        rate = args.passwords / t.elapsed
+        baseline = baseline or rate
+        print(f'{workers:>8}{t.elapsed:>10.2f}{rate:>9.1f}{rate / baseline:>8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
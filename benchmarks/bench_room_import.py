@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Regression benchmark for POST /api/admin/rooms/import.
+
+Uploads a CSV of --rooms rooms spread over ten buildings, first as a dry
+run and then for real, and prints both times. A tenth of the rows are
+duplicates of earlier ones, so per-row error reporting is exercised too.
+Exits non-zero when an import takes longer than --max-seconds, i.e. when
+per-row queries creep back in. Usage:
+
+    python benchmarks/bench_room_import.py --rooms 1000 10000
+"""
+import argparse
+import io
+import sys
+
+from common import use_temp_database, Timer
+
+
+def build_csv(rooms):
+    lines = ['building_name,room_number,room_type,max_capacity']
+    for i in range(rooms):
+        if i % 10 == 9:
+            i -= 1
+        room_type = '4' if i % 3 else '8'
+        lines.append(f'{i % 10 + 1}号楼,{i // 10 + 100},{room_type},{room_type}')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def run(rooms):
+    use_temp_database()
+    from backend.app import create_app
+    from backend import database as db
+    app = create_app('production')
+    with app.app_context():
+        for b in range(1, 11):
+            db.create_building(f'{b}号楼')
+    client = app.test_client()
+    token = client.post('/api/auth/login', json={'username': 'admin', 'password': 'admin123'}).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    content = build_csv(rooms)
+
+    def upload(data):
+        data['file'] = (io.BytesIO(content), 'rooms.csv')
+        response = client.post('/api/admin/rooms/import', data=data, headers=headers,
+                               content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response.get_json()
+
+    with Timer() as dry:
+        upload({'dry_run': '1'})
+    with Timer() as real:
+        report = upload({})
+    return dry.elapsed, real.elapsed, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, nargs='*', default=[1000, 10000])
+    parser.add_argument('--max-seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f'{"rooms":>8}{"created":>9}{"errors":>8}{"dry s":>8}{"import s":>10}')
+    failed = False
+    for rooms in args.rooms:
+        dry, real, report = run(rooms)
+        print(f'{rooms:>8}{report["success_count"]:>9}{report["error_count"]:>8}'
+              f'{dry:>8.2f}{real:>10.2f}')
+        failed = failed or real > args.max_seconds
+
+    if failed:
+        print(f'FAIL: a room import took longer than {args.max_seconds}s')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
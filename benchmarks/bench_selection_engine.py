@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Compare per-request bed claims against the group-commit selection engine.
+
+Each client thread claims distinct beds for distinct users, so every claim
+succeeds and the numbers measure commit throughput only. Usage:
+
+    python benchmarks/bench_selection_engine.py --clients 32 --claims 2000
+"""
+import argparse
+import threading
+
+from common import use_temp_database, seed_rooms, Timer
+
+from config import Config
+from flask import Flask
+
+
+def setup(profile, claims):
+    use_temp_database(profile)
+    from backend import database as db
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    db.init_db()
+    with app.app_context():
+        conn = db.get_db()
+        seed_rooms(conn, rooms_per_building=claims // 4 + 1)
+        conn.executemany(
+            'INSERT INTO users (username, password_hash, name) VALUES (?, ?, ?)',
+            [(f'bench{i}', 'x', f'Bench {i}') for i in range(claims)]
+        )
+        conn.commit()
+        users = [r['id'] for r in conn.execute('SELECT id FROM users WHERE is_admin = 0 ORDER BY id')]
+        beds = [r['id'] for r in conn.execute('SELECT id FROM beds ORDER BY id')]
+    return app, db, list(zip(users, beds))
+
+
+def run_clients(pairs, clients, claim):
+    chunks = [pairs[i::clients] for i in range(clients)]
+    threads = [threading.Thread(target=lambda chunk=chunk: [claim(u, b) for u, b in chunk]) for chunk in chunks]
+    with Timer() as t:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return len(pairs) / t.elapsed
+
+
+def bench_direct(profile, clients, claims):
+    app, db, pairs = setup(profile, claims)
+
+    def claim(user_id, bed_id):
+        # One app context per claim, like one HTTP request
+        with app.app_context():
+            db.select_room(user_id, bed_id, operated_by=user_id)
+
+    return run_clients(pairs, clients, claim)
+
+
+def bench_engine(profile, clients, claims, max_batch):
+    app, db, pairs = setup(profile, claims)
+    from backend.selection_engine import SelectionEngine
+    engine = SelectionEngine(app, max_batch=max_batch, timeout=60)
+
+    def claim(user_id, bed_id):
+        engine.run(db.select_room, user_id, bed_id, operated_by=user_id)
+
+    rate = run_clients(pairs, clients, claim)
+    stats = engine.stats
+    return rate, stats['commands'] / max(stats['batches'], 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--claims', type=int, default=2000)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--profiles', nargs='*', default=['wal', 'wal_full'])
+    args = parser.parse_args()
+
+    print(f'{args.clients} clients, {args.claims} claims')
+    print(f'{"profile":<12}{"direct/s":>12}{"engine/s":>12}{"speedup":>10}{"avg batch":>12}')
+    for profile in args.profiles:
+        direct = bench_direct(profile, args.clients, args.claims)
+        engine, avg_batch = bench_engine(profile, args.clients, args.claims, args.max_batch)
+        print(f'{profile:<12}{direct:>12.1f}{engine:>12.1f}{engine / direct:>9.1f}x{avg_batch:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
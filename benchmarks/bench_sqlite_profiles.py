@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Compare read/write throughput of the SQLite profiles in config.SQLITE_PROFILES.
+
+Readers run the available-rooms query while writers flip bed occupancy in
+small transactions, mimicking selection day. Usage:
+
+    python benchmarks/bench_sqlite_profiles.py --readers 8 --writers 4 --seconds 5
+"""
+import argparse
+import sqlite3
+import threading
+import time
+
+from common import use_temp_database, seed_rooms
+
+from config import SQLITE_PROFILES
+
+READ_QUERY = '''
+    SELECT r.*, b.name as building_name,
+           (SELECT COUNT(*) FROM beds WHERE room_id = r.id AND is_occupied = 0) as available_beds
+    FROM rooms r
+    JOIN buildings b ON r.building_id = b.id
+    WHERE r.is_available = 1 AND r.current_occupancy < r.max_capacity
+    ORDER BY b.name, r.room_number
+'''
+
+
+def run_profile(name, readers, writers, seconds, rooms):
+    use_temp_database(name)
+    from backend import database as db
+    db.init_db()
+    conn = db.get_db()
+    seed_rooms(conn, rooms_per_building=rooms)
+    bed_count = conn.execute('SELECT COUNT(*) FROM beds').fetchone()[0]
+    conn.close()
+
+    counts = {'reads': 0, 'writes': 0, 'locked': 0}
+    counts_lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def bump(key):
+        with counts_lock:
+            counts[key] += 1
+
+    def reader():
+        while time.perf_counter() < stop:
+            conn = db.get_db()
+            try:
+                conn.execute(READ_QUERY).fetchall()
+                bump('reads')
+            except sqlite3.OperationalError:
+                bump('locked')
+            finally:
+                conn.close()
+
+    def writer(seed):
+        bed_id = seed
+        while time.perf_counter() < stop:
+            bed_id = bed_id % bed_count + 1
+            try:
+                with db.get_db_connection() as conn:
+                    c = conn.cursor()
+                    c.execute('UPDATE beds SET is_occupied = 1 - is_occupied WHERE id = ?', (bed_id,))
+                    c.execute('''
+                        UPDATE rooms
+                        SET current_occupancy = (SELECT COUNT(*) FROM beds WHERE room_id = rooms.id AND is_occupied = 1)
+                        WHERE id = (SELECT room_id FROM beds WHERE id = ?)
+                    ''', (bed_id,))
+                bump('writes')
+            except sqlite3.OperationalError:
+                bump('locked')
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i * 97,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    db.get_pool().close_all()
+    return {k: v / seconds for k, v in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rooms', type=int, default=500)
+    parser.add_argument('--profiles', nargs='*', default=list(SQLITE_PROFILES))
+    args = parser.parse_args()
+
+    print(f'{args.readers} readers, {args.writers} writers, {args.rooms} rooms, {args.seconds}s per profile')
+    print(f'{"profile":<12}{"reads/s":>12}{"writes/s":>12}{"locked/s":>12}')
+    for name in args.profiles:
+        result = run_profile(name, args.readers, args.writers, args.seconds, args.rooms)
+        print(f'{name:<12}{result["reads"]:>12.1f}{result["writes"]:>12.1f}{result["locked"]:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Speed and fairness of the weighted lottery permutation.
+
+Speed: time lottery_engine.weighted_shuffle against the unweighted
+permutation for each participant count.
+
+Fairness, two checks:
+  * first place: with weights 1..5, the share of trials a user is drawn
+    first must match w / sum(w) (Efraimidis-Spirakis guarantee); reported
+    with a chi-square statistic (4 degrees of freedom, 5% critical 9.49).
+  * large campus: 10% of users have weight 3; reports the share of weighted
+    users among the first 10% of lottery numbers and their mean rank,
+    against the unweighted baseline.
+
+Usage:
+
+    python benchmarks/bench_weighted_lottery.py --participants 1000 10000 100000
+"""
+import argparse
+
+import numpy as np
+
+from common import use_temp_database, Timer
+
+use_temp_database()
+from backend import lottery_engine
+
+
+def bench_speed(participants, repeats=5):
+    rng = np.random.default_rng(1)
+    user_ids = np.arange(1, participants + 1, dtype=np.int64)
+    weights = rng.choice([1.0, 2.0, 3.0], size=participants)
+    uniform = weighted = float('inf')
+    for _ in range(repeats):
+        with Timer() as t:
+            lottery_engine.shuffle(user_ids, rng)
+        uniform = min(uniform, t.elapsed)
+        with Timer() as t:
+            lottery_engine.weighted_shuffle(user_ids, weights, rng)
+        weighted = min(weighted, t.elapsed)
+    return uniform, weighted
+
+
+def first_place(trials):
+    rng = np.random.default_rng(2)
+    weights = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+    user_ids = np.arange(len(weights))
+    counts = np.zeros(len(weights))
+    for _ in range(trials):
+        counts[lottery_engine.weighted_shuffle(user_ids, weights, rng)[0]] += 1
+    expected = weights / weights.sum() * trials
+    chi_square = float(((counts - expected) ** 2 / expected).sum())
+    return counts / trials, weights / weights.sum(), chi_square
+
+
+def heavy_share(participants, trials, heavy_weight=3.0):
+    rng = np.random.default_rng(3)
+    user_ids = np.arange(participants)
+    heavy = np.zeros(participants, dtype=bool)
+    heavy[rng.choice(participants, participants // 10, replace=False)] = True
+    weights = np.where(heavy, heavy_weight, 1.0)
+    top = participants // 10
+    shares, ranks = [], []
+    for weighted in (False, True):
+        share = rank = 0.0
+        for _ in range(trials):
+            order = lottery_engine.weighted_shuffle(user_ids, weights, rng) if weighted else lottery_engine.shuffle(user_ids, rng)
+            share += heavy[order[:top]].mean()
+            rank += np.flatnonzero(heavy[order]).mean() / participants
+        shares.append(share / trials)
+        ranks.append(rank / trials)
+    return shares, ranks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', type=int, nargs='*', default=[1000, 10000, 100000])
+    parser.add_argument('--trials', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f'{"participants":>13}{"uniform ms":>12}{"weighted ms":>13}')
+    for participants in args.participants:
+        uniform, weighted = bench_speed(participants)
+        print(f'{participants:>13}{uniform * 1000:>12.2f}{weighted * 1000:>13.2f}')
+
+    observed, expected, chi_square = first_place(args.trials)
+    print(f'\nfirst place over {args.trials} trials, weights 1..5')
+    print('  observed ' + ' '.join(f'{p:.3f}' for p in observed))
+    print('  expected ' + ' '.join(f'{p:.3f}' for p in expected))
+    print(f'  chi-square {chi_square:.2f} ({"ok" if chi_square < 9.49 else "REJECTED"} at 5%)')
+
+    participants = 10000
+    shares, ranks = heavy_share(participants, 50)
+    print(f'\n{participants} participants, 10% with weight 3')
+    print(f'  share of weighted users in first 10%: unweighted {shares[0]:.3f}, weighted {shares[1]:.3f}')
+    print(f'  mean relative rank of weighted users: unweighted {ranks[0]:.3f}, weighted {ranks[1]:.3f}')
+
+
+if __name__ == '__main__':
+    main()
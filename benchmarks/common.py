@@ -0,0 +1,66 @@
+"""Shared helpers for the benchmark scripts in this directory."""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from config import Config
+
+
+def use_temp_database(profile=None):
+    """Point Config at a fresh database file in a temp dir and return its path.
+
+    Must run before backend.database is imported for the first time, so the
+    import-time init_db() does not create dorm_lottery.db in the cwd.
+    """
+    path = os.path.join(tempfile.mkdtemp(prefix='dorm_bench_'), 'bench.db')
+    Config.DATABASE_NAME = path
+    if profile:
+        Config.SQLITE_PROFILE = profile
+    return path
+
+
+def seed_rooms(conn, buildings=1, rooms_per_building=500, capacity=4, room_type='4'):
+    """Bulk insert buildings, rooms and beds; returns the number of rooms."""
+    c = conn.cursor()
+    total = 0
+    for b in range(1, buildings + 1):
+        c.execute('INSERT INTO buildings (name) VALUES (?)', (f'{b}号楼',))
+        building_id = c.lastrowid
+        c.executemany(
+            'INSERT INTO rooms (building_id, room_number, room_type, max_capacity) VALUES (?, ?, ?, ?)',
+            [(building_id, str(100 + i), room_type, capacity) for i in range(rooms_per_building)]
+        )
+        total += rooms_per_building
+    c.execute('''
+        INSERT INTO beds (room_id, bed_number)
+        SELECT r.id, n.value FROM rooms r
+        JOIN (WITH RECURSIVE seq(value) AS (SELECT 1 UNION ALL SELECT value + 1 FROM seq WHERE value < ?)
+              SELECT value FROM seq) n ON n.value <= r.max_capacity
+    ''', (capacity,))
+    conn.commit()
+    return total
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Timer:
+    """Context manager that records elapsed wall time in seconds."""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Generate a production-sized dorm lottery database for profiling.
+
+Builds a fresh database with the schema from init_db and fills it with bulk
+inserts in one transaction: --buildings buildings of --floors floors with
+--rooms-per-floor rooms each (a --six-share of them 6-person rooms, the
+rest 4-person), their beds, --users students sharing one precomputed
+bcrypt hash, a published lottery drawn through lottery_engine over every
+student, room type allocations for --allocated of the drawn students,
+selections for the first --selected of them in lottery order and an
+allocation_history of about --history rows per selected student. Bed
+flags and rooms.current_occupancy are derived from the selections.
+
+    python benchmarks/generate_dataset.py --database /tmp/big/dorm_lottery.db
+
+Every student logs in with --password; the default admin is created by
+init_db as usual. Point the app at the file by running it from its
+directory (DATABASE_NAME is relative) and profile the admin listings,
+exports and statistics at scale.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+
+from common import Timer
+
+from config import Config
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈'
+GIVEN = '伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超秀兰霞平刚桂英华玉萍红娥玲芬燕彬鹏辉宇浩然子轩欣怡梓涵'
+
+
+def generate_users(conn, args, rng, password_hash):
+    names = [rng.choice(SURNAMES) + ''.join(rng.choices(GIVEN, k=rng.randint(1, 2))) for _ in range(args.users)]
+    conn.executemany(
+        'INSERT INTO users (username, password_hash, name) VALUES (?, ?, ?)',
+        ((f'{args.username_prefix}{i:06d}', password_hash, names[i]) for i in range(args.users))
+    )
+
+
+def generate_rooms(conn, args, rng):
+    """Insert buildings, rooms and beds; returns {room_type: [(room_id, [bed ids])]}."""
+    c = conn.cursor()
+    rooms = []
+    for b in range(1, args.buildings + 1):
+        c.execute('INSERT INTO buildings (name, description) VALUES (?, ?)', (f'{b}号楼', f'{args.floors}层学生公寓'))
+        building_id = c.lastrowid
+        for floor in range(1, args.floors + 1):
+            for number in range(1, args.rooms_per_floor + 1):
+                room_type = '6' if rng.random() < args.six_share else '4'
+                rooms.append((building_id, f'{floor}{number:02d}', room_type, int(room_type)))
+    c.executemany('INSERT INTO rooms (building_id, room_number, room_type, max_capacity) VALUES (?, ?, ?, ?)', rooms)
+    c.execute('''
+        INSERT INTO beds (room_id, bed_number)
+        SELECT r.id, n.value FROM rooms r
+        JOIN (WITH RECURSIVE seq(value) AS (SELECT 1 UNION ALL SELECT value + 1 FROM seq WHERE value < 6)
+              SELECT value FROM seq) n ON n.value <= r.max_capacity
+    ''')
+    by_type = {}
+    c.execute('''
+        SELECT r.id, r.room_type, b.id FROM rooms r JOIN beds b ON b.room_id = r.id
+        ORDER BY r.id, b.bed_number
+    ''')
+    for room_id, room_type, bed_id in c:
+        room_list = by_type.setdefault(room_type, [])
+        if not room_list or room_list[-1][0] != room_id:
+            room_list.append((room_id, []))
+        room_list[-1][1].append(bed_id)
+    return by_type
+
+
+def generate_lottery(conn, args, rng, by_type):
+    """Draw every student and publish; returns [(user_id, room_type)] in lottery order."""
+    import numpy as np
+    from backend import lottery_engine
+    c = conn.execute(
+        "INSERT INTO lottery_settings (lottery_name, lottery_time, room_type, is_published) VALUES (?, ?, '4', 1)",
+        ('生成数据抽签', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+    lottery_id = c.lastrowid
+    user_ids = lottery_engine.load_participants(conn)
+    segments = [
+        ('4', sum(len(beds) for room_id, beds in by_type.get('4', [])), 4, '4-'),
+        ('6', sum(len(beds) for room_id, beds in by_type.get('6', [])), 6, '6-'),
+    ]
+    lottery_engine.draw(conn, lottery_id, user_ids, segments, rng=np.random.default_rng(args.seed))
+    c.execute('SELECT user_id, room_type FROM lottery_results WHERE lottery_id = ? ORDER BY lottery_number', (lottery_id,))
+    return c.fetchall()
+
+
+def generate_selections(conn, args, rng, by_type, drawn):
+    """Seat the first --selected of the drawn students and write their history."""
+    allocated = rng.sample(drawn, int(len(drawn) * args.allocated))
+    conn.executemany(
+        'INSERT INTO room_type_allocations (user_id, room_type, allocated_by, notes) VALUES (?, ?, 1, ?)',
+        ((user_id, room_type, '生成数据') for user_id, room_type in allocated)
+    )
+
+    # Students fill rooms one after another, rooms in random order
+    free = {}
+    bed_pool = {}
+    for room_type, rooms in by_type.items():
+        rooms = rooms[:]
+        rng.shuffle(rooms)
+        free[room_type] = iter([(room_id, bed_id) for room_id, beds in rooms for bed_id in beds])
+        bed_pool[room_type] = [(room_id, bed_id) for room_id, beds in rooms for bed_id in beds]
+
+    selections = []
+    for user_id, room_type in drawn[:int(len(drawn) * args.selected)]:
+        room_id, bed_id = next(free[room_type], (None, None))
+        if bed_id is not None:
+            selections.append((user_id, room_id, bed_id))
+    conn.executemany('INSERT INTO room_selections (user_id, room_id, bed_id) VALUES (?, ?, ?)', selections)
+    conn.executemany('UPDATE beds SET is_occupied = 1 WHERE id = ?', ((bed_id,) for user_id, room_id, bed_id in selections))
+    occupancy = Counter(room_id for user_id, room_id, bed_id in selections)
+    conn.executemany('UPDATE rooms SET current_occupancy = ? WHERE id = ?', ((n, room_id) for room_id, n in occupancy.items()))
+
+    # Earlier picks that were changed or dropped, then the final assignment
+    room_type_of = dict(drawn)
+    start = datetime.now() - timedelta(days=14)
+    history = []
+    for user_id, room_id, bed_id in selections:
+        at = start + timedelta(seconds=rng.randrange(14 * 86400))
+        depth = max(1, round(rng.expovariate(1 / args.history))) if args.history else 0
+        action = 'assigned'
+        for step in range(depth - 1):
+            old_room, old_bed = rng.choice(bed_pool[room_type_of[user_id]])
+            history.append((user_id, old_room, old_bed, action, None, None, at.strftime('%Y-%m-%d %H:%M:%S')))
+            at += timedelta(minutes=rng.randint(1, 600))
+            action = 'modified'
+            if rng.random() < 0.3:
+                history.append((user_id, old_room, old_bed, 'removed', None, None, at.strftime('%Y-%m-%d %H:%M:%S')))
+                at += timedelta(minutes=rng.randint(1, 600))
+                action = 'assigned'
+        if depth:
+            history.append((user_id, room_id, bed_id, action, None, None, at.strftime('%Y-%m-%d %H:%M:%S')))
+    history.sort(key=lambda row: row[6])
+    conn.executemany(
+        'INSERT INTO allocation_history (user_id, room_id, bed_id, action, operated_by, notes, operated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        history
+    )
+    return len(allocated), len(selections), len(history)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', required=True, help='database file to create')
+    parser.add_argument('--force', action='store_true', help='replace an existing file')
+    parser.add_argument('--buildings', type=int, default=40)
+    parser.add_argument('--floors', type=int, default=8)
+    parser.add_argument('--rooms-per-floor', type=int, default=40)
+    parser.add_argument('--six-share', type=float, default=0.25, help='share of 6-person rooms')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--username-prefix', default='s')
+    parser.add_argument('--password', default='password123')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12, help='cost of the shared password hash')
+    parser.add_argument('--allocated', type=float, default=0.3, help='share of drawn students with a room type allocation')
+    parser.add_argument('--selected', type=float, default=0.8, help='share of drawn students who picked a bed')
+    parser.add_argument('--history', type=float, default=4, help='mean allocation_history rows per selected student')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    path = os.path.abspath(args.database)
+    if os.path.exists(path):
+        if not args.force:
+            sys.exit(f'{path} exists, pass --force to replace it')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # backend.database runs init_db on import when the file is missing
+    Config.DATABASE_NAME = path
+    import bcrypt
+    from backend import database as db  # noqa: F401
+
+    rng = random.Random(args.seed)
+    password_hash = bcrypt.hashpw(args.password.encode('utf-8'), bcrypt.gensalt(rounds=args.bcrypt_rounds)).decode('utf-8')
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('BEGIN')
+    with Timer() as total:
+        with Timer() as t:
+            generate_users(conn, args, rng, password_hash)
+        print(f'{args.users} users in {t.elapsed:.2f}s')
+        with Timer() as t:
+            by_type = generate_rooms(conn, args, rng)
+        rooms = sum(len(r) for r in by_type.values())
+        beds = sum(len(beds) for r in by_type.values() for room_id, beds in r)
+        print(f'{args.buildings} buildings, {rooms} rooms, {beds} beds in {t.elapsed:.2f}s')
+        with Timer() as t:
+            drawn = generate_lottery(conn, args, rng, by_type)
+        print(f'lottery with {len(drawn)} drawn students in {t.elapsed:.2f}s')
+        with Timer() as t:
+            allocated, selected, history = generate_selections(conn, args, rng, by_type, drawn)
+        print(f'{allocated} allocations, {selected} selections, {history} history rows in {t.elapsed:.2f}s')
+        conn.execute('COMMIT')
+        conn.execute('ANALYZE')
+    conn.close()
+    print(f'{path} built in {total.elapsed:.2f}s, students log in with {args.password!r}')
+
+
+if __name__ == '__main__':
+    main()
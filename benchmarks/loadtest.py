@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""Selection-day load test against the Flask app.
+
+Seeds a synthetic campus (buildings, rooms through db.create_room, students
+and a published lottery), logs every student in and then fires a mix of
+/api/room-selection/select, /api/room-selection/change and
+/api/lottery/rooms/available requests from --concurrency threads. A
+--hot-share of the bed picks go to the first --hot-fraction of the beds,
+like the popular rooms everyone wants. Reports throughput and latency per
+endpoint, the 409/503 rates, and checks the final state: no bed held twice,
+occupied flags and rooms.current_occupancy matching room_selections.
+Exits non-zero when an invariant is broken.
+
+With --streams N, N students keep a /api/lottery/rooms/stream connection
+open for the whole selection phase, like pages left open in browsers. The
+report then shows how many streams the server accepted or refused (503
+past ROOM_STREAM_MAX_CONNECTIONS per worker) and how many bed events they
+received, next to the latency of the other endpoints.
+
+In-process, through the Flask test client (default):
+
+    python benchmarks/loadtest.py --students 2000 --requests 20000 --concurrency 32
+
+Against a local gunicorn, seed first, start the server in the directory
+holding the database file, then run without seeding:
+
+    python benchmarks/loadtest.py --database /tmp/lt/dorm_lottery.db --seed-only
+    gunicorn --chdir /tmp/lt --pythonpath . -w 4 -k gthread --threads 8 -b 127.0.0.1:5000 'backend.app:create_app("production")'
+    python benchmarks/loadtest.py --database /tmp/lt/dorm_lottery.db --skip-seed --url http://127.0.0.1:5000
+
+Students are seeded with a --bcrypt-rounds hash. A server whose
+BCRYPT_ROUNDS differs rehashes each password at its first login, which
+makes the login phase measure that instead.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter, defaultdict
+
+from common import use_temp_database, percentile, Timer
+
+from config import Config
+
+PASSWORD = 'loadtest'
+
+
+def seed(args):
+    """Create the campus, students and a published lottery in Config.DATABASE_NAME."""
+    import bcrypt
+    from backend.app import create_app
+    from backend import database as db, lottery_engine
+    app = create_app('production')
+    with app.app_context():
+        # create_room commits on its own; the outer block turns those into
+        # savepoints so the whole campus is one transaction
+        with db.get_db_connection():
+            for b in range(1, args.buildings + 1):
+                building_id = db.create_building(f'{b}号楼')
+                for r in range(args.rooms_per_building):
+                    floor, number = divmod(r, 20)
+                    db.create_room(building_id, f'{floor + 1}{number + 1:02d}', '4', 4)
+
+        # One hash for everyone: hashing per student would dominate seeding
+        password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds=args.bcrypt_rounds)).decode('utf-8')
+        with db.get_db_connection() as conn:
+            conn.executemany(
+                'INSERT INTO users (username, password_hash, name) VALUES (?, ?, ?)',
+                [(f'lt{i:06d}', password_hash, f'学生{i}') for i in range(args.students)]
+            )
+            c = conn.execute(
+                "INSERT INTO lottery_settings (lottery_name, lottery_time, room_type, is_published) VALUES ('压测抽签', datetime('now'), '4', 1)"
+            )
+            user_ids = lottery_engine.load_participants(conn)
+            lottery_engine.draw(conn, c.lastrowid, user_ids, [('4', len(user_ids), 4, '4-')])
+    beds = args.buildings * args.rooms_per_building * 4
+    print(f'seeded {args.buildings} buildings, {beds // 4} rooms, {beds} beds, {args.students} students')
+
+
+class TestClientTransport:
+    """Requests through the Flask test client; one client per thread."""
+
+    def __init__(self):
+        from backend.app import create_app
+        self.app = create_app('production')
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, token=None):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self.local.client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+    def stream(self, path):
+        """Open a streaming GET; returns (status, chunk iterator, close)."""
+        response = self.app.test_client().get(path, buffered=False)
+        return response.status_code, response.response, response.close
+
+
+class HttpTransport:
+    """Requests to a running server over one keep-alive connection per thread."""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlparse(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        payload = json.dumps(body) if body is not None else None
+        for attempt in (1, 2):
+            if not hasattr(self.local, 'conn'):
+                self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.local.conn.request(method, path, body=payload, headers=headers)
+                response = self.local.conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # Server closed the keep-alive connection; reconnect once
+                del self.local.conn
+                if attempt == 2:
+                    raise
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+    def stream(self, path):
+        """Open a streaming GET on its own connection; returns (status, line iterator, close)."""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        conn.request('GET', path)
+        response = conn.getresponse()
+        if response.status != 200:
+            response.read()
+        return response.status, iter(response.readline, b''), conn.close
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def record(self, endpoint, status, elapsed):
+        with self.lock:
+            self.latencies[endpoint].append(elapsed * 1000)
+            self.statuses[endpoint][status] += 1
+
+
+def run_parallel(items, concurrency, work):
+    chunks = [items[i::concurrency] for i in range(concurrency)]
+    errors = []
+
+    def worker(chunk):
+        try:
+            for item in chunk:
+                work(item)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks if chunk]
+    with Timer() as t:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return t.elapsed
+
+
+def login_all(transport, usernames, concurrency, stats):
+    tokens = {}
+
+    def login(username):
+        with Timer() as t:
+            status, body = transport.request('POST', '/api/auth/login', {'username': username, 'password': PASSWORD})
+        stats.record('login', status, t.elapsed)
+        if status == 200:
+            tokens[username] = body['access_token']
+
+    elapsed = run_parallel(usernames, concurrency, login)
+    return tokens, elapsed
+
+
+def selection_day(transport, tokens, beds, args, stats):
+    """Fire the request mix; each student's requests run in one thread, in order."""
+    rng = random.Random(args.seed)
+    hot = beds[:max(1, int(len(beds) * args.hot_fraction))]
+    mix = [('select', args.select_share), ('change', args.change_share), ('available', args.available_share)]
+    students = list(tokens)
+    plan = defaultdict(list)
+    for _ in range(args.requests):
+        kind = rng.choices([k for k, _ in mix], [w for _, w in mix])[0]
+        bed_id = rng.choice(hot) if rng.random() < args.hot_share else rng.choice(beds)
+        plan[rng.choice(students)].append((kind, bed_id))
+
+    def student(username):
+        token = tokens[username]
+        has_bed = False
+        for kind, bed_id in plan[username]:
+            if kind == 'change' and not has_bed:
+                kind = 'select'
+            with Timer() as t:
+                if kind == 'select':
+                    status, body = transport.request('POST', '/api/room-selection/select', {'bed_id': bed_id}, token)
+                elif kind == 'change':
+                    status, body = transport.request('POST', '/api/room-selection/change', {'new_bed_id': bed_id}, token)
+                else:
+                    status, body = transport.request('GET', '/api/lottery/rooms/available?room_type=4', token=token)
+            stats.record(kind, status, t.elapsed)
+            if kind != 'available' and status in (200, 201):
+                has_bed = True
+
+    return run_parallel(list(plan), args.concurrency, student)
+
+
+class StreamHolder:
+    """Keep room event streams open in background threads and count what they receive."""
+
+    def __init__(self, transport, tokens):
+        self.transport = transport
+        self.tokens = tokens
+        self.lock = threading.Lock()
+        self.statuses = Counter()
+        self.events = 0
+        self.closers = []
+        self.threads = []
+        self.stopped = threading.Event()
+
+    def _hold(self, token):
+        status, body = self.transport.request('POST', '/api/lottery/rooms/stream-token', token=token)
+        if status != 200:
+            with self.lock:
+                self.statuses[status] += 1
+            return
+        status, chunks, close = self.transport.stream(f'/api/lottery/rooms/stream?jwt={body["token"]}')
+        with self.lock:
+            self.statuses[status] += 1
+            self.closers.append(close)
+        if status != 200:
+            close()
+            return
+        try:
+            for chunk in chunks:
+                if self.stopped.is_set():
+                    break
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                with self.lock:
+                    self.events += chunk.count(b'event: bed')
+        except (OSError, ValueError, AttributeError, http.client.HTTPException):
+            pass  # Closed by stop()
+
+    def start(self):
+        for token in self.tokens:
+            thread = threading.Thread(target=self._hold, args=(token,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+        with self.lock:
+            closers = list(self.closers)
+        for close in closers:
+            try:
+                close()
+            except Exception:
+                pass  # The in-process stream may be mid-read in its thread
+        for thread in self.threads:
+            thread.join(1)
+        with self.lock:
+            return dict(self.statuses), self.events
+
+
+def check_invariants(database):
+    """Return a list of broken invariants in the final database state."""
+    conn = sqlite3.connect(database)
+    problems = []
+    checks = [
+        ('beds held by more than one selection',
+         'SELECT COUNT(*) FROM (SELECT bed_id FROM room_selections GROUP BY bed_id HAVING COUNT(*) > 1)'),
+        ('students with more than one selection',
+         'SELECT COUNT(*) FROM (SELECT user_id FROM room_selections GROUP BY user_id HAVING COUNT(*) > 1)'),
+        ('selections whose bed is not marked occupied',
+         'SELECT COUNT(*) FROM room_selections rs JOIN beds b ON rs.bed_id = b.id WHERE b.is_occupied = 0'),
+        ('occupied beds without a selection',
+         'SELECT COUNT(*) FROM beds b LEFT JOIN room_selections rs ON rs.bed_id = b.id WHERE b.is_occupied = 1 AND rs.id IS NULL'),
+        ('selections pointing at the wrong room',
+         'SELECT COUNT(*) FROM room_selections rs JOIN beds b ON rs.bed_id = b.id WHERE b.room_id != rs.room_id'),
+        ('rooms whose current_occupancy is off',
+         '''SELECT COUNT(*) FROM rooms r
+            WHERE r.current_occupancy != (SELECT COUNT(*) FROM room_selections rs WHERE rs.room_id = r.id)'''),
+        ('rooms over capacity', 'SELECT COUNT(*) FROM rooms WHERE current_occupancy > max_capacity'),
+    ]
+    for description, query in checks:
+        count = conn.execute(query).fetchone()[0]
+        if count:
+            problems.append(f'{count} {description}')
+    selections = conn.execute('SELECT COUNT(*) FROM room_selections').fetchone()[0]
+    conn.close()
+    return problems, selections
+
+
+def report(stats, elapsed, label):
+    print(f'\n{label}: {sum(len(v) for v in stats.latencies.values())} requests in {elapsed:.2f}s')
+    print(f'{"endpoint":>10}{"count":>8}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"2xx":>8}{"409":>8}{"503":>8}{"other":>7}')
+    for endpoint, samples in sorted(stats.latencies.items()):
+        statuses = stats.statuses[endpoint]
+        ok = sum(n for s, n in statuses.items() if 200 <= s < 300)
+        other = len(samples) - ok - statuses[409] - statuses[503]
+        print(f'{endpoint:>10}{len(samples):>8}{len(samples) / elapsed:>9.1f}'
+              f'{percentile(samples, 50):>9.1f}{percentile(samples, 95):>9.1f}{percentile(samples, 99):>9.1f}'
+              f'{ok / len(samples):>8.1%}{statuses[409] / len(samples):>8.1%}{statuses[503] / len(samples):>8.1%}{other:>7}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='server to test; default is the in-process Flask test client')
+    parser.add_argument('--database', help='database file to seed and check (default: a temp file)')
+    parser.add_argument('--seed-only', action='store_true')
+    parser.add_argument('--skip-seed', action='store_true')
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--buildings', type=int, default=5)
+    parser.add_argument('--rooms-per-building', type=int, default=60)
+    parser.add_argument('--bcrypt-rounds', type=int, default=4, help='cost of the seeded password hash')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--hot-fraction', type=float, default=0.02, help='share of beds that are hot')
+    parser.add_argument('--hot-share', type=float, default=0.5, help='share of picks aimed at hot beds')
+    parser.add_argument('--select-share', type=float, default=0.4)
+    parser.add_argument('--change-share', type=float, default=0.2)
+    parser.add_argument('--available-share', type=float, default=0.4)
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the request plan')
+    parser.add_argument('--streams', type=int, default=0,
+                        help='room event streams to hold open during the selection phase')
+    args = parser.parse_args()
+    # Keep the in-process app from rehashing the seeded passwords at login
+    Config.BCRYPT_ROUNDS = args.bcrypt_rounds
+
+    if args.database:
+        Config.DATABASE_NAME = os.path.abspath(args.database)
+    elif args.url or args.skip_seed:
+        parser.error('--url and --skip-seed need --database so the state can be checked')
+    else:
+        use_temp_database()
+
+    if not args.skip_seed:
+        seed(args)
+    if args.seed_only:
+        return
+
+    conn = sqlite3.connect(Config.DATABASE_NAME)
+    usernames = [row[0] for row in conn.execute("SELECT username FROM users WHERE username LIKE 'lt%' ORDER BY id")]
+    beds = [row[0] for row in conn.execute('SELECT id FROM beds ORDER BY id')]
+    conn.close()
+
+    transport = HttpTransport(args.url) if args.url else TestClientTransport()
+    login_stats = Stats()
+    tokens, elapsed = login_all(transport, usernames, args.concurrency, login_stats)
+    report(login_stats, elapsed, f'login ({len(tokens)}/{len(usernames)} students)')
+
+    holder = None
+    if args.streams:
+        holder = StreamHolder(transport, list(tokens.values())[-args.streams:])
+        holder.start()
+        # Let the streams connect before the request mix starts
+        time.sleep(1)
+
+    stats = Stats()
+    elapsed = selection_day(transport, tokens, beds, args, stats)
+    report(stats, elapsed, 'selection day')
+
+    if holder is not None:
+        statuses, events = holder.stop()
+        print(f'\nstreams: {statuses.get(200, 0)} open, {statuses.get(503, 0)} refused (503), '
+              f'{sum(statuses.values()) - statuses.get(200, 0) - statuses.get(503, 0)} other; '
+              f'{events} bed events received')
+
+    problems, selections = check_invariants(Config.DATABASE_NAME)
+    print(f'\n{selections} of {len(beds)} beds taken')
+    if problems:
+        for problem in problems:
+            print(f'INVARIANT BROKEN: {problem}')
+        sys.exit(1)
+    print('invariants ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,104 @@
 import os
 
+# SQLite 存储配置档：每个连接建立时执行一次对应的 PRAGMA
+# 可用 benchmarks/bench_sqlite_profiles.py 对比各配置档的读写吞吐
+SQLITE_PROFILES = {
+    # SQLite 默认的回滚日志模式
+    'rollback': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+    },
+    # WAL：读写互不阻塞，synchronous=NORMAL 时只在检查点同步磁盘
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,  # 16MB
+        'mmap_size': 134217728,  # 128MB
+        'temp_store': 'MEMORY',
+    },
+    # WAL + 每次提交都同步磁盘，断电也不丢已提交事务
+    'wal_full': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,
+        'mmap_size': 134217728,
+        'temp_store': 'MEMORY',
+    },
+}
+
 class Config:
     SECRET_KEY = 'dev-secret-key-change-in-production'
     JWT_SECRET_KEY = 'jwt-secret-key-change-in-production'
     DATABASE_NAME = 'dorm_lottery.db'
     
+    # 数据库连接池配置
+    DB_POOL_SIZE = 10  # 保留的空闲连接数上限
+    DB_POOL_HEALTH_CHECK = True  # 取出连接时先执行 SELECT 1 检查
+    SQLITE_PROFILE = 'wal'  # SQLITE_PROFILES 中的配置档名称
+    
+    # 床位选择锁：memory 仅在单进程内有效；sqlite 通过 lock_leases 表跨进程生效，
+    # 但每次选择/取消多两个写事务。gunicorn 多于一个 worker（WEB_CONCURRENCY > 1）时
+    # 即使这里是 memory 也会自动改用 sqlite。
+    # 两者都只是减少争抢，防止重复选床靠的是 select_room 的条件 UPDATE
+    LOCK_BACKEND = 'memory'
+    # 排队等待模式：床位被锁时按先来后到排队，而不是立即返回 503
+    LOCK_WAIT_ENABLED = False
+    LOCK_MAX_WAIT = 3.0  # 最长等待秒数
+    LOCK_MAX_QUEUE_DEPTH = 20  # 单个床位的最大排队人数，超出直接失败
+    
+    # 批量提交选择引擎：选择/取消/更改/确认由单个写线程合并到一个事务中提交
+    SELECTION_ENGINE_ENABLED = False
+    SELECTION_ENGINE_MAX_BATCH = 64  # 每个事务最多合并的操作数
+    SELECTION_ENGINE_TIMEOUT = 10  # 请求等待提交结果的最长秒数
+    
+    # 可选房间查询使用进程内床位索引，不再每次查询数据库
+    AVAILABILITY_INDEX_ENABLED = True
+    # 增量同步（?since=版本号）保留的变更版本数，更早的版本需要完整刷新
+    INVENTORY_CHANGE_RETENTION = 10000
+    
+    # 床位变化实时推送（SSE）：需要 gthread/gevent 等可长连接的 gunicorn worker
+    ROOM_STREAM_KEEPALIVE = 15  # 无事件时发送保活注释的间隔秒数
+    ROOM_STREAM_POLL_INTERVAL = 2  # 检查其他进程写入的间隔秒数
+    # 每个 worker 进程同时保持的推送连接上限。每个连接一直占用一个 gunicorn 线程，
+    # 必须明显小于 gunicorn.conf.py 的 threads，超出的客户端收到 503 并退回定时刷新
+    ROOM_STREAM_MAX_CONNECTIONS = 4
+    # 推送连接使用的一次性短期令牌有效秒数（只在建立连接时校验，只能用于推送接口）
+    ROOM_STREAM_TOKEN_EXPIRES = 60
+    
+    # 紧凑抽签模式：只保存随机种子和参与者名单，抽签号按需计算；
+    # 只有管理员修改某条抽签结果时才把该次抽签写入 lottery_results，查看和统计在内存中合并
+    LOTTERY_COMPACT_ENABLED = False
+    
+    # 按抽签顺序批量分配床位：每位学生最多填写的志愿数（楼栋/房间/楼层）
+    ROOM_PREFERENCE_LIMIT = 10
+    
+    # 分批选房时段：按抽签号分批开放，窗口在每个抽签设置中配置；
+    # 各进程缓存窗口表，最长这么多秒后重新加载以获取其他进程的修改
+    SELECTION_WINDOW_REFRESH = 30
+    
+    # SQL 语句统计：每个请求结束时输出一行 sql_profile 日志（语句数、总耗时、最长耗时），
+    # 超过阈值的语句附带 SQL 文本；调试模式下同时返回 X-SQL-Profile 响应头
+    SQL_PROFILE_ENABLED = False
+    SQL_SLOW_QUERY_MS = 50  # 慢查询阈值（毫秒）
+    SQL_PROFILE_EXPLAIN = False  # 对每条不同的查询执行 EXPLAIN QUERY PLAN，标记全表扫描
+    
+    # Prometheus 指标（/metrics）：请求数与延迟、床位锁、SQLite 连接与事务、bcrypt 耗时；
+    # gunicorn 多进程部署时 gunicorn.conf.py 在启动前设置并清空 PROMETHEUS_MULTIPROC_DIR 目录，
+    # 各进程的数据写入其中的文件，由任一进程汇总输出
+    METRICS_ENABLED = True
+    
+    # bcrypt 成本因子：新密码按此值计算；登录时若已存哈希的成本不同则自动重新计算
+    BCRYPT_ROUNDS = 12
+    # 批量导入时的 bcrypt 哈希进程池大小，0 表示 CPU 核数除以 gunicorn worker 数（WEB_CONCURRENCY）；
+    # 1 表示在请求线程中直接计算。单个密码（登录、修改密码）总是在请求线程中计算
+    PASSWORD_HASH_WORKERS = 0
+    
+    # CSV 导入按块流式读取，每块在一个事务中批量写入
+    IMPORT_CHUNK_SIZE = 1000
+    
     # 上传文件配置
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     UPLOAD_FOLDER = 'uploads'
@@ -19,6 +113,9 @@ class DevelopmentConfig(Config):
 
 class ProductionConfig(Config):
     DEBUG = False
+    # 实测（bench_sqlite_profiles.py）wal 的读写吞吐均为 rollback 的 2 倍以上，
+    # wal_full 写入吞吐下降约 20 倍
+    SQLITE_PROFILE = 'wal'
 
 config = {
     'development': DevelopmentConfig,
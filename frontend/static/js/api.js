@@ -127,9 +127,56 @@ class API {
         return this.put(`/api/admin/users/${userId}/password`, { new_password: newPassword });
     }
 
-    async importUsers(file) {
+    async updateUserPriorityWeight(userId, priorityWeight) {
+        return this.put(`/api/admin/users/${userId}/priority-weight`, { priority_weight: priorityWeight });
+    }
+
+    async getRoommateGroups() {
+        return this.get('/api/admin/roommate-groups');
+    }
+
+    async createRoommateGroup(name, usernames) {
+        return this.post('/api/admin/roommate-groups', { name, usernames });
+    }
+
+    async deleteRoommateGroup(groupId) {
+        return this.delete(`/api/admin/roommate-groups/${groupId}`);
+    }
+
+    async importPriorityWeights(file) {
+        const formData = new FormData();
+        formData.append('file', file);
+        
+        const config = {
+            method: 'POST',
+            headers: {
+                'Authorization': `Bearer ${this.token}`
+            },
+            body: formData
+        };
+
+        try {
+            const response = await fetch(this.baseURL + '/api/admin/users/priority-weights/import', config);
+            const data = await response.json();
+
+            if (!response.ok) {
+                throw new Error(data.error || '请求失败');
+            }
+
+            return data;
+        } catch (error) {
+            if (error.message.includes('401') || error.message.includes('token')) {
+                this.logout();
+                window.location.href = '/login';
+            }
+            throw error;
+        }
+    }
+
+    async importUsers(file, dryRun = false) {
         const formData = new FormData();
         formData.append('file', file);
+        if (dryRun) formData.append('dry_run', '1');  // 只校验，不导入
         
         const config = {
             method: 'POST',
@@ -189,9 +236,10 @@ class API {
         return this.delete(`/api/admin/rooms/${roomId}`);
     }
 
-    async importRooms(file) {
+    async importRooms(file, dryRun = false) {
         const formData = new FormData();
         formData.append('file', file);
+        if (dryRun) formData.append('dry_run', '1');  // 只校验，不导入
         
         const config = {
             method: 'POST',
@@ -277,6 +325,10 @@ class API {
         return this.delete(`/api/admin/lottery/${lotteryId}`);
     }
 
+    async batchAssignBeds(lotteryId, dryRun = false) {
+        return this.post(`/api/admin/lottery/${lotteryId}/batch-assign`, { dry_run: dryRun });
+    }
+
     async getAllLotteryResults(page = 1, perPage = 20, lotteryId = null) {
         const params = { page, per_page: perPage };
         if (lotteryId) params.lottery_id = lotteryId;
@@ -305,13 +357,29 @@ class API {
         return this.put(`/api/admin/lottery/results/${resultId}`, data);
     }
 
-    async getAvailableRooms(roomType = null, buildingId = null) {
+    async getAvailableRooms(roomType = null, buildingId = null, since = null) {
         const params = {};
         if (roomType) params.room_type = roomType;
         if (buildingId) params.building_id = buildingId;
+        if (since !== null) params.since = since;
         return this.get('/api/lottery/rooms/available', params);
     }
 
+    async openRoomStream() {
+        // EventSource 不能设置请求头，令牌放在查询参数中；
+        // 为此单独申请只能用于推送、很快过期的令牌，登录令牌不出现在 URL 里
+        const { token } = await this.post('/api/lottery/rooms/stream-token');
+        return new EventSource(`/api/lottery/rooms/stream?jwt=${encodeURIComponent(token)}`);
+    }
+
+    async updateSelectionWindow(settingId, windowData) {
+        return this.put(`/api/lottery/settings/${settingId}/selection-window`, windowData);
+    }
+
+    async getMySelectionWindow() {
+        return this.get('/api/lottery/selection-window');
+    }
+
     async getMySelection() {
         return this.get('/api/lottery/my-selection');
     }
@@ -333,6 +401,22 @@ class API {
         return this.post('/api/room-selection/change', { new_bed_id: newBedId });
     }
 
+    async getRoomPreferences() {
+        return this.get('/api/room-selection/preferences');
+    }
+
+    async saveRoomPreferences(preferences) {
+        return this.put('/api/room-selection/preferences', { preferences });
+    }
+
+    async getMyRoommateGroup() {
+        return this.get('/api/room-selection/group');
+    }
+
+    async selectGroupRoom(roomId) {
+        return this.post('/api/room-selection/select-group', { room_id: roomId });
+    }
+
     async getSelectionStatistics() {
         return this.get('/api/room-selection/statistics');
     }
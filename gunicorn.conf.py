@@ -0,0 +1,33 @@
+# gunicorn 生产部署配置：gunicorn -c gunicorn.conf.py app:app
+import os
+import shutil
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 5000)}"
+# 多于一个 worker 时床位锁自动改用 sqlite 后端（见 on_starting 和 locks.init_app）
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# 床位变化推送（SSE）是长连接，需要线程 worker；每个连接占用一个线程，
+# 所以 ROOM_STREAM_MAX_CONNECTIONS 要明显小于 threads，其余线程留给普通请求
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Prometheus 多进程模式：各 worker 把指标写入这个目录下的文件，/metrics 汇总输出。
+# 必须在 worker 导入 prometheus_client 之前设置，所以放在配置文件里而不是应用中
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/lucky-cookie-metrics')
+
+def on_starting(server):
+    """Publish the worker count and empty the metrics directory before any worker starts.
+    
+    Workers inherit WEB_CONCURRENCY, so the app sees the real count even
+    when it was given with -w. Do not enable preload_app: the app would be
+    loaded before this runs.
+    """
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that exited."""
+    # Imported here so the master process never loads the app's metrics
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -54,5 +54,5 @@ echo "默认管理员账户: admin / admin123"
 echo "按 Ctrl+C 停止服务"
 echo ""
 
-# 启动应用
+# 启动应用（生产环境使用 gunicorn -c gunicorn.conf.py app:app）
 python3 app.py
\ No newline at end of file
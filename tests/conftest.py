@@ -0,0 +1,76 @@
+"""Shared fixtures: every test that needs the database gets a fresh file."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from config import Config
+
+# Before backend.database is first imported, so its import-time init_db()
+# does not create dorm_lottery.db in the cwd
+Config.DATABASE_NAME = os.path.join(tempfile.mkdtemp(prefix='dorm_test_'), 'import.db')
+Config.BCRYPT_ROUNDS = 4
+Config.PASSWORD_HASH_WORKERS = 1
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App on an empty database in tmp_path (only the default admin exists)."""
+    monkeypatch.setattr(Config, 'DATABASE_NAME', str(tmp_path / 'test.db'))
+    from backend.app import create_app
+    app = create_app('development')
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def conn(app):
+    """A pooled connection to the test database, closed afterwards."""
+    from backend import database as db
+    connection = db.get_pool().acquire()
+    yield connection
+    connection.close()
+
+
+def seed_room(conn, room_number='101', capacity=4, building_id=None):
+    """Insert a room with capacity beds (and a building if none is given); returns the room id."""
+    c = conn.cursor()
+    if building_id is None:
+        c.execute('INSERT INTO buildings (name) VALUES (?)', (f'楼{room_number}',))
+        building_id = c.lastrowid
+    c.execute(
+        'INSERT INTO rooms (building_id, room_number, room_type, max_capacity) VALUES (?, ?, ?, ?)',
+        (building_id, room_number, str(capacity), capacity)
+    )
+    room_id = c.lastrowid
+    c.executemany('INSERT INTO beds (room_id, bed_number) VALUES (?, ?)',
+                  [(room_id, number) for number in range(1, capacity + 1)])
+    conn.commit()
+    return room_id
+
+
+def seed_users(conn, count, prefix='stu'):
+    """Insert count students without usable passwords; returns their ids."""
+    c = conn.cursor()
+    ids = []
+    for i in range(count):
+        c.execute('INSERT INTO users (username, password_hash, name) VALUES (?, ?, ?)',
+                  (f'{prefix}{i}', 'x', f'学生{i}'))
+        ids.append(c.lastrowid)
+    conn.commit()
+    return ids
+
+
+def seed_lottery(conn, published=True, name='抽签'):
+    """Insert a lottery setting; returns its id."""
+    c = conn.execute(
+        "INSERT INTO lottery_settings (lottery_name, lottery_time, room_type, is_published) VALUES (?, datetime('now'), '4', ?)",
+        (name, 1 if published else 0)
+    )
+    conn.commit()
+    return c.lastrowid
@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+
+from backend import database as db
+from backend.availability import get_availability_index
+from backend.lottery import query_available_rooms
+from config import Config
+from conftest import seed_room, seed_users
+
+
+def sql_rooms(conn, **filters):
+    return query_available_rooms(conn.cursor(), **filters)
+
+
+@pytest.fixture
+def index(app, conn):
+    """The app's availability index over two buildings of rooms, with full loads counted."""
+    first = seed_room(conn, room_number='101', capacity=4)
+    building_id = conn.execute('SELECT building_id FROM rooms WHERE id = ?', (first,)).fetchone()[0]
+    seed_room(conn, room_number='102', capacity=6, building_id=building_id)
+    seed_room(conn, room_number='201', capacity=4)
+    index = get_availability_index()
+    index.available_rooms()
+    index.loads = 0
+    load = index._load
+
+    def counting():
+        index.loads += 1
+        load()
+    index._load = counting
+    yield index
+    del index._load
+
+
+def beds_of(conn, room_number):
+    return [row[0] for row in conn.execute(
+        'SELECT bd.id FROM beds bd JOIN rooms r ON bd.room_id = r.id WHERE r.room_number = ? ORDER BY bd.id',
+        (room_number,)
+    )]
+
+
+@pytest.mark.parametrize('filters', [{}, {'room_type': '4'}, {'room_type': '6'}, {'building_id': 1}])
+def test_index_matches_the_query(index, conn, filters):
+    assert index.available_rooms(**filters)[1] == sql_rooms(conn, **filters)
+
+
+def test_local_writes_apply_incrementally(app, index, conn):
+    user_ids = seed_users(conn, 4)
+    with app.app_context():
+        for user_id, bed_id in zip(user_ids, beds_of(conn, '101')):
+            db.select_room(user_id, bed_id)
+        db.cancel_room_selection(user_ids[0])
+    version, rooms = index.available_rooms()
+    assert rooms == sql_rooms(conn)
+    assert version == conn.execute('SELECT version FROM inventory_version').fetchone()[0]
+    assert index.loads == 0
+
+
+def external_select(bed_id, bump=1, prune=False):
+    """Claim a bed from a separate connection, like another worker process would."""
+    other = sqlite3.connect(Config.DATABASE_NAME)
+    room_id = other.execute('SELECT room_id FROM beds WHERE id = ?', (bed_id,)).fetchone()[0]
+    other.execute('UPDATE beds SET is_occupied = 1 WHERE id = ?', (bed_id,))
+    other.execute('UPDATE rooms SET current_occupancy = current_occupancy + 1 WHERE id = ?', (room_id,))
+    other.execute('UPDATE inventory_version SET version = version + ?', (bump,))
+    if prune:
+        other.execute('DELETE FROM inventory_changes')
+    other.execute('INSERT INTO inventory_changes (version, room_id, bed_id) SELECT version, ?, ? FROM inventory_version',
+                  (room_id, bed_id))
+    other.commit()
+    other.close()
+
+
+def test_other_process_writes_are_caught_up_from_the_log(index, conn):
+    external_select(beds_of(conn, '102')[0])
+    assert index.available_rooms()[1] == sql_rooms(conn)
+    assert index.loads == 0
+
+
+def test_pruned_log_forces_a_full_reload(index, conn):
+    external_select(beds_of(conn, '102')[0], bump=2, prune=True)
+    assert index.available_rooms()[1] == sql_rooms(conn)
+    assert index.loads == 1
+
+
+def test_full_room_leaves_the_listing(app, index, conn):
+    user_ids = seed_users(conn, 4)
+    with app.app_context():
+        for user_id, bed_id in zip(user_ids, beds_of(conn, '201')):
+            db.select_room(user_id, bed_id)
+    rooms = index.available_rooms()[1]
+    assert '201' not in [room['room_number'] for room in rooms]
+    assert rooms == sql_rooms(conn)
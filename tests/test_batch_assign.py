@@ -0,0 +1,92 @@
+import pytest
+
+from backend import batch_assign
+from backend.batch_assign import FreeBeds, match, room_floor
+from conftest import seed_lottery, seed_room, seed_users
+
+# (bed_id, room_id, building_id, room_number, room_type), in bed order
+BEDS = [
+    (11, 1, 1, '101', '4'), (12, 1, 1, '101', '4'),
+    (21, 2, 1, '201', '4'), (22, 2, 1, '201', '4'),
+    (31, 3, 2, 'A301', '6'), (32, 3, 2, 'A301', '6'), (33, 3, 2, 'A301', '6'),
+]
+
+
+@pytest.mark.parametrize('room_number, floor', [('305', 3), ('A305', 3), ('1204', 12), ('12', None), ('单间', None)])
+def test_room_floor(room_number, floor):
+    assert room_floor(room_number) == floor
+
+
+def test_match_serves_preferences_in_lottery_order():
+    participants = [(1, '4'), (2, '4'), (3, '4')]
+    preferences = {user_id: [(None, 2, None)] for user_id in (1, 2, 3)}
+    assignments = match(participants, preferences, {}, FreeBeds(BEDS))
+    # The third student finds room 201 full and falls back to any four-person room
+    assert assignments == [(1, 2, 21, 1), (2, 2, 22, 1), (3, 1, 11, None)]
+
+
+def test_match_uses_building_and_floor_preferences():
+    participants = [(1, '6'), (2, '4')]
+    preferences = {
+        1: [(1, None, None), (2, None, 3)],  # building 1 has no six-person room
+        2: [(None, None, 2)],
+    }
+    assignments = match(participants, preferences, {}, FreeBeds(BEDS))
+    assert assignments == [(1, 3, 31, 2), (2, 2, 21, 1)]
+
+
+def test_match_seats_a_group_together_at_its_first_turn():
+    participants = [(1, '4'), (5, '4'), (2, '4')]
+    groups = {1: [1, 2], 2: [1, 2]}
+    preferences = {1: [(None, 2, None)], 5: [(None, 2, None)]}
+    assignments = match(participants, preferences, groups, FreeBeds(BEDS))
+    assert assignments == [(1, 2, 21, 1), (2, 2, 22, 1), (5, 1, 11, None)]
+
+
+def test_match_places_members_one_by_one_when_the_group_does_not_fit():
+    # Three members, but the four-person rooms only have two free beds each:
+    # the first is seated alone, the two still waiting then fit one room
+    participants = [(1, '4'), (2, '4'), (3, '4')]
+    groups = {user_id: [1, 2, 3] for user_id in (1, 2, 3)}
+    assignments = match(participants, {}, groups, FreeBeds(BEDS))
+    assert [a[:3] for a in assignments] == [(1, 1, 11), (2, 2, 21), (3, 2, 22)]
+
+
+def test_match_splits_groups_with_different_room_types():
+    participants = [(1, '4'), (2, '6')]
+    groups = {1: [1, 2], 2: [1, 2]}
+    assignments = match(participants, {}, groups, FreeBeds(BEDS))
+    assert [a[:2] for a in assignments] == [(1, 1), (2, 3)]
+
+
+def test_match_leaves_students_without_a_bed_unassigned():
+    participants = [(user_id, '6') for user_id in range(1, 6)]
+    assignments = match(participants, {}, {}, FreeBeds(BEDS))
+    assert [a[0] for a in assignments] == [1, 2, 3]
+
+
+def test_assign_beds_writes_in_lottery_order(app, conn):
+    room_id = seed_room(conn, capacity=4)
+    user_ids = seed_users(conn, 5)
+    lottery_id = seed_lottery(conn)
+    # Lottery order is the reverse of the id order
+    conn.executemany(
+        "INSERT INTO lottery_results (user_id, lottery_id, lottery_number, room_type) VALUES (?, ?, ?, '4')",
+        [(user_id, lottery_id, 5 - i) for i, user_id in enumerate(user_ids)]
+    )
+    conn.commit()
+
+    with app.app_context():
+        preview = batch_assign.assign_beds(lottery_id, dry_run=True)
+        assert preview['assigned'] == 4
+        assert conn.execute('SELECT COUNT(*) FROM room_selections').fetchone()[0] == 0
+        summary = batch_assign.assign_beds(lottery_id, operated_by=user_ids[0])
+
+    assert summary['participants'] == 5
+    assert summary['assigned'] == 4
+    assert summary['unassigned_user_ids'] == [user_ids[0]]
+    selected = [row[0] for row in conn.execute('SELECT user_id FROM room_selections ORDER BY bed_id')]
+    assert selected == user_ids[:0:-1]
+    assert conn.execute('SELECT current_occupancy FROM rooms WHERE id = ?', (room_id,)).fetchone()[0] == 4
+    assert conn.execute('SELECT COUNT(*) FROM beds WHERE is_occupied = 1').fetchone()[0] == 4
+    assert conn.execute("SELECT COUNT(*) FROM allocation_history WHERE action = 'assigned'").fetchone()[0] == 4
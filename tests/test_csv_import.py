@@ -0,0 +1,228 @@
+import io
+
+import pandas as pd
+import pytest
+from flask_jwt_extended import create_access_token
+
+from backend import csv_import
+from backend import database as db
+from backend.csv_import import (
+    ImportFormatError, validate_room_type_allocations, validate_rooms, validate_users
+)
+from config import Config
+from conftest import seed_room
+
+HASH = '$2b$04$' + 'a' * 53
+
+
+@pytest.fixture
+def admin_client(app, conn):
+    """Test client and headers of the default admin."""
+    admin_id = conn.execute("SELECT id FROM users WHERE username = 'admin'").fetchone()[0]
+    with app.app_context():
+        headers = {'Authorization': f'Bearer {create_access_token(identity=admin_id)}'}
+    return app.test_client(), headers
+
+
+def upload(client, headers, url, text, encoding='utf-8', **form):
+    data = dict(form, file=(io.BytesIO(text.encode(encoding)), 'upload.csv'))
+    return client.post(url, data=data, headers=headers, content_type='multipart/form-data')
+
+
+def test_import_users_in_chunks(app, conn, admin_client, monkeypatch):
+    monkeypatch.setattr(Config, 'IMPORT_CHUNK_SIZE', 2)
+    client, headers = admin_client
+    response = upload(client, headers, '/api/admin/users/import', '\n'.join([
+        'username,name,password,priority_weight',
+        'alice,张三,secret1,',
+        'bob,李四,secret2,2',
+        'admin,王五,secret3,',
+        'alice,赵六,secret4,',  # repeats a username of the previous chunk
+        'carol,孙七,secret5,0.5',
+    ]))
+    assert response.status_code == 200
+    report = response.get_json()
+    assert (report['success_count'], report['error_count']) == (3, 2)
+    assert report['errors'] == ['第4行: 用户名 admin 已存在', '第5行: 用户名 alice 已存在']
+
+    with app.app_context():
+        alice = db.get_user_by_username('alice')
+        assert alice['name'] == '张三'
+        assert db.check_password(alice, 'secret1')
+    weights = dict(conn.execute("SELECT username, priority_weight FROM users WHERE username != 'admin'").fetchall())
+    assert weights == {'alice': 1.0, 'bob': 2.0, 'carol': 0.5}
+
+
+def test_import_users_reads_gbk_files(app, conn, admin_client):
+    client, headers = admin_client
+    response = upload(client, headers, '/api/admin/users/import',
+                      'username,name,password\ndave,王五,secret\n', encoding='gbk')
+    assert response.get_json()['success_count'] == 1
+    assert conn.execute("SELECT name FROM users WHERE username = 'dave'").fetchone()[0] == '王五'
+
+
+def test_import_users_requires_columns(admin_client):
+    client, headers = admin_client
+    response = upload(client, headers, '/api/admin/users/import', 'username,name\nalice,张三\n')
+    assert response.status_code == 400
+
+
+def test_import_users_redoes_a_chunk_that_hits_a_new_username(app, conn, monkeypatch):
+    # A username created after the existing ones were loaded fails only its own row
+    conn.execute("INSERT INTO users (username, password_hash, name) VALUES ('bob', 'x', '李四')")
+    conn.commit()
+    monkeypatch.setattr(csv_import, 'load_usernames', set)
+    file = type('Upload', (), {'stream': io.BytesIO('username,name,password\nalice,张三,a1b2c3\nbob,李四,a1b2c3\n'.encode())})
+    with app.app_context():
+        report = csv_import.import_users(file)
+    assert (report.success_count, report.error_count) == (1, 1)
+    assert report.errors == ['第3行: 用户名 bob 已存在']
+    assert conn.execute("SELECT COUNT(*) FROM users WHERE username = 'alice'").fetchone()[0] == 1
+
+
+def frame(rows, columns):
+    return pd.DataFrame(rows, columns=columns, dtype=str).fillna('')
+
+
+def test_validate_users_reports_first_error_per_row():
+    errors, rows = validate_users(frame([
+        ['alice', '张三', 'secret', '', ''],
+        ['', '李四', 'secret', '', ''],
+        ['bob', '王五', '', 'not-a-hash', ''],
+        ['ab', '赵六', 'secret', '', ''],
+        ['carol', '孙七', 'secret', '', '-1'],
+        ['taken', '周八', 'secret', '', ''],
+        ['alice', '吴九', 'secret', '', ''],
+        ['dave', '郑十', '', HASH, '2.5'],
+    ], ['username', 'name', 'password', 'password_hash', 'priority_weight']), {'taken'})
+    assert errors.to_dict() == {
+        1: '用户名、姓名和密码不能为空',
+        2: '密码哈希不是有效的bcrypt格式',
+        3: '用户名 ab 长度至少3个字符',
+        4: '优先权重必须是大于0的数字',
+        5: '用户名 taken 已存在',
+        6: '用户名 alice 在文件中重复',
+    }
+    assert rows['username'].tolist() == ['alice', 'dave']
+    assert rows['priority_weight'].tolist() == [1.0, 2.5]
+
+
+def test_validate_users_requires_columns():
+    with pytest.raises(ImportFormatError):
+        validate_users(frame([['alice', '张三']], ['username', 'name']), set())
+
+
+def test_validate_rooms():
+    errors, rows = validate_rooms(frame([
+        ['1号楼', '101', '4', '4'],
+        ['1号楼', '102', '4', '0'],
+        ['9号楼', '101', '4', '4'],
+        ['1号楼', '103', '4', '4'],
+        ['1号楼', '101', '4', '4'],
+        ['2号楼', '101', '6', '6'],
+        ['1号楼', '', '4', '4'],
+    ], ['building_name', 'room_number', 'room_type', 'max_capacity']), {'1号楼': 1, '2号楼': 2}, {'1/103'})
+    assert errors.to_dict() == {
+        1: '最大容量必须是正整数',
+        2: '楼栋 9号楼 不存在',
+        3: '房间 1号楼-103 已存在',
+        4: '房间 1号楼-101 在文件中重复',
+        6: '楼栋、房间号和房间类型不能为空',
+    }
+    assert rows.to_dict('records') == [
+        {'building_id': 1, 'room_number': '101', 'room_type': '4', 'max_capacity': 4},
+        {'building_id': 2, 'room_number': '101', 'room_type': '6', 'max_capacity': 6},
+    ]
+
+
+def test_validate_room_type_allocations():
+    users = pd.DataFrame({'id': [1, 2, 3, 4], 'is_admin': [1, 0, 0, 0]}, index=['admin', 'alice', 'bob', 'carol'])
+    errors, rows = validate_room_type_allocations(frame([
+        ['alice', '4', '靠窗'],
+        ['carol', '6', ''],
+        ['nobody', '8', ''],
+        ['admin', '4', ''],
+        ['alice', '8', ''],
+        ['bob', '8', ''],
+    ], ['username', 'room_type', 'notes']), users)
+    assert errors.to_dict() == {
+        1: '房间类型必须是4或8',
+        2: '用户名 nobody 不存在',
+        3: '不能为管理员用户 admin 分配房间类型',
+        4: '用户名 alice 在文件中重复',
+    }
+    assert rows.to_dict('records') == [
+        {'user_id': 2, 'room_type': '4', 'notes': '靠窗'},
+        {'user_id': 3, 'room_type': '8', 'notes': None},
+    ]
+
+
+def test_dry_run_reports_every_error_and_writes_nothing(app, conn, admin_client):
+    client, headers = admin_client
+    lines = ['username,name,password'] + [f'u{i},学生{i},' for i in range(12)] + ['ok1,学生,secret']
+    response = upload(client, headers, '/api/admin/users/import', '\n'.join(lines), dry_run='1')
+    assert response.status_code == 200
+    report = response.get_json()
+    assert report['dry_run'] is True
+    assert (report['total_count'], report['valid_count'], report['error_count']) == (13, 1, 12)
+    # Unlike a real import, every row error is listed
+    assert len(report['errors']) == 12
+    assert report['errors'][0] == '第2行: 用户名、姓名和密码不能为空'
+    assert conn.execute("SELECT COUNT(*) FROM users WHERE username != 'admin'").fetchone()[0] == 0
+
+
+def test_import_users_keeps_the_first_errors_only(app, conn, admin_client):
+    client, headers = admin_client
+    lines = ['username,name,password'] + [f'u{i},学生{i},' for i in range(12)]
+    report = upload(client, headers, '/api/admin/users/import', '\n'.join(lines)).get_json()
+    assert report['error_count'] == 12
+    assert len(report['errors']) == csv_import.MAX_REPORTED_ERRORS
+
+
+def test_import_users_stores_bcrypt_hashes_as_is(app, conn, admin_client):
+    client, headers = admin_client
+    response = upload(client, headers, '/api/admin/users/import', f'username,name,password,password_hash\nerin,学生,,{HASH}\n')
+    assert response.get_json()['success_count'] == 1
+    assert conn.execute("SELECT password_hash FROM users WHERE username = 'erin'").fetchone()[0] == HASH
+
+
+def test_import_rooms_creates_rooms_and_beds(app, conn, admin_client):
+    conn.executemany('INSERT INTO buildings (name) VALUES (?)', [('1号楼',), ('2号楼',)])
+    conn.commit()
+    existing = seed_room(conn, room_number='103', building_id=1)
+    client, headers = admin_client
+    response = upload(client, headers, '/api/admin/rooms/import', '\n'.join([
+        'building_name,room_number,room_type,max_capacity',
+        '1号楼,101,4,4',
+        '1号楼,103,4,4',
+        '9号楼,101,4,4',
+        '2号楼,101,6,6',
+        '1号楼,102,4,0',
+    ]))
+    assert response.status_code == 200
+    report = response.get_json()
+    assert (report['success_count'], report['error_count']) == (2, 3)
+    assert report['errors'] == ['第3行: 房间 1号楼-103 已存在', '第4行: 楼栋 9号楼 不存在', '第6行: 最大容量必须是正整数']
+    rooms = conn.execute('''
+        SELECT b.name, r.room_number, r.room_type, COUNT(bd.id) FROM rooms r
+        JOIN buildings b ON r.building_id = b.id
+        JOIN beds bd ON bd.room_id = r.id
+        WHERE r.id != ?
+        GROUP BY r.id ORDER BY r.id
+    ''', (existing,)).fetchall()
+    assert [tuple(room) for room in rooms] == [('1号楼', '101', '4', 4), ('2号楼', '101', '6', 6)]
+
+
+def test_import_rooms_reports_rooms_created_meanwhile(app, conn, monkeypatch):
+    building_id = conn.execute("INSERT INTO buildings (name) VALUES ('1号楼')").lastrowid
+    conn.commit()
+    seed_room(conn, room_number='102', building_id=building_id)
+    # Loaded before 102 was created by someone else
+    monkeypatch.setattr(csv_import, 'load_room_keys', set)
+    text = 'building_name,room_number,room_type,max_capacity\n1号楼,101,4,4\n1号楼,102,4,4\n'
+    file = type('Upload', (), {'stream': io.BytesIO(text.encode())})
+    with app.app_context():
+        report = csv_import.import_rooms(file)
+    assert (report.success_count, report.error_count) == (1, 1)
+    assert report.errors == ['第3行: 房间 1号楼-102 已存在']
+    assert conn.execute('SELECT COUNT(*) FROM beds').fetchone()[0] == 8
@@ -0,0 +1,117 @@
+import threading
+import time
+
+from backend import locks
+from backend.locks import MemoryLock, QueuedLock, SQLiteLeaseLock
+
+
+def lease_rows(conn):
+    return conn.execute('SELECT COUNT(*) FROM lock_leases').fetchone()[0]
+
+
+def test_lease_excludes_other_processes(app):
+    # Two instances stand in for two worker processes sharing the file
+    a, b = SQLiteLeaseLock(), SQLiteLeaseLock()
+    assert a.acquire('bed_selection:1')
+    assert not b.acquire('bed_selection:1')
+    assert b.acquire('bed_selection:2')
+    a.release('bed_selection:1')
+    assert b.acquire('bed_selection:1')
+
+
+def test_release_only_frees_own_lease(app):
+    a, b = SQLiteLeaseLock(), SQLiteLeaseLock()
+    assert a.acquire('bed_selection:1')
+    b.release('bed_selection:1')
+    assert not b.acquire('bed_selection:1')
+
+
+def test_expired_lease_can_be_taken_over(app):
+    a, b = SQLiteLeaseLock(), SQLiteLeaseLock()
+    assert a.acquire('bed_selection:1', timeout=0.05)
+    time.sleep(0.1)
+    assert b.acquire('bed_selection:1')
+    # The old owner's late release leaves the new lease alone
+    a.release('bed_selection:1')
+    assert not a.acquire('bed_selection:1')
+
+
+def test_acquire_prunes_expired_leases(app, conn):
+    lock = SQLiteLeaseLock(cleanup_interval=0)
+    for bed_id in range(10):
+        assert lock.acquire(f'bed_selection:{bed_id}', timeout=0.01)
+    time.sleep(0.05)
+    lock.acquire('bed_selection:100')
+    assert lease_rows(conn) == 1
+
+
+def unwrap(lock):
+    while isinstance(lock, (locks.MeteredLock, locks.QueuedLock)):
+        lock = lock.lock if isinstance(lock, locks.MeteredLock) else lock.backend
+    return lock
+
+
+def test_memory_backend_is_replaced_with_several_workers(app, monkeypatch):
+    app.config['LOCK_BACKEND'] = 'memory'
+    monkeypatch.setenv('WEB_CONCURRENCY', '1')
+    locks.init_app(app)
+    assert isinstance(unwrap(locks.get_bed_lock()), locks.MemoryLock)
+    monkeypatch.setenv('WEB_CONCURRENCY', '4')
+    locks.init_app(app)
+    assert isinstance(unwrap(locks.get_bed_lock()), SQLiteLeaseLock)
+
+
+def hold_then_release(lock, key, seconds):
+    def release():
+        time.sleep(seconds)
+        lock.release(key)
+    thread = threading.Thread(target=release)
+    thread.start()
+    return thread
+
+
+def test_queued_lock_waits_for_release():
+    lock = QueuedLock(MemoryLock(), max_wait=2.0)
+    assert lock.acquire('bed_selection:1')
+    releaser = hold_then_release(lock, 'bed_selection:1', 0.1)
+    started = time.monotonic()
+    assert lock.acquire('bed_selection:1')
+    assert time.monotonic() - started >= 0.05
+    releaser.join()
+    assert lock.metrics()['acquired'] == 2
+
+
+def test_queued_lock_times_out_and_rejects_past_max_depth():
+    lock = QueuedLock(MemoryLock(), max_wait=0.2, max_depth=1)
+    assert lock.acquire('bed_selection:1')
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(lock.acquire('bed_selection:1')))
+    waiter.start()
+    time.sleep(0.05)
+    # The queue for this key is full: fail at once instead of waiting
+    assert not lock.acquire('bed_selection:1')
+    waiter.join()
+    assert results == [False]
+    stats = lock.metrics()
+    assert (stats['rejected'], stats['timed_out'], stats['waiting_requests']) == (1, 1, 0)
+
+
+def test_queued_lock_serves_waiters_in_arrival_order():
+    lock = QueuedLock(MemoryLock(), max_wait=3.0)
+    assert lock.acquire('bed_selection:1')
+    order = []
+
+    def wait(name):
+        assert lock.acquire('bed_selection:1')
+        order.append(name)
+        lock.release('bed_selection:1')
+
+    waiters = []
+    for name in range(5):
+        waiters.append(threading.Thread(target=wait, args=(name,)))
+        waiters[-1].start()
+        time.sleep(0.02)
+    lock.release('bed_selection:1')
+    for waiter in waiters:
+        waiter.join()
+    assert order == list(range(5))
@@ -0,0 +1,159 @@
+import numpy as np
+import pytest
+
+from backend import lottery_engine
+from backend.lottery_engine import FeistelPermutation, assign, pack
+from conftest import seed_lottery, seed_users
+
+SEGMENTS = [('4', 8, 4, '4-'), ('6', 12, 6, '6-')]
+
+
+def test_assign_fills_segments_in_order():
+    room_types, group_numbers, sizes = assign(11, SEGMENTS)
+    assert sizes == [8, 3]
+    assert room_types == ['4'] * 8 + ['6'] * 3
+    assert group_numbers == ['4-1'] * 4 + ['4-2'] * 4 + ['6-1'] * 3
+
+
+def test_assign_without_groups_or_prefix():
+    room_types, group_numbers, sizes = assign(5, [(None, 3, None, None), ('8', 10, 2, None)])
+    assert sizes == [3, 2]
+    assert group_numbers == [None, None, None, 1, 1]
+
+
+def test_assign_matches_position_result():
+    room_types, group_numbers, sizes = assign(20, SEGMENTS)
+    for position in range(20):
+        assert lottery_engine.position_result(position, SEGMENTS) == (room_types[position], group_numbers[position])
+    assert lottery_engine.position_result(20, SEGMENTS) is None
+
+
+def test_draw_writes_one_row_per_allocated_participant(conn):
+    user_ids = seed_users(conn, 25)
+    lottery_id = seed_lottery(conn)
+    sizes = lottery_engine.draw(conn, lottery_id, np.array(user_ids), SEGMENTS, rng=np.random.default_rng(7))
+    conn.commit()
+    assert sizes == [8, 12]
+    rows = conn.execute(
+        'SELECT user_id, lottery_number, group_number, room_type FROM lottery_results WHERE lottery_id = ? ORDER BY lottery_number',
+        (lottery_id,)
+    ).fetchall()
+    assert [row['lottery_number'] for row in rows] == list(range(1, 21))
+    assert len({row['user_id'] for row in rows}) == 20
+    assert set(row['user_id'] for row in rows) <= set(user_ids)
+    room_types, group_numbers, _ = assign(20, SEGMENTS)
+    assert [(row['room_type'], row['group_number']) for row in rows] == list(zip(room_types, group_numbers))
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 5, 16, 17, 1000, 4099])
+def test_feistel_is_a_bijection(n):
+    permutation = FeistelPermutation(n, seed=12345)
+    positions = permutation.forward(np.arange(n))
+    assert sorted(positions.tolist()) == list(range(n))
+    assert permutation.inverse(positions).tolist() == list(range(n))
+
+
+def test_feistel_scalar_and_array_agree():
+    permutation = FeistelPermutation(777, seed=2**63 + 5)
+    positions = permutation.forward(np.arange(777)).tolist()
+    assert [permutation.forward(i) for i in range(777)] == positions
+    assert [permutation.inverse(p) for p in positions] == list(range(777))
+
+
+def test_feistel_depends_on_seed():
+    a = FeistelPermutation(500, seed=1).forward(np.arange(500))
+    b = FeistelPermutation(500, seed=2).forward(np.arange(500))
+    assert a.tolist() != b.tolist()
+
+
+def test_compact_results_match_materialized_rows(conn):
+    user_ids = seed_users(conn, 25)
+    lottery_id = seed_lottery(conn)
+    sizes = lottery_engine.draw_compact(conn, lottery_id, user_ids, SEGMENTS, seed=99)
+    conn.commit()
+    assert sizes == [8, 12]
+    assert conn.execute('SELECT COUNT(*) FROM lottery_results WHERE lottery_id = ?', (lottery_id,)).fetchone()[0] == 0
+    computed = {}
+    for user_id in user_ids:
+        results = lottery_engine.compact_results_for_user(conn, user_id, lottery_id)
+        if results:
+            (result,) = results
+            computed[user_id] = (result['lottery_number'], result['room_type'], result['group_number'])
+    assert len(computed) == 20
+    assert sorted(number for number, _, _ in computed.values()) == list(range(1, 21))
+
+    assert lottery_engine.materialize(conn, lottery_id)
+    conn.commit()
+    rows = conn.execute(
+        'SELECT user_id, lottery_number, room_type, group_number FROM lottery_results WHERE lottery_id = ?',
+        (lottery_id,)
+    ).fetchall()
+    assert {row['user_id']: (row['lottery_number'], row['room_type'], row['group_number']) for row in rows} == computed
+
+
+def test_compact_results_hidden_until_published(conn):
+    user_ids = seed_users(conn, 3)
+    lottery_id = seed_lottery(conn, published=False)
+    lottery_engine.draw_compact(conn, lottery_id, user_ids, SEGMENTS, seed=1)
+    conn.commit()
+    assert lottery_engine.compact_results_for_user(conn, user_ids[0]) == []
+    assert len(lottery_engine.compact_results_for_user(conn, user_ids[0], published_only=False)) == 1
+
+
+def test_weighted_shuffle_is_a_seeded_permutation():
+    user_ids = np.arange(100, 150)
+    weights = np.linspace(0.5, 5, 50)
+    order = lottery_engine.weighted_shuffle(user_ids, weights, np.random.default_rng(3))
+    assert sorted(order.tolist()) == user_ids.tolist()
+    again = lottery_engine.weighted_shuffle(user_ids, weights, np.random.default_rng(3))
+    assert order.tolist() == again.tolist()
+
+
+def test_weighted_shuffle_favours_heavier_weights():
+    # Weight 3 against weight 1: first three times out of four
+    rng = np.random.default_rng(11)
+    trials = 4000
+    first = sum(lottery_engine.weighted_shuffle([1, 2], [3, 1], rng)[0] == 1 for _ in range(trials))
+    assert abs(first / trials - 0.75) < 0.03
+
+
+def test_load_participants_with_weights(conn):
+    user_ids = seed_users(conn, 3)
+    conn.execute('UPDATE users SET priority_weight = 2.5 WHERE id = ?', (user_ids[1],))
+    conn.commit()
+    ids, weights = lottery_engine.load_participants(conn, with_weights=True)
+    weight_of = dict(zip(ids.tolist(), weights.tolist()))
+    assert [weight_of[user_id] for user_id in user_ids] == [1.0, 2.5, 1.0]
+
+
+def test_pack_without_groups_is_assign():
+    units = [[user_id] for user_id in range(100, 111)]
+    order, room_types, group_numbers, sizes, used, split = pack(units, SEGMENTS)
+    assert order.tolist() == list(range(100, 111))
+    assert (room_types, group_numbers, sizes) == assign(11, SEGMENTS)
+    assert used == [2, 1]
+    assert split == 0
+
+
+def test_pack_seats_roommate_groups_together():
+    # A group of three drawn second still shares one four-person group
+    units = [[1], [2, 3, 4], [5], [6, 7], [8], [9, 10, 11, 12, 13]]
+    order, room_types, group_numbers, sizes, used, split = pack(units, SEGMENTS)
+    group_of = dict(zip(order.tolist(), group_numbers))
+    assert split == 0
+    assert sorted(order.tolist()) == list(range(1, 14))
+    for unit in units:
+        assert len({group_of[user_id] for user_id in unit}) == 1
+    # The five-member group only fits a six-person group
+    assert group_of[9].startswith('6-')
+    assert sizes == [8, 5]
+    assert used == [2, 1]
+
+
+def test_pack_splits_a_group_that_fits_nowhere():
+    units = [[1, 2, 3, 4, 5]]
+    order, room_types, group_numbers, sizes, used, split = pack(units, [('4', 8, 4, '4-')])
+    assert split == 1
+    assert order.tolist() == [1, 2, 3, 4, 5]
+    assert group_numbers == ['4-1'] * 4 + ['4-2']
+    assert used == [2]
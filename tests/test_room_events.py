@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from backend.room_events import get_room_events
+from conftest import seed_room, seed_users
+
+
+@pytest.fixture
+def student(app, conn):
+    """(user_id, Authorization header) of a student, with one four-bed room seeded."""
+    seed_room(conn, capacity=4)
+    user_id = seed_users(conn, 1)[0]
+    with app.app_context():
+        token = create_access_token(identity=user_id)
+    return user_id, {'Authorization': f'Bearer {token}'}
+
+
+def open_stream(client, headers):
+    token = client.post('/api/lottery/rooms/stream-token', headers=headers).get_json()['token']
+    return client.get(f'/api/lottery/rooms/stream?jwt={token}', buffered=False)
+
+
+def test_stream_only_takes_stream_tokens(app, student):
+    user_id, headers = student
+    client = app.test_client()
+    access_token = headers['Authorization'].split()[1]
+    assert client.get(f'/api/lottery/rooms/stream?jwt={access_token}').status_code != 200
+    token = client.post('/api/lottery/rooms/stream-token', headers=headers).get_json()['token']
+    stream_headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/lottery/rooms/available', headers=stream_headers).status_code != 200
+
+
+def test_streams_are_capped_and_selection_keeps_working(app, conn, student):
+    user_id, headers = student
+    app.config['ROOM_STREAM_KEEPALIVE'] = 0.2
+    get_room_events().max_subscribers = 2
+    client = app.test_client()
+    streams = [open_stream(client, headers) for _ in range(2)]
+    try:
+        assert [stream.status_code for stream in streams] == [200, 200]
+        refused = open_stream(client, headers)
+        assert refused.status_code == 503
+        assert refused.headers['Retry-After']
+
+        # Selecting is not held up by the open streams, and they see the change
+        received = []
+        reader = threading.Thread(target=lambda: received.extend(
+            chunk for chunk, _ in zip(streams[0].response, range(4))
+        ))
+        reader.start()
+        bed_id = conn.execute('SELECT id FROM beds ORDER BY id').fetchone()[0]
+        response = client.post('/api/room-selection/select', json={'bed_id': bed_id}, headers=headers)
+        assert response.status_code == 201
+        reader.join(5)
+        assert any(b'event: bed' in chunk for chunk in received)
+    finally:
+        for stream in streams:
+            stream.close()
+    # A closed stream frees its slot
+    reopened = open_stream(client, headers)
+    assert reopened.status_code == 200
+    reopened.close()
+    assert len(get_room_events().subscribers) == 0
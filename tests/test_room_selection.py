@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from backend import database as db
+from backend.locks import get_bed_lock
+from backend.selection_windows import get_selection_windows
+from conftest import seed_lottery, seed_room, seed_users
+
+
+@pytest.fixture
+def group(conn):
+    """Three students in one roommate group; returns (group_id, user_ids)."""
+    user_ids = seed_users(conn, 3)
+    c = conn.cursor()
+    c.execute('INSERT INTO roommate_groups (name, created_by) VALUES (?, ?)', ('一组', user_ids[0]))
+    group_id = c.lastrowid
+    c.executemany('INSERT INTO roommate_group_members (group_id, user_id) VALUES (?, ?)',
+                  [(group_id, user_id) for user_id in user_ids])
+    conn.commit()
+    return group_id, user_ids
+
+
+def free_beds(conn, room_id, count=4):
+    return [row[0] for row in conn.execute(
+        'SELECT id FROM beds WHERE room_id = ? AND is_occupied = 0 ORDER BY bed_number LIMIT ?', (room_id, count)
+    )]
+
+
+def token_headers(app, user_id):
+    with app.app_context():
+        return {'Authorization': f'Bearer {create_access_token(identity=user_id)}'}
+
+
+def room_state(conn, room_id):
+    occupancy = conn.execute('SELECT current_occupancy FROM rooms WHERE id = ?', (room_id,)).fetchone()[0]
+    beds = conn.execute(
+        'SELECT user_id, bed_id FROM room_selections WHERE room_id = ? ORDER BY user_id', (room_id,)
+    ).fetchall()
+    return occupancy, [tuple(bed) for bed in beds]
+
+
+def test_select_group_room_is_idempotent(app, conn, group):
+    group_id, user_ids = group
+    room_id = seed_room(conn, capacity=4)
+    with app.app_context():
+        first = db.select_group_room(group_id, room_id, free_beds(conn, room_id, 3))
+        state = room_state(conn, room_id)
+        second = db.select_group_room(group_id, room_id, [])
+    assert state[0] == 3
+    assert sorted(s['user_id'] for s in first) == user_ids
+    assert sorted((s['user_id'], s['bed_id']) for s in second) == state[1]
+    assert room_state(conn, room_id) == state
+
+
+def test_select_group_room_keeps_members_already_in_the_room(app, conn, group):
+    group_id, user_ids = group
+    room_id = seed_room(conn, capacity=4)
+    with app.app_context():
+        bed_id = conn.execute('SELECT id FROM beds WHERE room_id = ? AND bed_number = ?', (room_id, '4')).fetchone()[0]
+        db.select_room(user_ids[1], bed_id)
+        db.select_group_room(group_id, room_id, free_beds(conn, room_id, 2))
+    occupancy, beds = room_state(conn, room_id)
+    assert occupancy == 3
+    assert dict(beds)[user_ids[1]] == bed_id
+
+
+def test_select_group_room_rolls_back_when_beds_run_out(app, conn, group):
+    group_id, user_ids = group
+    room_id = seed_room(conn, capacity=4)
+    other = seed_users(conn, 2, prefix='other')
+    with app.app_context():
+        free = [row[0] for row in conn.execute('SELECT id FROM beds WHERE room_id = ?', (room_id,))]
+        db.select_room(other[0], free[0])
+        db.select_room(other[1], free[1])
+        with pytest.raises(db.SelectionError) as error:
+            db.select_group_room(group_id, room_id, free_beds(conn, room_id))
+    assert error.value.status_code == 409
+    assert room_state(conn, room_id)[0] == 2
+    assert conn.execute('SELECT COUNT(*) FROM room_selections WHERE user_id IN (?, ?, ?)', user_ids).fetchone()[0] == 0
+
+
+def test_select_group_route_accepts_string_room_id_and_repeats(app, conn, group):
+    group_id, user_ids = group
+    room_id = seed_room(conn, capacity=4)
+    client = app.test_client()
+    headers = token_headers(app, user_ids[0])
+    first = client.post('/api/room-selection/select-group', json={'room_id': str(room_id)}, headers=headers)
+    second = client.post('/api/room-selection/select-group', json={'room_id': room_id}, headers=headers)
+    assert first.status_code == 201
+    assert second.status_code == 201
+    by_user = lambda response: sorted(response.get_json()['selections'], key=lambda s: s['user_id'])
+    assert by_user(first) == by_user(second)
+    assert room_state(conn, room_id)[0] == 3
+
+    bad = client.post('/api/room-selection/select-group', json={'room_id': 'abc'}, headers=headers)
+    assert bad.status_code == 400
+
+
+def test_select_group_room_refuses_confirmed_members(app, conn, group):
+    group_id, user_ids = group
+    room_id = seed_room(conn, capacity=4)
+    elsewhere = seed_room(conn, room_number='102', capacity=4)
+    with app.app_context():
+        db.select_room(user_ids[2], free_beds(conn, elsewhere, 1)[0])
+        db.confirm_room_selection(user_ids[2])
+        with pytest.raises(db.SelectionError) as error:
+            db.select_group_room(group_id, room_id, free_beds(conn, room_id, 3))
+    assert error.value.status_code == 409
+    assert '已确认' in str(error.value)
+    assert room_state(conn, room_id)[0] == 0
+    assert room_state(conn, elsewhere)[0] == 1
+
+
+def test_select_group_room_refuses_a_mismatched_room_type(app, conn, group):
+    group_id, user_ids = group
+    room_id = seed_room(conn, capacity=4)
+    conn.execute("INSERT INTO room_type_allocations (user_id, room_type) VALUES (?, '4')", (user_ids[0],))
+    conn.execute("INSERT INTO room_type_allocations (user_id, room_type) VALUES (?, '8')", (user_ids[1],))
+    conn.commit()
+    with app.app_context():
+        with pytest.raises(db.SelectionError) as error:
+            db.select_group_room(group_id, room_id, free_beds(conn, room_id, 3))
+    assert error.value.status_code == 400
+    assert '房型' in str(error.value)
+    assert room_state(conn, room_id)[0] == 0
+
+
+def test_select_group_room_refuses_beds_of_another_room(app, conn, group):
+    group_id, user_ids = group
+    room_id = seed_room(conn, capacity=4)
+    other = seed_room(conn, room_number='102', capacity=4)
+    with app.app_context():
+        with pytest.raises(db.SelectionError) as error:
+            db.select_group_room(group_id, room_id, free_beds(conn, other, 3))
+    assert error.value.status_code == 400
+    assert room_state(conn, other)[0] == 0
+
+
+def test_select_group_route_checks_every_moving_members_window(app, conn, group):
+    group_id, user_ids = group
+    room_id = seed_room(conn, capacity=4)
+    # The initiator's wave is open, the second member's opens an hour later
+    lottery_id = seed_lottery(conn)
+    conn.execute(
+        'UPDATE lottery_settings SET selection_start = ?, selection_wave_size = 1, selection_wave_interval = 60 WHERE id = ?',
+        ((datetime.now() - timedelta(minutes=1)).isoformat(), lottery_id)
+    )
+    conn.executemany('INSERT INTO lottery_results (user_id, lottery_id, lottery_number) VALUES (?, ?, ?)',
+                     [(user_id, lottery_id, rank) for rank, user_id in enumerate(user_ids, 1)])
+    conn.commit()
+    get_selection_windows().invalidate()
+    client = app.test_client()
+    response = client.post('/api/room-selection/select-group', json={'room_id': room_id},
+                           headers=token_headers(app, user_ids[0]))
+    assert response.status_code == 403
+    assert room_state(conn, room_id)[0] == 0
+
+
+def test_select_group_route_takes_the_bed_locks(app, conn, group):
+    group_id, user_ids = group
+    room_id = seed_room(conn, capacity=4)
+    elsewhere = seed_room(conn, room_number='102', capacity=4)
+    old_bed = free_beds(conn, elsewhere, 1)[0]
+    with app.app_context():
+        db.select_room(user_ids[1], old_bed)
+    client = app.test_client()
+    headers = token_headers(app, user_ids[0])
+    bed_lock = get_bed_lock()
+
+    # A bed being claimed by /select or /change, or one a member moves out of
+    for key in (f'bed_selection:{free_beds(conn, room_id, 1)[0]}', f'bed_selection:{old_bed}'):
+        assert bed_lock.acquire(key)
+        try:
+            response = client.post('/api/room-selection/select-group', json={'room_id': room_id}, headers=headers)
+        finally:
+            bed_lock.release(key)
+        assert response.status_code == 503
+        assert room_state(conn, room_id)[0] == 0
+
+    claimed = free_beds(conn, room_id, 3)
+    response = client.post('/api/room-selection/select-group', json={'room_id': room_id}, headers=headers)
+    assert response.status_code == 201
+    assert sorted(bed for user, bed in room_state(conn, room_id)[1]) == claimed
+    # Every lock was released again
+    for bed_id in claimed + [old_bed]:
+        assert bed_lock.acquire(f'bed_selection:{bed_id}')
+        bed_lock.release(f'bed_selection:{bed_id}')
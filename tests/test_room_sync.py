@@ -0,0 +1,85 @@
+import pytest
+from flask_jwt_extended import create_access_token
+
+from backend import database as db
+from conftest import seed_room, seed_users
+
+
+@pytest.fixture
+def sync(app, conn):
+    """GET /api/lottery/rooms/available as a student, with two small rooms seeded."""
+    seed_room(conn, room_number='101', capacity=2)
+    seed_room(conn, room_number='102', capacity=2)
+    with app.app_context():
+        headers = {'Authorization': f'Bearer {create_access_token(identity=seed_users(conn, 1, prefix="viewer")[0])}'}
+    client = app.test_client()
+
+    def get(query=''):
+        response = client.get(f'/api/lottery/rooms/available{query}', headers=headers)
+        assert response.status_code == 200
+        return response.get_json()
+    return get
+
+
+def room_id(conn, room_number):
+    return conn.execute('SELECT id FROM rooms WHERE room_number = ?', (room_number,)).fetchone()[0]
+
+
+def select(app, conn, user_id, room_number, bed_number):
+    bed_id = conn.execute(
+        'SELECT bd.id FROM beds bd JOIN rooms r ON bd.room_id = r.id WHERE r.room_number = ? AND bd.bed_number = ?',
+        (room_number, str(bed_number))
+    ).fetchone()[0]
+    with app.app_context():
+        db.select_room(user_id, bed_id)
+
+
+def test_since_returns_only_changed_rooms(app, conn, sync):
+    full = sync()
+    assert full['full'] and len(full['rooms']) == 2
+    user_ids = seed_users(conn, 2)
+    select(app, conn, user_ids[0], '101', 1)
+
+    delta = sync(f'?since={full["version"]}')
+    assert not delta['full']
+    assert delta['version'] == full['version'] + 1
+    assert [room['room_number'] for room in delta['rooms']] == ['101']
+    assert delta['rooms'][0]['available_beds'] == 1
+    assert delta['removed_room_ids'] == []
+
+    # Up to date: nothing to send
+    assert sync(f'?since={delta["version"]}')['rooms'] == []
+
+
+def test_full_room_is_reported_as_removed(app, conn, sync):
+    version = sync()['version']
+    user_ids = seed_users(conn, 2)
+    select(app, conn, user_ids[0], '102', 1)
+    select(app, conn, user_ids[1], '102', 2)
+    delta = sync(f'?since={version}')
+    assert delta['rooms'] == []
+    assert delta['removed_room_ids'] == [room_id(conn, '102')]
+
+
+def test_filters_apply_to_deltas(app, conn, sync):
+    version = sync()['version']
+    select(app, conn, seed_users(conn, 1)[0], '101', 1)
+    delta = sync(f'?since={version}&room_type=4')
+    # Room 101 no longer matches the filter, so the client drops it
+    assert delta['rooms'] == []
+    assert delta['removed_room_ids'] == [room_id(conn, '101')]
+
+
+@pytest.mark.parametrize('since', ['future', 'pruned'])
+def test_unbridgeable_versions_fall_back_to_a_full_listing(app, conn, sync, since):
+    version = sync()['version']
+    select(app, conn, seed_users(conn, 1)[0], '101', 1)
+    if since == 'pruned':
+        conn.execute('DELETE FROM inventory_changes')
+        conn.commit()
+        query = f'?since={version}'
+    else:
+        query = f'?since={version + 100}'
+    result = sync(query)
+    assert result['full']
+    assert len(result['rooms']) == 2
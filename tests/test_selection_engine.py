@@ -0,0 +1,89 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from backend import database as db
+from backend.selection_engine import SelectionEngine
+from conftest import seed_room, seed_users
+
+
+@pytest.fixture
+def engine(app):
+    return SelectionEngine(app, max_batch=64, timeout=10)
+
+
+def test_failing_command_rolls_back_only_itself(app, conn, engine):
+    room_id = seed_room(conn, capacity=4)
+    user_ids = seed_users(conn, 3)
+    beds = [row[0] for row in conn.execute('SELECT id FROM beds WHERE room_id = ? ORDER BY id', (room_id,))]
+
+    def half_written(user_id, bed_id):
+        # Writes a selection, then fails: its savepoint must undo the write
+        db.select_room(user_id, bed_id)
+        raise RuntimeError('boom')
+
+    batch = [
+        (Future(), db.select_room, (user_ids[0], beds[0]), {}),
+        (Future(), half_written, (user_ids[1], beds[1]), {}),
+        (Future(), db.select_room, (user_ids[2], beds[2]), {}),
+    ]
+    with app.app_context():
+        engine._apply(batch)
+
+    first, failed, third = (future for future, fn, args, kwargs in batch)
+    assert first.result()['bed_id'] == beds[0]
+    assert third.result()['bed_id'] == beds[2]
+    with pytest.raises(RuntimeError):
+        failed.result()
+    selected = [row[0] for row in conn.execute('SELECT user_id FROM room_selections ORDER BY user_id')]
+    assert selected == [user_ids[0], user_ids[2]]
+    assert conn.execute('SELECT is_occupied FROM beds WHERE id = ?', (beds[1],)).fetchone()[0] == 0
+    assert conn.execute('SELECT current_occupancy FROM rooms WHERE id = ?', (room_id,)).fetchone()[0] == 2
+    assert engine.metrics()['commands'] == 3
+
+
+def test_run_returns_committed_result_and_raises_selection_errors(app, conn, engine):
+    room_id = seed_room(conn, capacity=4)
+    user_ids = seed_users(conn, 2)
+    bed_id = conn.execute('SELECT id FROM beds WHERE room_id = ? ORDER BY id', (room_id,)).fetchone()[0]
+    selection = engine.run(db.select_room, user_ids[0], bed_id)
+    assert selection['user_id'] == user_ids[0]
+    with pytest.raises(db.SelectionError):
+        engine.run(db.select_room, user_ids[1], bed_id)
+    # The writer thread is still serving commands
+    assert engine.run(db.cancel_room_selection, user_ids[0]) is None
+
+
+def test_run_stops_waiting_on_a_stuck_command(app):
+    engine = SelectionEngine(app, timeout=0.1)
+    started, release = threading.Event(), threading.Event()
+
+    def stuck():
+        started.set()
+        release.wait(5)
+        return 'late'
+
+    def queued():
+        return 'never'
+
+    stuck_future = engine.submit(stuck)
+    assert started.wait(5)
+    # Still queued behind the stuck command: withdrawn, never applied
+    with pytest.raises(db.SelectionError) as error:
+        engine.run(queued)
+    assert error.value.status_code == 503
+    assert '未执行' in str(error.value)
+    # Already running: bounded second wait, then an unknown outcome
+    started.clear()
+    release.set()
+    assert stuck_future.result(5) == 'late'
+    release.clear()
+    begin = time.monotonic()
+    with pytest.raises(db.SelectionError) as error:
+        engine.run(stuck)
+    assert error.value.status_code == 503
+    assert '结果未知' in str(error.value)
+    assert time.monotonic() - begin < 1
+    release.set()
@@ -0,0 +1,122 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend import database as db
+from backend import lottery_engine
+from backend.selection_windows import SelectionWindows
+from conftest import seed_lottery, seed_users
+
+START = datetime(2030, 9, 1, 9, 0)
+
+
+def open_waves(conn, lottery_id, start=START, wave_size=2, interval=30):
+    conn.execute(
+        'UPDATE lottery_settings SET selection_start = ?, selection_wave_size = ?, selection_wave_interval = ? WHERE id = ?',
+        (start.isoformat(), wave_size, interval, lottery_id)
+    )
+    conn.commit()
+
+
+def test_waves_follow_lottery_numbers(app, conn):
+    user_ids = seed_users(conn, 6)
+    lottery_id = seed_lottery(conn)
+    open_waves(conn, lottery_id)
+    # Ranks 1..5 for the first five students; the sixth was not drawn
+    conn.executemany('INSERT INTO lottery_results (user_id, lottery_id, lottery_number) VALUES (?, ?, ?)',
+                     [(user_id, lottery_id, rank) for rank, user_id in enumerate(user_ids[:5], 1)])
+    conn.commit()
+    windows = SelectionWindows()
+    assert [windows.opens_at(user_id) for user_id in user_ids] == [
+        (START, 1), (START, 2),
+        (START + timedelta(minutes=30), 3), (START + timedelta(minutes=30), 4),
+        (START + timedelta(minutes=60), 5),
+        (START + timedelta(minutes=90), None),  # after the last wave
+    ]
+    with pytest.raises(db.SelectionError) as error:
+        windows.check(user_ids[0])
+    assert error.value.status_code == 403
+
+
+def test_unpublished_or_unscheduled_lotteries_do_not_restrict(app, conn):
+    user_id, = seed_users(conn, 1)
+    open_waves(conn, seed_lottery(conn, published=False))
+    seed_lottery(conn)
+    windows = SelectionWindows()
+    assert windows.opens_at(user_id) is None
+    windows.check(user_id)
+
+
+def test_compact_draw_ranks_match_the_materialized_rows(app, conn):
+    user_ids = seed_users(conn, 9)
+    lottery_id = seed_lottery(conn)
+    open_waves(conn, lottery_id, wave_size=3)
+    lottery_engine.draw_compact(conn, lottery_id, user_ids, [('4', 8, 4, '4-')], seed=5)
+    conn.commit()
+    compact = {user_id: SelectionWindows().opens_at(user_id) for user_id in user_ids}
+    lottery_engine.materialize(conn, lottery_id)
+    conn.commit()
+    stored = {user_id: SelectionWindows().opens_at(user_id) for user_id in user_ids}
+    assert compact == stored
+    # Eight positions were allocated; the ninth student waits for the last wave
+    assert sorted(rank for opens_at, rank in compact.values() if rank) == list(range(1, 9))
+    assert sorted(compact.values(), key=lambda window: window[1] or 99)[-1] == (START + timedelta(minutes=90), None)
+
+
+def test_invalidate_picks_up_new_settings(app, conn):
+    user_id, = seed_users(conn, 1)
+    windows = SelectionWindows(refresh_interval=3600)
+    assert windows.opens_at(user_id) is None
+    lottery_id = seed_lottery(conn)
+    open_waves(conn, lottery_id)
+    # Cached until invalidated
+    assert windows.opens_at(user_id) is None
+    windows.invalidate()
+    assert windows.opens_at(user_id) == (START, None)
+
+
+def test_one_thread_reloads_at_a_time():
+    windows = SelectionWindows(refresh_interval=0.05)
+    loads = []
+
+    def slow_load():
+        loads.append(1)
+        time.sleep(0.2)
+        return [len(loads)]
+
+    windows._load = slow_load
+
+    def read_concurrently():
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(windows._current())) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    # Before the first load everyone waits for the single loader
+    assert read_concurrently() == [[1]] * 20
+    assert len(loads) == 1
+    # Once expired, readers keep the old map while one thread reloads
+    time.sleep(0.1)
+    results = read_concurrently()
+    assert len(loads) == 2
+    assert {tuple(result) for result in results} <= {(1,), (2,)}
+    assert [2] in results
+
+
+def test_failed_reload_propagates_and_frees_the_loader():
+    windows = SelectionWindows()
+
+    def failing_load():
+        raise RuntimeError('boom')
+
+    windows._load = failing_load
+    with pytest.raises(RuntimeError):
+        windows._current()
+    assert not windows.loading
+    windows._load = lambda: []
+    assert windows.opens_at(1) is None